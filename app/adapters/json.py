@@ -4,15 +4,45 @@ import warnings
 
 from app import app
 from app.config import ProtocolKey, ResponseStatus
-from app.modules import (brand, brand_report, common,
-                         country, country_dialing_code, locality,
+from app.modules import (autocomplete, brand, brand_report, common,
+                         country, country_dialing_code, federated_search, locality,
                          product, product_color, product_material,
-                         product_report, store, store_product,
+                         product_report, reference_data, stats, store, store_map, store_product,
                          store_report, user, user_account,
                          user_account_report, user_account_session, user_phone_number_verification_code)
+from app.modules.user_account import UserAccount
 from app.modules.user_account_session import UserAccountSession
 
 
+def _admin_required(func):
+    """
+    [DECORATOR] Like _auth_required, but the session must also belong to
+    an admin account. Admin rights are read from the database rather than
+    the session cache so a revoked admin loses access straight away.
+    """
+
+    @functools.wraps(func)
+    @_auth_required
+    def wrapper_admin_required(*args, **kwargs):
+        session_id = request.cookies.get(ProtocolKey.USER_ACCOUNT_SESSION_ID.value)
+        user_account = UserAccount.get_by_session(session_id)
+
+        if user_account and UserAccount.is_admin(user_account.id):
+            value = func(*args, **kwargs)
+        else:
+            error = {
+                ProtocolKey.ERROR: {
+                    ProtocolKey.ERROR_CODE: ResponseStatus.FORBIDDEN.value,
+                    ProtocolKey.ERROR_MESSAGE: "Only admins can perform this function.",
+                }
+            }
+            value = make_response(error, _map_response_status(ResponseStatus.FORBIDDEN))
+
+        return value
+
+    return wrapper_admin_required
+
+
 def _auth_required(func):
     """
     [DECORATOR] Makes sure a valid session exists for the user
@@ -97,6 +127,24 @@ def _map_response_status(response_status: ResponseStatus) -> int:
     return ret
 
 
+def _make_preserialized_response(serialized: reference_data.SerializedBody) -> Response:
+    """
+    Serves a body that was serialized ahead of time, answering with 304
+    Not Modified when the client already holds this version of it.
+    """
+
+    if request.if_none_match.contains(serialized.etag):
+        http_response = Response(status=304)
+    else:
+        http_response = Response(serialized.body, status=200, mimetype="application/json")
+
+    http_response.set_etag(serialized.etag)
+    # Cacheable, but clients must check it's still current before reuse.
+    http_response.headers["Cache-Control"] = "no-cache"
+
+    return http_response
+
+
 def _stub(func):
     """
     [DECORATOR]
@@ -344,9 +392,31 @@ def get_brand() -> Response:
 def get_brands() -> Response:
     user_account_session.update_session()
 
+    cursor = request.form.get(ProtocolKey.CURSOR)
+    page_size = request.form.get(ProtocolKey.PAGE_SIZE)
     query = request.form.get(ProtocolKey.QUERY)
 
-    service_response = brand.get_brands(query)
+    service_response = brand.get_brands(query, cursor=cursor, page_size=page_size)
+    http_response = make_response(service_response[0], _map_response_status(service_response[1]))
+
+    return http_response
+
+
+@_auth_required
+def get_brands_by_tags() -> Response:
+    user_account_session.update_session()
+
+    cursor = request.form.get(ProtocolKey.CURSOR)
+    match = request.form.get(ProtocolKey.MATCH)
+    page_size = request.form.get(ProtocolKey.PAGE_SIZE)
+    tags = request.form.get(ProtocolKey.TAGS)
+
+    service_response = brand.get_brands_by_tags(
+        tags=tags,
+        match=match,
+        cursor=cursor,
+        page_size=page_size
+    )
     http_response = make_response(service_response[0], _map_response_status(service_response[1]))
 
     return http_response
@@ -355,8 +425,8 @@ def get_brands() -> Response:
 def get_country_list() -> Response:
     is_enabled = request.form.get(ProtocolKey.IS_ENABLED)
 
-    service_response = country.get_all(is_enabled)
-    http_response = make_response(service_response[0], _map_response_status(service_response[1]))
+    service_response = country.get_all_serialized(is_enabled)
+    http_response = _make_preserialized_response(service_response)
 
     return http_response
 
@@ -364,8 +434,8 @@ def get_country_list() -> Response:
 def get_dialing_code_list() -> Response:
     is_enabled = request.form.get(ProtocolKey.IS_ENABLED)
 
-    service_response = country_dialing_code.get_all(is_enabled)
-    http_response = make_response(service_response[0], _map_response_status(service_response[1]))
+    service_response = country_dialing_code.get_all_serialized(is_enabled)
+    http_response = _make_preserialized_response(service_response)
 
     return http_response
 
@@ -374,9 +444,10 @@ def get_dialing_code_list() -> Response:
 def get_localities() -> Response:
     user_account_session.update_session()
 
+    alpha_2_code = request.form.get(ProtocolKey.ALPHA_2_CODE)
     query = request.form.get(ProtocolKey.QUERY)
 
-    service_response = locality.get_localities(query)
+    service_response = locality.get_localities(query, alpha_2_code=alpha_2_code)
     http_response = make_response(service_response[0], _map_response_status(service_response[1]))
 
     return http_response
@@ -400,27 +471,29 @@ def get_product() -> Response:
 
 @_auth_required
 def get_product_color_list() -> Response:
-    service_response = product_color.get_all()
-    http_response = make_response(service_response[0], _map_response_status(service_response[1]))
+    service_response = product_color.get_all_serialized()
+    http_response = _make_preserialized_response(service_response)
 
     return http_response
 
 
 @_auth_required
 def get_product_material_list() -> Response:
-    service_response = product_material.get_all()
-    http_response = make_response(service_response[0], _map_response_status(service_response[1]))
+    service_response = product_material.get_all_serialized()
+    http_response = _make_preserialized_response(service_response)
 
     return http_response
 
 
 def get_product_variants() -> Response:
+    cursor = request.form.get(ProtocolKey.CURSOR)
     offset = request.form.get(ProtocolKey.OFFSET)
     parent_product_id = request.form.get(ProtocolKey.PARENT_PRODUCT_ID)
 
     service_response = product.get_product_variants(
         offset=offset,
-        parent_product_id=parent_product_id
+        parent_product_id=parent_product_id,
+        cursor=cursor
     )
     http_response = make_response(service_response[0], _map_response_status(service_response[1]))
 
@@ -432,17 +505,51 @@ def get_products() -> Response:
     user_account_session.update_session()
 
     brand_id = request.form.get(ProtocolKey.BRAND_ID)
+    cursor = request.form.get(ProtocolKey.CURSOR)
+    page_size = request.form.get(ProtocolKey.PAGE_SIZE)
     query = request.form.get(ProtocolKey.QUERY)
 
     service_response = product.get_products(
         brand_id=brand_id,
-        query=query
+        query=query,
+        cursor=cursor,
+        page_size=page_size
+    )
+    http_response = make_response(service_response[0], _map_response_status(service_response[1]))
+
+    return http_response
+
+
+@_auth_required
+def get_products_by_tags() -> Response:
+    user_account_session.update_session()
+
+    cursor = request.form.get(ProtocolKey.CURSOR)
+    match = request.form.get(ProtocolKey.MATCH)
+    page_size = request.form.get(ProtocolKey.PAGE_SIZE)
+    tags = request.form.get(ProtocolKey.TAGS)
+
+    service_response = product.get_products_by_tags(
+        tags=tags,
+        match=match,
+        cursor=cursor,
+        page_size=page_size
     )
     http_response = make_response(service_response[0], _map_response_status(service_response[1]))
 
     return http_response
 
 
+@_admin_required
+def get_stats() -> Response:
+    user_account_session.update_session()
+
+    service_response = stats.get_stats()
+    http_response = make_response(service_response[0], _map_response_status(service_response[1]))
+
+    return http_response
+
+
 @_auth_required
 def get_store() -> Response:
     user_account_session.update_session()
@@ -459,6 +566,28 @@ def get_store() -> Response:
     return http_response
 
 
+@_auth_required
+def get_store_map() -> Response:
+    user_account_session.update_session()
+
+    max_latitude = request.form.get(ProtocolKey.MAX_LATITUDE)
+    max_longitude = request.form.get(ProtocolKey.MAX_LONGITUDE)
+    min_latitude = request.form.get(ProtocolKey.MIN_LATITUDE)
+    min_longitude = request.form.get(ProtocolKey.MIN_LONGITUDE)
+    zoom = request.form.get(ProtocolKey.ZOOM)
+
+    service_response = store_map.get_store_map(
+        min_latitude=min_latitude,
+        min_longitude=min_longitude,
+        max_latitude=max_latitude,
+        max_longitude=max_longitude,
+        zoom=zoom
+    )
+    http_response = make_response(service_response[0], _map_response_status(service_response[1]))
+
+    return http_response
+
+
 @_auth_required
 def get_store_product() -> Response:
     user_account_session.update_session()
@@ -487,14 +616,36 @@ def get_store_products() -> Response:
 def get_stores() -> Response:
     user_account_session.update_session()
 
+    cursor = request.form.get(ProtocolKey.CURSOR)
+    page_size = request.form.get(ProtocolKey.PAGE_SIZE)
     query = request.form.get(ProtocolKey.QUERY)
     latitude = request.form.get(ProtocolKey.LATITUDE)
     longitude = request.form.get(ProtocolKey.LONGITUDE)
+    radius = request.form.get(ProtocolKey.RADIUS)
 
     service_response = store.get_stores(
         query=query,
         latitude=latitude,
-        longitude=longitude
+        longitude=longitude,
+        radius=radius,
+        cursor=cursor,
+        page_size=page_size
+    )
+    http_response = make_response(service_response[0], _map_response_status(service_response[1]))
+
+    return http_response
+
+
+@_auth_required
+def get_suggestions() -> Response:
+    user_account_session.update_session()
+
+    entity_type = request.form.get(ProtocolKey.TYPE)
+    query = request.form.get(ProtocolKey.QUERY)
+
+    service_response = autocomplete.get_suggestions(
+        query=query,
+        entity_type=entity_type
     )
     http_response = make_response(service_response[0], _map_response_status(service_response[1]))
 
@@ -521,9 +672,10 @@ def get_user_account() -> Response:
 def get_user_accounts() -> Response:
     user_account_session.update_session()
 
+    cursor = request.form.get(ProtocolKey.CURSOR)
     query = request.form.get(ProtocolKey.QUERY)
 
-    service_response = user_account.get_accounts(query)
+    service_response = user_account.get_accounts(query, cursor=cursor)
     http_response = make_response(service_response[0], _map_response_status(service_response[1]))
 
     return http_response
@@ -726,6 +878,18 @@ def report_user_account() -> Response:
     return http_response
 
 
+@_auth_required
+def search() -> Response:
+    user_account_session.update_session()
+
+    query = request.form.get(ProtocolKey.QUERY)
+
+    service_response = federated_search.search(query)
+    http_response = make_response(service_response[0], _map_response_status(service_response[1]))
+
+    return http_response
+
+
 def send_verification_code() -> Response:
     alpha_2_code = request.form.get(ProtocolKey.ALPHA_2_CODE)
     dialing_code = request.form.get(ProtocolKey.DIALING_CODE)
@@ -29,28 +29,83 @@ class Configuration:
     ALLOWED_AVATAR_FILE_EXTENSIONS = frozenset(["gif", "jpeg", "jpg", "png"])
     ALLOWED_PRODUCT_MEDIA_FILE_EXTENSIONS = frozenset(["gif", "jpeg", "jpg", "png"])
     APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+    ARP_TABLE_REFRESH_INTERVAL = int(os.getenv("ARP_TABLE_REFRESH_INTERVAL", "30"))  # Seconds
     ATTRIBUTION_MAX_LEN = 512
+    AUTOCOMPLETE_QUERY_MIN_LEN = 2
+    AUTOCOMPLETE_RESULT_LIMIT = 5  # Suggestions per entity type
+    AUTOCOMPLETE_TIMEOUT = 200  # Milliseconds
     AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
     AWS_EC2_PROD_DATABASE_HOST = os.getenv("AWS_EC2_PROD_DATABASE_HOST")
     AWS_EC2_PROD_PASSWORD = os.getenv("AWS_EC2_PROD_PASSWORD")
+    AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")  # Optional, e.g. a local MinIO or moto server
+    AWS_S3_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_S3_MAX_POOL_CONNECTIONS", "32"))  # Per worker process
     AWS_S3_MEDIA_BUCKET_NAME = os.getenv("AWS_S3_MEDIA_BUCKET_NAME")
+    AWS_S3_MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes
+    AWS_S3_MULTIPART_CONCURRENCY = 4  # Parts in flight per upload
+    AWS_S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024  # Bytes
+    AWS_S3_UPLOAD_CONCURRENCY = int(os.getenv("AWS_S3_UPLOAD_CONCURRENCY", "8"))  # Uploads in flight per worker process
     AWS_REGION = os.getenv("AWS_REGION", "eu-west-2")
     AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+    BRAND_CACHE_MAX_SIZE = 2000  # Brands per worker
+    BRAND_CACHE_TTL = 300  # Seconds
     DATABASE_NAME = os.getenv("DATABASE_NAME", "971town")
+    DATABASE_POOL_HEALTH_CHECK_INTERVAL = int(os.getenv("DATABASE_POOL_HEALTH_CHECK_INTERVAL", "30"))  # Seconds idle before a ping
+    DATABASE_POOL_MAX_LIFETIME = int(os.getenv("DATABASE_POOL_MAX_LIFETIME", "1800"))  # Seconds
+    DATABASE_POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", "10"))  # Per worker process
+    DATABASE_POOL_MIN_SIZE = int(os.getenv("DATABASE_POOL_MIN_SIZE", "1"))  # Per worker process
+    DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "5"))  # Seconds
     DATABASE_USER = os.getenv("DATABASE_USER", "postgres")
     DEBUG = os.getenv("FLASK_DEBUG", "0") == "1"
     DESCRIPTION_MAX_LEN = 512
+    GEOIP_CACHE_MAX_SIZE = 10000  # IP addresses per worker
+    GEOIP_RELOAD_CHECK_INTERVAL = 60  # Seconds between checks for an updated database file
+    LOCALITY_RESULT_LIMIT = 20
+    MEDIA_BUFFER_MAX_SIZE = 8 * 1024 * 1024  # Bytes of an image kept in memory before spilling to disk
+    MEDIA_DERIVATIVE_FORMATS = ("avif", "webp", "jpeg")  # Formats Pillow can't write here are skipped
+    MEDIA_DERIVATIVE_QUALITY = 80
+    MEDIA_DERIVATIVE_WIDTHS = (160, 320, 640, 1280)  # Pixels; only those narrower than the original
+    MEDIA_QUEUE_MAX_ATTEMPTS = 5  # Per upload, before it's marked as failed
+    MEDIA_QUEUE_RETRY_DELAY = 10  # Seconds, multiplied by the attempt count
+    MEDIA_QUEUE_WORKERS = int(os.getenv("MEDIA_QUEUE_WORKERS", "2"))  # Threads per worker process
+    MAC_ADDRESS_LOOKUP_BEHIND_PROXY = os.getenv("MAC_ADDRESS_LOOKUP_BEHIND_PROXY", "0") == "1"
     NAME_MAX_LEN = 128
+    PAGE_SIZE = 20  # Default results per page
+    PAGE_SIZE_MAX = 100
+    PRODUCT_CACHE_MAX_SIZE = 5000  # Products per worker
+    PRODUCT_CACHE_TTL = 120  # Seconds
     PRODUCT_MEDIA_MAX_COUNT = 6
+    REDIS_TIMEOUT = 0.5  # Seconds
+    REDIS_URL = os.getenv("REDIS_URL")  # Optional shared cache, e.g. redis://localhost:6379/0
+    SEARCH_CACHE_MAX_SIZE = 1000  # Responses per search per worker
+    SEARCH_CACHE_TTL = 30  # Seconds
+    SEARCH_QUOTA_PER_TYPE = 10  # Results per entity type
+    SEARCH_RESULT_LIMIT = 20
     SERVICE_NAME = "971town"
+    SESSION_ACTIVITY_FLUSH_INTERVAL = int(os.getenv("SESSION_ACTIVITY_FLUSH_INTERVAL", "30"))  # Seconds
+    SESSION_CACHE_MAX_SIZE = 10000  # Sessions per worker
+    SESSION_CACHE_TTL = 60  # Seconds
+    STORE_CACHE_MAX_SIZE = 2000  # Stores per worker
+    STORE_CACHE_TTL = 300  # Seconds
+    STORE_MAP_CACHE_MAX_SIZE = 5000  # Tiles per worker
+    STORE_MAP_CACHE_TTL = 600  # Seconds
+    STORE_MAP_CLUSTER_GRID = 3  # Clusters per tile side = 2 ** this
+    STORE_MAP_CLUSTER_ZOOM = 15  # Lowest zoom level showing individual stores
+    STORE_MAP_MAX_TILES = 16  # Per viewport
+    STORE_MAP_ZOOM_LEVELS = (0, 3, 6, 9, 12, 15)  # Zoom 0 is one tile, so any viewport fits
+    STORE_NEARBY_RADIUS = 1000  # Meters
+    STORE_NEARBY_RADIUS_MAX = 25000  # Meters
+    TAG_COUNT_CACHE_TTL = 300  # Seconds
     TAG_ILLEGAL_CHARACTERS = frozenset(string.punctuation)
     TAG_MAX_COUNT = 64  # Tags in total
     TAG_MAX_LEN = 64    # Characters per tag
+    TAG_QUERY_MAX_COUNT = 10  # Tags per by-tags query
     TESTING_OTP = os.getenv("TESTING_OTP")  # Only used in development
     TESTING_PHONE_NUMBER = os.getenv("TESTING_PHONE_NUMBER")  # Only used in development
     TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
     TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
     URL_MAX_LEN = 512
+    USER_ACCOUNT_CACHE_MAX_SIZE = 5000  # Accounts per worker
+    USER_ACCOUNT_CACHE_TTL = 300  # Seconds
     USER_ACCOUNT_MAX_COUNT = 10
     USER_VERIFICATION_CODE_ATTEMPT_LIMIT = 3
     USER_VERIFICATION_CODE_LEN = 6
@@ -61,6 +116,8 @@ class Configuration:
     MEDIA_DIR = os.path.join(STATIC_DIR, "media")
     BRAND_MEDIA_DIR = os.path.join(MEDIA_DIR, "brand")
     PRODUCT_MEDIA_DIR = os.path.join(MEDIA_DIR, "product")
+    # Uploads waiting to be processed. Must survive restarts, so not /tmp.
+    MEDIA_SPOOL_DIR = os.getenv("MEDIA_SPOOL_DIR", os.path.join(APP_ROOT, "spool", "media"))
 
 
 class ContentVisibility(IntEnum):
@@ -85,6 +142,7 @@ class DatabaseTable(str, Enum):
     COUNTRY_DIALING_CODE = "country_dialing_code_"
     CURRENCY = "currency_"
     LOCALITY = "locality_"
+    MEDIA_BLOB = "media_blob_"
     PRODUCT = "product_"
     PRODUCT_COLOR = "product_color_"
     PRODUCT_EDIT_HISTORY = "product_edit_history_"
@@ -92,6 +150,7 @@ class DatabaseTable(str, Enum):
     PRODUCT_MATERIAL = "product_material_"
     PRODUCT_MEDIUM = "product_medium_"
     PRODUCT_REPORT = "product_report_"
+    PRODUCT_SEARCH = "product_search_"
     PRODUCT_TAG = "product_tag_"
     PRODUCT_VIEW = "product_view_"
     PRODUCT_VOTE = "product_vote_"
@@ -130,6 +189,8 @@ class EntityType(IntEnum):
     PRODUCT = 2
     STORE = 3
     USER_ACCOUNT = 4
+    LOCALITY = 5
+    TAG = 6
 
 
 class Field(IntEnum):
@@ -177,6 +238,12 @@ class MediaMode(IntEnum):
     LIGHT = 2
 
 
+class MediaStatus(IntEnum):
+    PENDING = 1  # Accepted, still being processed
+    READY = 2
+    FAILED = 3
+
+
 class MediaType(IntEnum):
     IMAGE = 1
     VIDEO = 2
@@ -208,6 +275,7 @@ class ProtocolKey(str, Enum):
     ATTRIBUTION = "attribution"
     AVATAR = "avatar"
     AVATAR_DARK_MODE_FILE_PATH = "avatar_dark_path"
+    AVATAR_LIGHT_MODE_DERIVATIVES = "avatar_light_derivatives"
     AVATAR_LIGHT_MODE_FILE_PATH = "avatar_light_path"
     BIO = "bio"
     BRAND = "brand"
@@ -217,6 +285,7 @@ class ProtocolKey(str, Enum):
     CLIENT = "client"
     CLIENT_ID = "client_id"
     CLIENT_VERSION = "client_version"
+    CLUSTERS = "clusters"
     CODE = "code"
     COMMENT = "comment"
     CONDITION = "condition"
@@ -225,20 +294,26 @@ class ProtocolKey(str, Enum):
     COORDINATES = "coordinates"
     COORDINATES_TEXT = "coordinates_txt"
     COUNTRIES = "countries"
+    COUNT = "count"
     COUNTRY = "country"
     CREATION_TIMESTAMP = "creation_timestamp"
     CREATOR = "creator"
     CREATOR_ID = "creator_id"
     CURRENCY = "currency"
     CURRENCY_CODE = "currency_code"
+    CURSOR = "cursor"
     DIALING_CODE = "dialing_code"
     DIALING_CODE_ID = "dialing_code_id"
     DIALING_CODES = "dialing_codes"
+    DERIVATIVES = "derivatives"
     DESCRIPTION = "description"
     DEVICE_NAME = "device_name"
     DEVICE_TYPE = "device_type"
+    DISTANCE = "distance"
+    DOCUMENT = "document"
     EDIT_ACCESS_LEVEL = "edit_access_level"
     EDITOR_ID = "editor_id"
+    ENTITY_ID = "entity_id"
     ENTITY_TYPE = "entity_type"
     ERROR = "error"
     ERROR_CODE = "error_code"
@@ -247,6 +322,8 @@ class ProtocolKey(str, Enum):
     FIELD_VALUE = "field_value"
     FILE_PATH = "file_path"
     FLOOR = "floor"
+    HASH = "hash"
+    HEIGHT = "height"
     HEX = "hex"
     ID = "id"
     IDENTITY = "identity"
@@ -267,15 +344,23 @@ class ProtocolKey(str, Enum):
     MAC_ADDRESS = "mac_address"
     MAIN_COLOR = "main_color"
     MAIN_COLOR_CODE = "main_color_code"
+    MATCH = "match"
     MATERIAL = "material"
     MATERIAL_ID = "material_id"
+    MAX_LATITUDE = "max_latitude"
+    MAX_LONGITUDE = "max_longitude"
     MEDIA = "media"
     MEDIA_MODE = "media_mode"
     MEDIA_TYPE = "media_type"
+    MEDIUM_ID = "medium_id"
+    MIME_TYPE = "mime_type"
+    MIN_LATITUDE = "min_latitude"
+    MIN_LONGITUDE = "min_longitude"
     MOBILE_CARRIER = "mobile_carrier"
     NAME = "name"
     NAME_CLEAN = "name_clean"
     NAME_LOWERCASE = "name_lc"
+    NEXT_CURSOR = "next_cursor"
     NUMERIC_3_CODE = "numeric_3_code"
     FULL_NAME = "full_name"
     OFFSET = "offset"
@@ -283,6 +368,7 @@ class ProtocolKey(str, Enum):
     OS_ID = "os_id"
     OS_VERSION = "os_version"
     OVERRIDES_DISPLAY_NAME = "display_name_override"
+    PAGE_SIZE = "page_size"
     PARENT_PRODUCT = "parent_product"
     PARENT_PRODUCT_ID = "parent_product_id"
     PASSWORD = "password"
@@ -302,12 +388,16 @@ class ProtocolKey(str, Enum):
     PRODUCT_VARIANTS = "product_variants"
     PRODUCTS = "products"
     QUERY = "query"
+    RADIUS = "radius"
+    REF_COUNT = "ref_count"
     RELEASE_TIMESTAMP = "release_timestamp"
     REP = "rep"
     REPORTER = "reporter"
     REPORTER_ID = "reporter_id"
+    RESULTS = "results"
     SCREEN_RESOLUTION = "screen_resolution"
     SESSIONS = "sessions"
+    STATS = "stats"
     STATUS = "status"
     STORE = "store"
     STORE_ID = "store_id"
@@ -316,10 +406,13 @@ class ProtocolKey(str, Enum):
     STORE_PRODUCTS = "store_products"
     STORES = "stores"
     STREET = "street"
+    SUGGESTIONS = "suggestions"
     SYMBOL = "symbol"
     TAGS = "tags"
     TAG_ID = "tag_id"
     TIME_ZONE = "time_zone"
+    TOTAL_COUNT = "total_count"
+    TOTAL_COUNT_IS_ESTIMATE = "total_count_is_estimate"
     TYPE = "type"
     UNIT = "unit"
     UPC = "upc"
@@ -336,6 +429,8 @@ class ProtocolKey(str, Enum):
     VERSION = "version"
     VISIBILITY = "visibility"
     WEBSITE = "website"
+    WIDTH = "width"
+    ZOOM = "zoom"
 
 
 class ResponseStatus(IntEnum):
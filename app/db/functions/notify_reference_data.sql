@@ -0,0 +1,40 @@
+-- Tell every app worker to reload its reference data snapshot whenever
+-- one of the reference tables changes.
+CREATE OR REPLACE FUNCTION notify_reference_data()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('reference_data', TG_TABLE_NAME);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notify_reference_data ON continent_;
+CREATE TRIGGER notify_reference_data
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON continent_
+FOR EACH STATEMENT EXECUTE FUNCTION notify_reference_data();
+
+DROP TRIGGER IF EXISTS notify_reference_data ON country_;
+CREATE TRIGGER notify_reference_data
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON country_
+FOR EACH STATEMENT EXECUTE FUNCTION notify_reference_data();
+
+DROP TRIGGER IF EXISTS notify_reference_data ON country_dialing_code_;
+CREATE TRIGGER notify_reference_data
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON country_dialing_code_
+FOR EACH STATEMENT EXECUTE FUNCTION notify_reference_data();
+
+DROP TRIGGER IF EXISTS notify_reference_data ON currency_;
+CREATE TRIGGER notify_reference_data
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON currency_
+FOR EACH STATEMENT EXECUTE FUNCTION notify_reference_data();
+
+DROP TRIGGER IF EXISTS notify_reference_data ON product_color_;
+CREATE TRIGGER notify_reference_data
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON product_color_
+FOR EACH STATEMENT EXECUTE FUNCTION notify_reference_data();
+
+DROP TRIGGER IF EXISTS notify_reference_data ON product_material_;
+CREATE TRIGGER notify_reference_data
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON product_material_
+FOR EACH STATEMENT EXECUTE FUNCTION notify_reference_data();
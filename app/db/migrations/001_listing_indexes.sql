@@ -0,0 +1,26 @@
+-- Indexes backing the keyset-paginated brand and product listings. Each
+-- one matches the ORDER BY (and keyset comparison) of a listing query so
+-- a page is read straight off the index instead of sorting every row.
+--
+-- CONCURRENTLY can't run inside a transaction block; run this file with
+-- psql as is (autocommit), not wrapped in BEGIN/COMMIT.
+
+-- Brand.get_all() without a query: ORDER BY name, id.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS brand_name_id_idx
+    ON public.brand_ USING btree (name, id)
+    WHERE visibility NOT IN (2, 3, 4);
+
+-- Product.get_all(brand_id=...): ORDER BY COALESCE(name, ''), id within a brand.
+-- Also serves the per-brand product counts.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_brand_id_name_id_idx
+    ON public.product_ USING btree (brand_id, (COALESCE(name, '')), id)
+    WHERE parent_product_id IS NULL;
+
+-- Product.get_all_variants().
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_parent_product_id_idx
+    ON public.product_ USING btree (parent_product_id, (COALESCE(name, '')), id)
+    WHERE parent_product_id IS NOT NULL;
+
+-- Product.get_all_by_user().
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_creator_id_idx
+    ON public.product_ USING btree (creator_id);
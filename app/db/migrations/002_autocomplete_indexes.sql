@@ -0,0 +1,47 @@
+-- Indexes backing get-suggestions (typeahead). Every expression and
+-- partial-index predicate here matches autocomplete.Suggestion's queries
+-- exactly; change them together.
+--
+-- CONCURRENTLY can't run inside a transaction block; run this file with
+-- psql as is (autocommit), not wrapped in BEGIN/COMMIT.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Prefix matches: C collation makes LIKE 'abc%' an index range scan and
+-- lets the results come back in index order.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS brand_name_prefix_idx
+    ON public.brand_ USING btree ((LOWER(name)) COLLATE "C", id)
+    WHERE visibility NOT IN (2, 3, 4);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS locality_name_clean_prefix_idx
+    ON public.locality_ USING btree ((name_clean) COLLATE "C", id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_name_prefix_idx
+    ON public.product_ USING btree ((LOWER(name)) COLLATE "C", id)
+    WHERE visibility NOT IN (2, 3, 4);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS store_name_prefix_idx
+    ON public.store_ USING btree ((LOWER(name)) COLLATE "C", id)
+    WHERE visibility NOT IN (2, 3, 4);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tag_name_prefix_idx
+    ON public.tag_ USING btree ((LOWER(name)) COLLATE "C", id);
+
+-- Substring and approximate matches (LIKE '%abc%', <%).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS brand_name_trgm_idx
+    ON public.brand_ USING gin ((LOWER(name)) gin_trgm_ops)
+    WHERE visibility NOT IN (2, 3, 4);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS locality_name_clean_trgm_idx
+    ON public.locality_ USING gin (name_clean gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_name_trgm_idx
+    ON public.product_ USING gin ((LOWER(name)) gin_trgm_ops)
+    WHERE visibility NOT IN (2, 3, 4);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS store_name_trgm_idx
+    ON public.store_ USING gin ((LOWER(name)) gin_trgm_ops)
+    WHERE visibility NOT IN (2, 3, 4);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tag_name_trgm_idx
+    ON public.tag_ USING gin ((LOWER(name)) gin_trgm_ops);
@@ -0,0 +1,156 @@
+-- Denormalized product search documents. Each row holds a product along
+-- with its brand, parent product and tags, already in the shape
+-- Product.get_all() returns them, so a search is one index scan over
+-- product_search_ instead of joining JSON built from every brand and
+-- product row. Triggers on the source tables keep it up to date.
+--
+-- CONCURRENTLY can't run inside a transaction block; run this file with
+-- psql as is (autocommit), not wrapped in BEGIN/COMMIT.
+
+CREATE TABLE IF NOT EXISTS public.product_search_ (
+    id bigint NOT NULL PRIMARY KEY REFERENCES public.product_ (id) ON DELETE CASCADE,
+    alias character varying(64),
+    visibility smallint NOT NULL,
+    ts_name tsvector,
+    document jsonb NOT NULL
+);
+
+ALTER TABLE public.product_search_ OWNER TO postgres;
+
+-- Rebuilds the search documents of the given products. Products that no
+-- longer exist are left to the foreign key's cascade.
+CREATE OR REPLACE FUNCTION refresh_product_search(p_ids BIGINT[])
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO product_search_
+        (id, alias, visibility, ts_name, document)
+    SELECT
+        p.id,
+        p.alias,
+        p.visibility,
+        p.ts_name,
+        (ROW_TO_JSON(p)::jsonb - 'ts_name') || jsonb_build_object(
+            'brand', ROW_TO_JSON(b)::jsonb - 'ts_name',
+            'parent_product', ROW_TO_JSON(pp)::jsonb - 'ts_name',
+            'tags', COALESCE(
+                (
+                    SELECT
+                        jsonb_agg(ROW_TO_JSON(t)::jsonb - 'ts_name' ORDER BY t.name)
+                    FROM
+                        product_tag_ AS pt
+                    JOIN
+                        tag_ AS t
+                    ON
+                        t.id = pt.tag_id
+                    WHERE
+                        pt.product_id = p.id
+                ),
+                '[]'::jsonb
+            )
+        )
+    FROM
+        product_ AS p
+    LEFT JOIN
+        brand_ AS b
+    ON
+        b.id = p.brand_id
+    LEFT JOIN
+        product_ AS pp
+    ON
+        pp.id = p.parent_product_id
+    WHERE
+        p.id = ANY(p_ids)
+    ON CONFLICT (id) DO UPDATE SET
+        alias = EXCLUDED.alias,
+        visibility = EXCLUDED.visibility,
+        ts_name = EXCLUDED.ts_name,
+        document = EXCLUDED.document;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A product changed: its own document, and those of its variants, which
+-- embed it as their parent.
+CREATE OR REPLACE FUNCTION product_search_on_product()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_product_id BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        v_product_id := OLD.id;
+    ELSE
+        v_product_id := NEW.id;
+        PERFORM refresh_product_search(ARRAY[v_product_id]);
+    END IF;
+
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM refresh_product_search(ARRAY(SELECT id FROM product_ WHERE parent_product_id = v_product_id));
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION product_search_on_brand()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_product_search(ARRAY(SELECT id FROM product_ WHERE brand_id = OLD.id));
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION product_search_on_product_tag()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM refresh_product_search(ARRAY[OLD.product_id]);
+    ELSE
+        PERFORM refresh_product_search(ARRAY[NEW.product_id]);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION product_search_on_tag()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_product_search(ARRAY(SELECT product_id FROM product_tag_ WHERE tag_id = NEW.id));
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS product_search ON product_;
+CREATE TRIGGER product_search
+AFTER INSERT OR UPDATE OR DELETE ON product_
+FOR EACH ROW EXECUTE FUNCTION product_search_on_product();
+
+DROP TRIGGER IF EXISTS product_search ON brand_;
+CREATE TRIGGER product_search
+AFTER UPDATE OR DELETE ON brand_
+FOR EACH ROW EXECUTE FUNCTION product_search_on_brand();
+
+DROP TRIGGER IF EXISTS product_search ON product_tag_;
+CREATE TRIGGER product_search
+AFTER INSERT OR DELETE ON product_tag_
+FOR EACH ROW EXECUTE FUNCTION product_search_on_product_tag();
+
+DROP TRIGGER IF EXISTS product_search ON tag_;
+CREATE TRIGGER product_search
+AFTER UPDATE ON tag_
+FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+EXECUTE FUNCTION product_search_on_tag();
+
+-- Backfill. Safe to rerun: existing documents are rebuilt in place.
+SELECT refresh_product_search(ARRAY(SELECT id FROM product_));
+
+-- Product.get_all(query=...): full-text and alias matches on visible
+-- products, ranked by ts_rank.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_search_ts_name_idx
+    ON public.product_search_ USING gin (ts_name)
+    WHERE visibility NOT IN (2, 3, 4);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_search_alias_trgm_idx
+    ON public.product_search_ USING gin (alias gin_trgm_ops)
+    WHERE visibility NOT IN (2, 3, 4);
@@ -0,0 +1,14 @@
+-- Indexes backing get-brands-by-tags and get-products-by-tags. The
+-- primary keys of the tag link tables lead with the brand or product ID,
+-- which serves "tags of this product" but not "products with this tag";
+-- these are the inverted direction. Tag.membership_condition() and the
+-- per-tag counts read them without touching the link tables' heaps.
+--
+-- CONCURRENTLY can't run inside a transaction block; run this file with
+-- psql as is (autocommit), not wrapped in BEGIN/COMMIT.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS brand_tag_tag_id_brand_id_idx
+    ON public.brand_tag_ USING btree (tag_id, brand_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_tag_tag_id_product_id_idx
+    ON public.product_tag_ USING btree (tag_id, product_id);
@@ -0,0 +1,7 @@
+-- Product media are now accepted before they're processed: a medium is
+-- created pending and the media queue marks it ready (or failed) once
+-- its image has been converted and stored. Existing media are ready.
+-- Values follow MediaStatus in app/config.py.
+
+ALTER TABLE public.product_medium_
+    ADD COLUMN IF NOT EXISTS status smallint DEFAULT 2 NOT NULL;
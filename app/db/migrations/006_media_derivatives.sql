@@ -0,0 +1,10 @@
+-- Smaller and more compact renditions of each product medium and brand
+-- avatar, written by the media queue next to the full image. Each entry
+-- holds the rendition's file_path (also its S3 object key), mime_type,
+-- width and height.
+
+ALTER TABLE public.product_medium_
+    ADD COLUMN IF NOT EXISTS derivatives jsonb DEFAULT '[]'::jsonb NOT NULL;
+
+ALTER TABLE public.brand_
+    ADD COLUMN IF NOT EXISTS avatar_light_derivatives jsonb DEFAULT '[]'::jsonb NOT NULL;
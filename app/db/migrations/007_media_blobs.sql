@@ -0,0 +1,17 @@
+-- Content-addressed media storage. Each distinct upload, keyed by the
+-- SHA-256 of its bytes, is processed and stored once under a key shared
+-- by every product medium and brand avatar using it; ref_count tracks
+-- how many do, and its files are only deleted once none are left.
+-- status follows MediaStatus in app/config.py. Media stored before this
+-- table existed have no row here and are deleted directly.
+
+CREATE TABLE IF NOT EXISTS public.media_blob_ (
+    hash character(64) NOT NULL PRIMARY KEY,
+    file_path character varying NOT NULL UNIQUE,
+    derivatives jsonb DEFAULT '[]'::jsonb NOT NULL,
+    ref_count integer DEFAULT 1 NOT NULL,
+    status smallint DEFAULT 1 NOT NULL,
+    creation_timestamp timestamp without time zone DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+ALTER TABLE public.media_blob_ OWNER TO postgres;
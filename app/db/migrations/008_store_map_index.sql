@@ -0,0 +1,13 @@
+-- Store map tiles (store_map.Tile.load) select stores with a planar
+-- bounding box test on coordinates::geometry. The geography index can't
+-- serve it, and a geography envelope can't either: one spanning 180° of
+-- longitude or more, like the zoom 0 tile, is degenerate. The
+-- expression and predicate here match that query exactly; change them
+-- together.
+--
+-- CONCURRENTLY can't run inside a transaction block; run this file with
+-- psql as is (autocommit), not wrapped in BEGIN/COMMIT.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS store_coordinates_geometry_idx
+    ON public.store_ USING gist ((coordinates::geometry))
+    WHERE visibility NOT IN (2, 3, 4);
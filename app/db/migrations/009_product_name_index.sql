@@ -0,0 +1,10 @@
+-- Product.get_all() without a query or brand: ORDER BY COALESCE(name, ''),
+-- id. The listing doesn't join brands, so a page is read straight off
+-- this index; the expression and predicate match that query exactly.
+--
+-- CONCURRENTLY can't run inside a transaction block; run this file with
+-- psql as is (autocommit), not wrapped in BEGIN/COMMIT.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_name_id_idx
+    ON public.product_ USING btree ((COALESCE(name, '')), id)
+    WHERE parent_product_id IS NULL AND visibility NOT IN (2, 3, 4);
@@ -0,0 +1,19 @@
+-- The brand trigger from 003 rebuilt every search document of a brand's
+-- products on any UPDATE of brand_, including avatar and description
+-- edits that searches don't depend on. It now fires only when the name
+-- or visibility changes; Product.get_all() and get_all_by_tags() fill in
+-- the rest of each brand from the brand cache. WHEN can't refer to OLD
+-- and NEW for a DELETE, so deletes get a trigger of their own.
+
+DROP TRIGGER IF EXISTS product_search ON brand_;
+
+DROP TRIGGER IF EXISTS product_search_on_update ON brand_;
+CREATE TRIGGER product_search_on_update
+AFTER UPDATE OF name, visibility ON brand_
+FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name OR OLD.visibility IS DISTINCT FROM NEW.visibility)
+EXECUTE FUNCTION product_search_on_brand();
+
+DROP TRIGGER IF EXISTS product_search_on_delete ON brand_;
+CREATE TRIGGER product_search_on_delete
+AFTER DELETE ON brand_
+FOR EACH ROW EXECUTE FUNCTION product_search_on_brand();
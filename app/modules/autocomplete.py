@@ -0,0 +1,279 @@
+from typing import Any, TypeVar, Type
+
+from app.config import (Configuration, ContentVisibility, DatabaseTable,
+                        EntityType, ProtocolKey, ResponseStatus)
+from app.modules import db
+from app.modules.locality import Locality
+
+
+###########
+# CLASSES #
+###########
+
+
+T = TypeVar("T", bound="Suggestion")
+
+
+class Suggestion:
+    """
+    A lightweight search-as-you-type match: just enough for a client to
+    show it and fetch the full entity once it's picked.
+    """
+
+    # Per type: table, the (lowercase) expression matched against, the
+    # alias column if the entity has one, and extra filters.
+    SOURCES = {
+        EntityType.BRAND: (
+            DatabaseTable.BRAND,
+            f"LOWER({ProtocolKey.NAME})",
+            ProtocolKey.ALIAS,
+            f"AND {ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})"
+        ),
+        EntityType.LOCALITY: (
+            DatabaseTable.LOCALITY,
+            ProtocolKey.NAME_CLEAN,
+            None,
+            ""
+        ),
+        EntityType.PRODUCT: (
+            DatabaseTable.PRODUCT,
+            f"LOWER({ProtocolKey.NAME})",
+            ProtocolKey.ALIAS,
+            f"AND {ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})"
+        ),
+        EntityType.STORE: (
+            DatabaseTable.STORE,
+            f"LOWER({ProtocolKey.NAME})",
+            ProtocolKey.ALIAS,
+            f"AND {ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})"
+        ),
+        EntityType.TAG: (
+            DatabaseTable.TAG,
+            f"LOWER({ProtocolKey.NAME})",
+            None,
+            ""
+        )
+    }
+
+    def __init__(self,
+                 data: dict) -> None:
+        self.alias: str = None
+        self.id: int = 0
+        self.name: str = None
+        self.type: EntityType = None
+
+        if data:
+            if ProtocolKey.ALIAS in data:
+                self.alias: str = data[ProtocolKey.ALIAS]
+
+            if ProtocolKey.ID in data:
+                self.id: int = data[ProtocolKey.ID]
+
+            if ProtocolKey.NAME in data:
+                self.name: str = data[ProtocolKey.NAME]
+
+            if ProtocolKey.TYPE in data:
+                self.type = EntityType(data[ProtocolKey.TYPE])
+
+    def __eq__(self,
+               __o: object) -> bool:
+        ret = False
+
+        if isinstance(__o, type(self)) and \
+                self.type == __o.type and \
+                self.id == __o.id:
+            ret = True
+
+        return ret
+
+    def __hash__(self) -> int:
+        return hash((self.type, self.id))
+
+    def __repr__(self) -> str:
+        return f"{self.name} ({self.type.name if self.type else None} {self.id})"
+
+    @staticmethod
+    def _escape_like(value: str) -> str:
+        return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    @staticmethod
+    def _source_select(entity_type: EntityType,
+                       fuzzy: bool) -> str:
+        """
+        The query for one type's share of the suggestions. Short inputs
+        are prefix matches only, read in order straight off the C-collated
+        expression index. Longer ones also match anywhere in the name, or
+        approximately, through the trigram index, best matches first.
+        """
+
+        table, expression, alias, condition = Suggestion.SOURCES[entity_type]
+        param = "locality_" if entity_type == EntityType.LOCALITY else ""
+        prefix_match = f"{expression} COLLATE \"C\" LIKE %({param}prefix)s"
+
+        if fuzzy:
+            match = f"""
+                ({prefix_match}
+                OR {expression} LIKE %({param}contains)s
+                OR %({param}query)s <%% {expression})
+            """
+            order = f"""
+                {prefix_match} DESC,
+                word_similarity(%({param}query)s, {expression}) DESC,
+                LENGTH({expression}),
+                {ProtocolKey.ID}
+            """
+        else:
+            match = prefix_match
+            order = f"{expression} COLLATE \"C\", {ProtocolKey.ID}"
+
+        return f"""
+            (SELECT
+                {entity_type.value} AS {ProtocolKey.TYPE},
+                {ProtocolKey.ID},
+                {ProtocolKey.NAME},
+                {alias or "NULL"} AS {ProtocolKey.ALIAS}
+            FROM
+                {table}
+            WHERE
+                {match}
+                {condition}
+            ORDER BY
+                {order}
+            LIMIT
+                %(limit)s)
+        """
+
+    def as_dict(self) -> dict[ProtocolKey, Any]:
+        serialized = {
+            ProtocolKey.ID: self.id,
+            ProtocolKey.NAME: self.name,
+            ProtocolKey.TYPE: self.type.value
+        }
+
+        if self.alias:
+            serialized[ProtocolKey.ALIAS] = self.alias
+
+        return serialized
+
+    @classmethod
+    def get_all(cls: Type[T],
+                query: str,
+                entity_types: list[EntityType] = None,
+                limit: int = Configuration.AUTOCOMPLETE_RESULT_LIMIT) -> list[T]:
+        """
+        Returns up to limit suggestions per type, all fetched in a single
+        round trip. The query is capped by a statement timeout so a slow
+        plan can't hold up typing; it then simply returns nothing.
+        """
+
+        if not isinstance(query, str):
+            raise TypeError(f"Argument 'query' must be of type str, not {type(query)}.")
+
+        if len(query) < Configuration.AUTOCOMPLETE_QUERY_MIN_LEN:
+            raise ValueError(f"Argument 'query' must be at least {Configuration.AUTOCOMPLETE_QUERY_MIN_LEN} characters long.")
+
+        if not entity_types:
+            entity_types = list(Suggestion.SOURCES)
+
+        ret: list[T] = []
+        conn = None
+        cursor = None
+        query = query.lower()
+        locality_query = Locality.clean(query)
+        # Trigrams need at least three characters to narrow anything down.
+        fuzzy = len(query) >= 3
+        params = {
+            "contains": f"%{Suggestion._escape_like(query)}%",
+            "limit": limit,
+            "locality_contains": f"%{Suggestion._escape_like(locality_query)}%",
+            "locality_prefix": f"{Suggestion._escape_like(locality_query)}%",
+            "locality_query": locality_query,
+            "prefix": f"{Suggestion._escape_like(query)}%",
+            "query": query
+        }
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SET LOCAL statement_timeout = %s;
+                """,
+                (Configuration.AUTOCOMPLETE_TIMEOUT,)
+            )
+            cursor.execute(
+                " UNION ALL ".join(Suggestion._source_select(entity_type, fuzzy) for entity_type in entity_types),
+                params
+            )
+            results = cursor.fetchall()
+            # SET LOCAL lasts until the transaction ends, which on the
+            # request's shared connection is the end of the request. A
+            # query that times out is rolled back to its savepoint, which
+            # undoes the SET as well.
+            cursor.execute(
+                """
+                SET LOCAL statement_timeout = DEFAULT;
+                """
+            )
+            conn.commit()
+
+            for result in results:
+                ret.append(cls(result))
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
+
+####################
+# MODULE FUNCTIONS #
+####################
+
+
+def get_suggestions(query: str,
+                    entity_type: str = None) -> tuple[dict, ResponseStatus]:
+    if query:
+        query = query.strip()
+
+    if entity_type:
+        try:
+            entity_type = EntityType(int(entity_type))
+
+            if entity_type not in Suggestion.SOURCES:
+                entity_type = None
+        except ValueError:
+            entity_type = None
+    else:
+        entity_type = None
+
+    if not query or len(query) < Configuration.AUTOCOMPLETE_QUERY_MIN_LEN:
+        response_status = ResponseStatus.BAD_REQUEST
+        error_message = f"Invalid or missing parameter: 'query' must be at least {Configuration.AUTOCOMPLETE_QUERY_MIN_LEN} characters long."
+
+        response = {
+            ProtocolKey.ERROR: {
+                ProtocolKey.ERROR_CODE: response_status.value,
+                ProtocolKey.ERROR_MESSAGE: error_message
+            }
+        }
+    else:
+        response_status = ResponseStatus.OK
+        serialized = []
+        entity_types = [entity_type] if entity_type else None
+
+        results = Suggestion.get_all(query, entity_types=entity_types)
+
+        for result in results:
+            serialized.append(result.as_dict())
+
+        response = {
+            ProtocolKey.SUGGESTIONS: serialized
+        }
+
+    return (response, response_status)
@@ -1,24 +1,22 @@
 from datetime import datetime
 from dateutil import parser as date_parser
 from flask import request
-import hashlib
 import json
-import os
 from PIL import Image
 import re
 import string
 from typing import Any, TypeVar, Type
 from urllib.parse import urlparse
-from werkzeug.utils import secure_filename
 
-from app import app
 from app.config import (Configuration, ContentVisibility, DatabaseTable,
                         EditAccessLevel, EntityType, Field,
-                        MediaMode, ProtocolKey, ResponseStatus,
-                        UserAction)
-from app.modules import db
-from app.modules.s3 import s3
-from app.modules.tag import Tag
+                        MediaMode, MediaStatus, ProtocolKey,
+                        ResponseStatus, UserAction)
+from app.modules import cache, db, loader, media_queue
+from app.modules.common import Common, invalid_cursor
+from app.modules.media_blob import MediaBlob
+from app.modules.media_queue import MediaJob
+from app.modules.tag import Tag, get_tagged
 from app.modules.user_account import UserAccount
 
 
@@ -34,6 +32,7 @@ class Brand:
     def __init__(self,
                  data: dict) -> None:
         self.alias: str = None
+        self.avatar_light_derivatives: list[dict] = []
         self.avatar_light_path: str = None
         self.creation_timestamp: datetime = None
         self.creator: UserAccount = None
@@ -53,6 +52,9 @@ class Brand:
             if ProtocolKey.ALIAS in data:
                 self.alias: str = data[ProtocolKey.ALIAS]
 
+            if ProtocolKey.AVATAR_LIGHT_MODE_DERIVATIVES in data and data[ProtocolKey.AVATAR_LIGHT_MODE_DERIVATIVES]:
+                self.avatar_light_derivatives: list[dict] = data[ProtocolKey.AVATAR_LIGHT_MODE_DERIVATIVES]
+
             if ProtocolKey.AVATAR_LIGHT_MODE_FILE_PATH in data:
                 self.avatar_light_path: str = data[ProtocolKey.AVATAR_LIGHT_MODE_FILE_PATH]
 
@@ -109,6 +111,108 @@ class Brand:
 
         return ret
 
+    @classmethod
+    def _get_all_by_ids(cls: Type[T],
+                        brand_ids: list[int]) -> dict[int, T]:
+        """
+        Uncached get_all_by_ids(). Each relation (creator, product count,
+        tags, products) is resolved through the loader with one query for
+        all brands.
+        """
+
+        ret: dict[int, T] = {}
+        conn = None
+        cursor = None
+
+        if not brand_ids:
+            return ret
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT * FROM {DatabaseTable.BRAND}
+                WHERE {ProtocolKey.ID} = ANY(%s);
+                """,
+                (brand_ids,)
+            )
+            results = cursor.fetchall()
+            conn.commit()
+
+            brands = [cls(result) for result in results]
+            ids = [brand.id for brand in brands]
+            creators = loader.load_many(EntityType.USER_ACCOUNT, [brand.creator_id for brand in brands])
+            product_counts = loader.load_many((EntityType.BRAND, ProtocolKey.PRODUCT_COUNT), ids)
+            tags = loader.load_many((EntityType.BRAND, ProtocolKey.TAGS), ids)
+            loader.prime((EntityType.BRAND, ProtocolKey.PRODUCTS),
+                         [brand_id for brand_id, count in zip(ids, product_counts) if count])
+
+            for brand, creator, product_count, brand_tags in zip(brands, creators, product_counts, tags):
+                brand.creator = creator
+                brand.product_count = product_count or 0
+                brand.tags = brand_tags or []
+
+                if brand.product_count > 0:
+                    brand.products = loader.load((EntityType.BRAND, ProtocolKey.PRODUCTS), brand.id) or []
+
+                ret[brand.id] = brand
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
+    @classmethod
+    def _get_by_id(cls: Type[T],
+                   brand_id: int) -> T:
+        """
+        Uncached get_by_id().
+        """
+
+        ret: Type[T] = None
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT * FROM {DatabaseTable.BRAND}
+                WHERE {ProtocolKey.ID} = %s;
+                """,
+                (brand_id,)
+            )
+            result = cursor.fetchone()
+            conn.commit()
+
+            if result:
+                from app.modules.product import Product
+
+                ret = cls(result)
+                ret.creator = UserAccount.get_by_id(ret.creator_id)
+                ret.product_count = Product.get_product_count(ret.id)
+                ret.tags = Brand.get_tags(ret.id)
+
+                if ret.product_count > 0:
+                    ret.products = Product.get_some_products(ret.id)
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
     @staticmethod
     def add_history(brand_id: int = 0,
                     editor_id: int = 0,
@@ -213,6 +317,7 @@ class Brand:
     def as_dict(self) -> dict[ProtocolKey, Any]:
         serialized = {
             ProtocolKey.ALIAS: self.alias,
+            ProtocolKey.AVATAR_LIGHT_MODE_DERIVATIVES: self.avatar_light_derivatives,
             ProtocolKey.AVATAR_LIGHT_MODE_FILE_PATH: self.avatar_light_path,
             ProtocolKey.CREATOR_ID: self.creator_id,
             ProtocolKey.DESCRIPTION: self.description,
@@ -308,6 +413,9 @@ class Brand:
 
                 ret.creator = UserAccount.get_by_id(ret.creator_id)
 
+                # Drops cached searches that might now include it.
+                brand_cache.invalidate(ret.id)
+
                 conn.commit()
         except Exception as e:
             print(e)
@@ -383,6 +491,7 @@ class Brand:
                     (self.id, tag_id)
                 )
                 conn.commit()
+                brand_cache.invalidate(self.id)
             except Exception as e:
                 print(e)
             finally:
@@ -395,11 +504,17 @@ class Brand:
     def delete(self) -> None:
         """
         [NOTE] This method erases the brand's record from the database.
+
+        The avatar fields are refreshed from the deleted row (and cleared
+        if nothing was deleted), so they name exactly the avatar that
+        went with it even if this object was stale.
         """
 
         if not self.id and not self.alias:
             raise Exception("Deletion requires either a brand ID or alias.")
 
+        self.avatar_light_derivatives = []
+        self.avatar_light_path = None
         conn = None
         cursor = None
 
@@ -411,7 +526,8 @@ class Brand:
                 cursor.execute(
                     f"""
                     DELETE FROM {DatabaseTable.BRAND}
-                    WHERE {ProtocolKey.ID} = %s;
+                    WHERE {ProtocolKey.ID} = %s
+                    RETURNING *;
                     """,
                     (self.id,)
                 )
@@ -419,12 +535,21 @@ class Brand:
                 cursor.execute(
                     f"""
                     DELETE FROM {DatabaseTable.BRAND}
-                    WHERE {ProtocolKey.ALIAS} = %s;
+                    WHERE {ProtocolKey.ALIAS} = %s
+                    RETURNING *;
                     """,
                     (self.alias,)
                 )
 
+            result = cursor.fetchone()
             conn.commit()
+
+            if result:
+                self.avatar_light_derivatives = result[ProtocolKey.AVATAR_LIGHT_MODE_DERIVATIVES] or []
+                self.avatar_light_path = result[ProtocolKey.AVATAR_LIGHT_MODE_FILE_PATH]
+
+            if self.id:
+                brand_cache.invalidate(self.id)
         except Exception as e:
             print(e)
         finally:
@@ -459,6 +584,7 @@ class Brand:
                 (self.id, tag_id)
             )
             conn.commit()
+            brand_cache.invalidate(self.id)
         except Exception as e:
             print(e)
         finally:
@@ -471,40 +597,75 @@ class Brand:
     @classmethod
     def get_all(cls: Type[T],
                 query: str,
-                offset: int = 0) -> list[T]:
+                page_cursor: str = None,
+                limit: int = Configuration.PAGE_SIZE) -> tuple[list[T], str]:
+        """
+        Returns a page of brands along with the cursor for the next page
+        (None on the last one). Search results are ranked by relevance,
+        everything else is listed by name.
+        """
+
         if not isinstance(query, str):
             raise TypeError(f"Argument 'query' must be of type str, not {type(query)}.")
 
         ret: list[T] = []
+        next_cursor: str = None
         conn = None
         cursor = None
+        # Decoded outside the try so that a bad cursor reaches the caller.
+        after = Common.decode_cursor(page_cursor, ((float, int), int) if query else (str, int))
 
         try:
             conn = db.connect()
             cursor = conn.cursor()
 
             if query:
+                keyset = ""
+                params = [query, query]
+
+                if after:
+                    keyset = f"WHERE (match.rank, match.{ProtocolKey.ID}) < (%s::real, %s)"
+                    params += after
+
+                params.append(limit + 1)
                 cursor.execute(
                     f"""
-                    SELECT *, ts_rank(match.{ProtocolKey.POSTGRES_SEARCH_NAME}, plainto_tsquery('english', %s)) AS rank FROM
-                    (SELECT * FROM {DatabaseTable.BRAND}
+                    SELECT * FROM
+                    (SELECT *, ts_rank({ProtocolKey.POSTGRES_SEARCH_NAME}, plainto_tsquery('english', %s)) AS rank
+                    FROM {DatabaseTable.BRAND}
                     WHERE {ProtocolKey.POSTGRES_SEARCH_NAME} @@ plainto_tsquery('english', %s)
                     AND {ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value}))
                     AS match
-                    ORDER BY rank DESC
-                    LIMIT 20 OFFSET %s;
+                    {keyset}
+                    ORDER BY match.rank DESC, match.{ProtocolKey.ID} DESC
+                    LIMIT %s;
                     """,
-                    (query, query, offset)
+                    params
                 )
+                results, next_cursor = Common.paginate(cursor.fetchall(), limit,
+                                                    lambda row: [row["rank"], row[ProtocolKey.ID]])
             else:
+                keyset = ""
+                params = []
+
+                if after:
+                    keyset = f"AND ({ProtocolKey.NAME}, {ProtocolKey.ID}) > (%s, %s)"
+                    params += after
+
+                params.append(limit + 1)
                 cursor.execute(
                     f"""
                     SELECT * FROM {DatabaseTable.BRAND}
-                    ORDER BY {ProtocolKey.NAME} ASC
-                    """
+                    WHERE {ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
+                    {keyset}
+                    ORDER BY {ProtocolKey.NAME} ASC, {ProtocolKey.ID} ASC
+                    LIMIT %s;
+                    """,
+                    params
                 )
+                results, next_cursor = Common.paginate(cursor.fetchall(), limit,
+                                                       lambda row: [row[ProtocolKey.NAME], row[ProtocolKey.ID]])
 
-            results = cursor.fetchall()
             conn.commit()
 
             for result in results:
@@ -518,7 +679,85 @@ class Brand:
             if conn:
                 conn.close()
 
-        return ret
+        return (ret, next_cursor)
+
+    @classmethod
+    def get_all_by_ids(cls: Type[T],
+                       brand_ids: list[int]) -> dict[int, T]:
+        """
+        Batch counterpart of get_by_id(), keyed by brand ID. Reads through
+        the brand cache; only the brands missing from it are queried.
+        """
+
+        if not isinstance(brand_ids, list):
+            raise TypeError(f"Argument 'brand_ids' must be of type list, not {type(brand_ids)}.")
+
+        return brand_cache.get_many(brand_ids, cls._get_all_by_ids)
+
+    @classmethod
+    def get_all_by_tags(cls: Type[T],
+                        tag_ids: list[int],
+                        match_all: bool = False,
+                        page_cursor: str = None,
+                        limit: int = Configuration.PAGE_SIZE) -> tuple[list[T], str]:
+        """
+        Returns a page of brands tagged with all (match_all) or any of the
+        tags, by name, along with the cursor for the next page.
+        """
+
+        if not isinstance(tag_ids, list):
+            raise TypeError(f"Argument 'tag_ids' must be of type list, not {type(tag_ids)}.")
+
+        if not tag_ids:
+            raise ValueError("Argument 'tag_ids' must be a non-empty list.")
+
+        if not isinstance(match_all, bool):
+            raise TypeError(f"Argument 'match_all' must be of type bool, not {type(match_all)}.")
+
+        ret: list[T] = []
+        next_cursor: str = None
+        conn = None
+        cursor = None
+        after = Common.decode_cursor(page_cursor, (str, int))
+        keyset = ""
+        params = [tag_ids, len(tag_ids) if match_all else 1]
+
+        if after:
+            keyset = f"AND ({ProtocolKey.NAME}, {ProtocolKey.ID}) > (%s, %s)"
+            params += after
+
+        params.append(limit + 1)
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT * FROM {DatabaseTable.BRAND}
+                WHERE {Tag.membership_condition(EntityType.BRAND, ProtocolKey.ID)}
+                AND {ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
+                {keyset}
+                ORDER BY {ProtocolKey.NAME} ASC, {ProtocolKey.ID} ASC
+                LIMIT %s;
+                """,
+                params
+            )
+            results, next_cursor = Common.paginate(cursor.fetchall(), limit,
+                                                   lambda row: [row[ProtocolKey.NAME], row[ProtocolKey.ID]])
+            conn.commit()
+
+            for result in results:
+                ret.append(cls(result))
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return (ret, next_cursor)
 
     @classmethod
     def get_all_by_user(cls: Type[T],
@@ -616,43 +855,7 @@ class Brand:
         if brand_id <= 0:
             raise ValueError("Argument 'brand_id' must be a positive, non-zero integer.")
 
-        ret: Type[T] = None
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.BRAND}
-                WHERE {ProtocolKey.ID} = %s;
-                """,
-                (brand_id,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                from app.modules.product import Product
-
-                ret = cls(result)
-                ret.creator = UserAccount.get_by_id(ret.creator_id)
-                ret.product_count = Product.get_product_count(ret.id)
-                ret.tags = Brand.get_tags(ret.id)
-
-                if ret.product_count > 0:
-                    ret.products = Product.get_some_products(ret.id)
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return brand_cache.get(brand_id, cls._get_by_id)
 
     @staticmethod
     def get_id_for_alias(alias: str) -> int:
@@ -779,6 +982,46 @@ class Brand:
 
         return ret
 
+    @staticmethod
+    def get_tags_for_brands(brand_ids: list[int]) -> dict[int, list[Tag]]:
+        if not isinstance(brand_ids, list):
+            raise TypeError(f"Argument 'brand_ids' must be of type list, not {type(brand_ids)}.")
+
+        ret: dict[int, list[Tag]] = {brand_id: [] for brand_id in brand_ids}
+        conn = None
+        cursor = None
+
+        if not brand_ids:
+            return ret
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT *
+                FROM {DatabaseTable.TAG}
+                INNER JOIN {DatabaseTable.BRAND_TAG} ON {DatabaseTable.BRAND_TAG}.{ProtocolKey.TAG_ID} = {DatabaseTable.TAG}.{ProtocolKey.ID}
+                WHERE {DatabaseTable.BRAND_TAG}.{ProtocolKey.BRAND_ID} = ANY(%s);
+                """,
+                (brand_ids,)
+            )
+            results = cursor.fetchall()
+            conn.commit()
+
+            for result in results:
+                ret[result[ProtocolKey.BRAND_ID]].append(Tag(result))
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
     @staticmethod
     def id_exists(brand_id: int) -> bool:
         if not isinstance(brand_id, int):
@@ -924,6 +1167,7 @@ class Brand:
                 (edit_access_level.value, self.id)
             )
             conn.commit()
+            brand_cache.invalidate(self.id)
         except Exception as e:
             print(e)
         finally:
@@ -963,6 +1207,7 @@ class Brand:
                 (visibility.value, self.id)
             )
             conn.commit()
+            brand_cache.invalidate(self.id)
         except Exception as e:
             print(e)
         finally:
@@ -998,6 +1243,7 @@ class Brand:
                 (self.description, self.name, self.rep, self.website, self.id)
             )
             conn.commit()
+            brand_cache.invalidate(self.id)
         except Exception as e:
             print(e)
         finally:
@@ -1009,7 +1255,17 @@ class Brand:
 
     def update_avatar_path(self,
                            file_path: str,
-                           media_mode: MediaMode) -> None:
+                           media_mode: MediaMode,
+                           derivatives: list[dict] = None) -> tuple[str, list[dict]]:
+        """
+        Derivatives are only kept for light mode avatars; there's no
+        column for dark mode ones.
+
+        Returns the path and derivatives the update replaced, or None if
+        nothing was updated. They're read under the row's lock, so two
+        concurrent updates never both get the same previous avatar.
+        """
+
         if not self.id:
             raise Exception("Brand has no ID associated with it.")
 
@@ -1021,11 +1277,21 @@ class Brand:
         if not isinstance(media_mode, MediaMode):
             raise TypeError(f"Argument 'media_mode' must be of type MediaMode, not {type(media_mode)}.")
 
+        if derivatives is None:
+            derivatives = []
+        elif not isinstance(derivatives, list):
+            raise TypeError(f"Argument 'derivatives' must be of type list, not {type(derivatives)}.")
+
         if media_mode == MediaMode.LIGHT:
-            column = ProtocolKey.AVATAR_LIGHT_MODE_FILE_PATH
+            assignments = f"{ProtocolKey.AVATAR_LIGHT_MODE_FILE_PATH} = %s, {ProtocolKey.AVATAR_LIGHT_MODE_DERIVATIVES} = %s::jsonb"
+            previous = f"previous.{ProtocolKey.AVATAR_LIGHT_MODE_FILE_PATH} AS {ProtocolKey.FILE_PATH}, previous.{ProtocolKey.AVATAR_LIGHT_MODE_DERIVATIVES} AS {ProtocolKey.DERIVATIVES}"
+            params = (file_path, json.dumps(derivatives), self.id)
         else:
-            column = ProtocolKey.AVATAR_DARK_MODE_FILE_PATH
+            assignments = f"{ProtocolKey.AVATAR_DARK_MODE_FILE_PATH} = %s"
+            previous = f"previous.{ProtocolKey.AVATAR_DARK_MODE_FILE_PATH} AS {ProtocolKey.FILE_PATH}, NULL::jsonb AS {ProtocolKey.DERIVATIVES}"
+            params = (file_path, self.id)
 
+        ret = None
         conn = None
         cursor = None
 
@@ -1035,15 +1301,27 @@ class Brand:
             cursor.execute(
                 f"""
                 UPDATE {DatabaseTable.BRAND}
-                SET {column} = %s
-                WHERE {ProtocolKey.ID} = %s;
+                SET {assignments}
+                FROM (
+                    SELECT * FROM {DatabaseTable.BRAND}
+                    WHERE {ProtocolKey.ID} = %s
+                    FOR UPDATE
+                ) AS previous
+                WHERE {DatabaseTable.BRAND}.{ProtocolKey.ID} = previous.{ProtocolKey.ID}
+                RETURNING {previous};
                 """,
-                (file_path, self.id)
+                params
             )
+            result = cursor.fetchone()
             conn.commit()
+            brand_cache.invalidate(self.id)
 
-            if media_mode == MediaMode.LIGHT:
-                self.avatar_light_path = file_path
+            if result:
+                ret = (result[ProtocolKey.FILE_PATH], result[ProtocolKey.DERIVATIVES] or [])
+
+                if media_mode == MediaMode.LIGHT:
+                    self.avatar_light_derivatives = derivatives
+                    self.avatar_light_path = file_path
         except Exception as e:
             print(e)
         finally:
@@ -1053,6 +1331,8 @@ class Brand:
             if conn:
                 conn.close()
 
+        return ret
+
 
 class BrandEditHistory:
     def __init__(self,
@@ -1085,6 +1365,67 @@ class BrandEditHistory:
 ####################
 
 
+loader.register(EntityType.BRAND, Brand.get_all_by_ids)
+loader.register((EntityType.BRAND, ProtocolKey.TAGS), Brand.get_tags_for_brands)
+brand_cache = cache.entity_cache(
+    "brand",
+    max_size=Configuration.BRAND_CACHE_MAX_SIZE,
+    ttl=Configuration.BRAND_CACHE_TTL,
+    dependencies={
+        "product": lambda brand, product_id: any(product.id == product_id for product in brand.products or []),
+        "user_account": lambda brand, account_id: brand.creator_id == account_id
+    }
+)
+brand_search_cache = cache.search_cache(
+    "brand",
+    dependencies=frozenset(["brand", "product", "user_account"])
+)
+
+
+def _on_avatar_processed(job: MediaJob,
+                         status: MediaStatus) -> None:
+    brand = Brand.get_by_id(job.entity_id)
+
+    if status != MediaStatus.READY or not brand:
+        # The upload's reference to the image isn't going to be used.
+        media_queue.release(job.file_path)
+
+        return
+
+    _set_avatar(brand, job.file_path, job.media_mode, job.derivatives, job.editor_id)
+
+
+def _set_avatar(brand: Brand,
+                file_path: str,
+                media_mode: MediaMode,
+                derivatives: list[dict],
+                editor_id: int) -> None:
+    """
+    Puts file_path, to which the caller holds a reference, in place as
+    the brand's avatar and drops the reference to whichever avatar it
+    replaced.
+    """
+
+    previous = brand.update_avatar_path(file_path, media_mode, derivatives)
+
+    if previous is None:
+        # The brand is gone; the new avatar won't be used.
+        media_queue.release(file_path)
+
+        return
+
+    previous_path, previous_derivatives = previous
+
+    if previous_path:
+        # Only what the update actually replaced gets released. If that
+        # was this same image, this drops the duplicate reference.
+        media_queue.release(previous_path, previous_derivatives)
+
+    if previous_path != file_path:
+        # Auditing.
+        Brand.add_history(brand.id, editor_id, UserAction.UPDATED, Field.AVATAR, file_path)
+
+
 def allowed_avatar_file(filename: str) -> bool:
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in Configuration.ALLOWED_AVATAR_FILE_EXTENSIONS
@@ -1310,18 +1651,12 @@ def delete_brand(brand_id: str) -> tuple[dict, ResponseStatus]:
             user_account = UserAccount.get_by_session(session_id)
 
             if user_account.is_admin:
-                if brand.avatar_light_path:
-                    # Delete the avatar file.
-                    if app.debug:
-                        try:
-                            os.remove(os.path.join(Configuration.AVATAR_DIR, brand.avatar_light_path))
-                        except OSError:
-                            pass
-                    else:
-                        s3.delete_media(brand.avatar_light_path)
-
                 brand.delete()
 
+                if brand.avatar_light_path:
+                    # Drop the avatar files, unless another brand or product uses the same image.
+                    media_queue.release(brand.avatar_light_path, brand.avatar_light_derivatives)
+
                 response = {
                     ProtocolKey.BRAND_ID: brand.id
                 }
@@ -1404,13 +1739,28 @@ def get_brand(alias: str = None,
     return (response, response_status)
 
 
-def get_brands(query: str) -> tuple[dict, ResponseStatus]:
+def get_brands(query: str,
+               cursor: str = None,
+               page_size: str = None) -> tuple[dict, ResponseStatus]:
+    key = (cache.normalize_query(query), cursor, page_size)
+
+    return brand_search_cache.get(key, lambda: _get_brands(query, cursor, page_size))
+
+
+def _get_brands(query: str,
+                cursor: str = None,
+                page_size: str = None) -> tuple[dict, ResponseStatus]:
     query = query.strip()
     response_status = ResponseStatus.OK
     serialized = []
+    next_cursor = None
+    page_size = Common.clamp_page_size(page_size)
 
     if isinstance(query, str):
-        results = Brand.get_all(query)
+        try:
+            results, next_cursor = Brand.get_all(query, page_cursor=cursor, limit=page_size)
+        except ValueError:
+            return invalid_cursor()
 
         for result in results:
             # This line is slowing things down.
@@ -1418,12 +1768,30 @@ def get_brands(query: str) -> tuple[dict, ResponseStatus]:
             serialized.append(result.as_dict())
 
     response = {
-        ProtocolKey.BRANDS: serialized
+        ProtocolKey.BRANDS: serialized,
+        ProtocolKey.NEXT_CURSOR: next_cursor
     }
 
+    # Counting the listed brands is a full scan; the planner's estimate for
+    # the listing's own condition is close enough for showing a total, and
+    # only the first page needs it.
+    if not query and not cursor:
+        response[ProtocolKey.TOTAL_COUNT] = Common.estimate_row_count(
+            DatabaseTable.BRAND,
+            f"{ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})"
+        )
+        response[ProtocolKey.TOTAL_COUNT_IS_ESTIMATE] = True
+
     return (response, response_status)
 
 
+def get_brands_by_tags(tags: str,
+                       match: str = None,
+                       cursor: str = None,
+                       page_size: str = None) -> tuple[dict, ResponseStatus]:
+    return get_tagged(tags, match, cursor, page_size, EntityType.BRAND, Brand.get_all_by_tags, ProtocolKey.BRANDS)
+
+
 def remove_brand(brand_id: str) -> tuple[dict, ResponseStatus]:
     if brand_id:
         try:
@@ -1540,58 +1908,16 @@ def update_avatar(brand_id: str,
         if brand and \
                 brand.visibility not in frozenset([ContentVisibility.DELETED, ContentVisibility.REMOVED]):
             if allowed_avatar_file(avatar.filename):
-                avatar_bytes = avatar.read()
-                avatar_hash = hashlib.sha256(avatar_bytes).hexdigest()
-
-                brand_media_dir = os.path.join(Configuration.BRAND_MEDIA_DIR, f"{brand_id}")
-                os.makedirs(brand_media_dir, exist_ok=True)
-                # We'd like to standardize all images to be in JPEG format.
-                file_path_final = os.path.join(brand_media_dir, f"{avatar_hash}_avatar_full.jpg")
-
-                avatar_filename = secure_filename(avatar.filename)
-                file_path_tmp = os.path.join("/tmp", avatar_filename)
-                avatar.stream.seek(0)
-                avatar.save(file_path_tmp)
+                avatar_data, avatar_hash = media_queue.read_upload(avatar)
+                avatar_light_path = MediaBlob.file_path_for(avatar_hash)
 
                 try:
-                    # Convert to PNG.
-                    pil_image = Image.open(file_path_tmp)
-                    pil_image.save(file_path_final)
-                    avatar_light_path = f"brand/{brand_id}/{avatar_hash}_avatar_full.jpg"
+                    # Only reads the headers; the conversion itself happens in the media queue.
+                    with Image.open(avatar_data) as pil_image:
+                        pil_image.verify()
 
-                    # Don't bother updating if it's the same image being re-uploaded.
-                    if brand.avatar_light_path != avatar_light_path:
-                        if app.debug:
-                            # Delete the previous avatar.
-                            if brand.avatar_light_path:
-                                try:
-                                    os.remove(os.path.join(Configuration.MEDIA_DIR, brand.avatar_light_path))
-                                except OSError:
-                                    pass
-                        else:
-                            # Delete the previous avatar.
-                            if brand.avatar_light_path:
-                                s3.delete_media(brand.avatar_light_path)
-
-                            s3.upload_media(file_path_final, avatar_light_path)
-                            # Don't need the local file anymore.
-                            os.remove(file_path_final)
-
-                        brand.update_avatar_path(avatar_light_path, media_mode)
-
-                        # Auditing.
-                        session_id = request.cookies.get(ProtocolKey.USER_ACCOUNT_SESSION_ID.value)
-                        editor = UserAccount.get_by_session(session_id)
-                        Brand.add_history(brand.id, editor.id, UserAction.UPDATED, Field.AVATAR, avatar_light_path)
-                    else:
-                        print("User re-uploaded the same image; ignoring.")
-
-                    response_status = ResponseStatus.OK
-                    response = {
-                        ProtocolKey.AVATAR_LIGHT_MODE_FILE_PATH: avatar_light_path,
-                        ProtocolKey.BRAND_ID: brand.id
-                    }
-                except IOError:
+                    avatar_data.seek(0)
+                except Exception:
                     # File is not an image file.
                     response_status = ResponseStatus.BAD_REQUEST
                     response = {
@@ -1600,9 +1926,55 @@ def update_avatar(brand_id: str,
                             ProtocolKey.ERROR_MESSAGE: f"Invalid file. Allowed image formats: {', '.join(Configuration.ALLOWED_AVATAR_FILE_EXTENSIONS)}"
                         }
                     }
+                else:
+                    # Don't bother updating if it's the same image being re-uploaded.
+                    if brand.avatar_light_path != avatar_light_path:
+                        session_id = request.cookies.get(ProtocolKey.USER_ACCOUNT_SESSION_ID.value)
+                        editor = UserAccount.get_by_session(session_id)
+                        blob = MediaBlob.acquire(avatar_hash)
+
+                        if not blob:
+                            status = MediaStatus.FAILED
+                        elif blob.status == MediaStatus.READY:
+                            # Someone uploaded this image before; use the stored copy.
+                            _set_avatar(brand, blob.file_path, media_mode, blob.derivatives, editor.id)
+                            status = blob.status
+                        else:
+                            # The brand keeps its current avatar until the new
+                            # one has been converted and stored.
+                            job = MediaJob.create(
+                                avatar_data,
+                                editor.id,
+                                brand.id,
+                                EntityType.BRAND,
+                                avatar_light_path,
+                                media_mode=media_mode
+                            )
+                            media_queue.enqueue(job)
+                            status = MediaStatus.PENDING
+                    else:
+                        print("User re-uploaded the same image; ignoring.")
+                        status = MediaStatus.READY
+
+                    if status == MediaStatus.FAILED:
+                        # Nothing was stored for it; fail the request so it
+                        # rolls back and can be retried as is.
+                        response_status = ResponseStatus.INTERNAL_SERVER_ERROR
+                        response = {
+                            ProtocolKey.ERROR: {
+                                ProtocolKey.ERROR_CODE: response_status.value,
+                                ProtocolKey.ERROR_MESSAGE: "The avatar could not be saved."
+                            }
+                        }
+                    else:
+                        response_status = ResponseStatus.OK
+                        response = {
+                            ProtocolKey.AVATAR_LIGHT_MODE_FILE_PATH: avatar_light_path,
+                            ProtocolKey.BRAND_ID: brand.id,
+                            ProtocolKey.STATUS: status
+                        }
                 finally:
-                    # Clean up.
-                    os.remove(file_path_tmp)
+                    avatar_data.close()
             else:
                 response_status = ResponseStatus.FORBIDDEN
                 response = {
@@ -1867,3 +2239,6 @@ def update_brand(brand_id: str = None,
                 }
 
     return (response, response_status)
+
+
+media_queue.register(EntityType.BRAND, _on_avatar_processed)
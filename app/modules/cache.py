@@ -0,0 +1,663 @@
+import copy
+import os
+import pickle
+import select
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from flask import g, has_request_context
+
+from app import app
+from app.config import Configuration
+from app.modules import db, loader
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+###########
+# CLASSES #
+###########
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded LRU cache whose entries optionally expire
+    after a time-to-live (in seconds).
+    """
+
+    def __init__(self,
+                 max_size: int,
+                 ttl: float = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "evictions": 0,
+            "hits": 0,
+            "invalidations": 0,
+            "misses": 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+
+    def delete(self,
+               key: Hashable) -> None:
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def delete_where(self,
+                     predicate: Callable[[Hashable, Any], bool]) -> None:
+        """
+        Drops every entry for which predicate(key, value) is true.
+        """
+
+        with self._lock:
+            keys = [key for key, (value, _) in self._entries.items() if predicate(key, value)]
+
+            for key in keys:
+                del self._entries[key]
+
+            self._stats["invalidations"] += len(keys)
+
+    def get(self,
+            key: Hashable,
+            default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self._stats["misses"] += 1
+
+                return default
+
+            value, expiry = entry
+
+            if expiry and expiry <= time.monotonic():
+                del self._entries[key]
+                self._stats["misses"] += 1
+
+                return default
+
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+
+            return value
+
+    def set(self,
+            key: Hashable,
+            value: Any,
+            ttl: float = None) -> None:
+        if ttl is None:
+            ttl = self.ttl
+
+        expiry = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            self._entries[key] = (value, expiry)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            ret = dict(self._stats)
+            ret["size"] = len(self._entries)
+            ret["max_size"] = self.max_size
+
+        return ret
+
+
+class EntityCache:
+    """
+    Read-through cache for entities looked up by ID. Every worker keeps
+    its own LRU layer; when REDIS_URL is configured, entries are shared
+    between workers and nodes through Redis as well. Callers always get
+    a deep copy, so mutating a returned object never touches the cache.
+
+    dependencies maps the names of other entity caches to a predicate
+    telling whether a cached entity embeds the given ID of that entity,
+    e.g. a product embeds its brand. Invalidating the brand then drops
+    those products too.
+    """
+
+    def __init__(self,
+                 name: str,
+                 max_size: int,
+                 ttl: float,
+                 dependencies: dict[str, Callable[[Any, Hashable], bool]] = None) -> None:
+        self.dependencies = dependencies or {}
+        self.name = name
+        self.ttl = ttl
+        self._local = LRUCache(max_size, ttl)
+        self._shared_prefix = f"{Configuration.SERVICE_NAME}:entity:{name}"
+
+    def _is_dirty(self,
+                  key: Hashable) -> bool:
+        # Entities written by the current request are read straight from
+        # the database until it commits; the cache must never see data
+        # that could still be rolled back.
+        return has_request_context() and (self.name, key) in g.get("entity_cache_dirty", ())
+
+    def _get_shared(self,
+                    key: Hashable) -> tuple[Any, int]:
+        client = _get_redis()
+
+        if client is None:
+            return (None, 0)
+
+        try:
+            generation, data = client.mget(f"{self._shared_prefix}:generation",
+                                           f"{self._shared_prefix}:{key}")
+            generation = int(generation or 0)
+
+            if data:
+                entry_generation, value = pickle.loads(data)
+
+                # Entries written before a dependency was invalidated are
+                # stale even though their own key was never deleted.
+                if entry_generation == generation:
+                    return (value, generation)
+        except Exception as e:
+            print(e)
+
+            return (None, None)
+
+        return (None, generation)
+
+    def _set_shared(self,
+                    key: Hashable,
+                    value: Any,
+                    generation: int) -> None:
+        client = _get_redis()
+
+        if client is None or generation is None:
+            return
+
+        try:
+            client.set(f"{self._shared_prefix}:{key}",
+                       pickle.dumps((generation, value)),
+                       ex=int(self.ttl) if self.ttl else None)
+        except Exception as e:
+            print(e)
+
+    def clear_local(self) -> None:
+        self._local.clear()
+
+    def drop_local(self,
+                   name: str,
+                   key: Hashable) -> None:
+        if name == self.name:
+            self._local.delete(key)
+
+        depends = self.dependencies.get(name)
+
+        if depends:
+            self._local.delete_where(lambda _, value: depends(value, key))
+
+    def drop_shared(self,
+                    name: str,
+                    key: Hashable) -> None:
+        client = _get_redis()
+
+        if client is None:
+            return
+
+        try:
+            if name == self.name:
+                client.delete(f"{self._shared_prefix}:{key}")
+
+            if name in self.dependencies:
+                client.incr(f"{self._shared_prefix}:generation")
+        except Exception as e:
+            print(e)
+
+    def get(self,
+            key: Hashable,
+            load: Callable[[Hashable], Any]) -> Any:
+        """
+        Returns a copy of the entity for key, calling load(key) on a miss.
+        Missing entities (load returning None) aren't cached.
+        """
+
+        if self._is_dirty(key):
+            return load(key)
+
+        value = self._local.get(key)
+
+        if value is None:
+            value, generation = self._get_shared(key)
+
+            if value is None:
+                value = load(key)
+
+                if value is None:
+                    return None
+
+                value = copy.deepcopy(value)
+                self._set_shared(key, value, generation)
+
+            self._local.set(key, value)
+
+        return copy.deepcopy(value)
+
+    def get_many(self,
+                 keys: list[Hashable],
+                 load_many: Callable[[list], dict]) -> dict:
+        """
+        Batch counterpart of get(): returns copies of the entities found
+        for keys, calling load_many() once with every key that isn't
+        cached. It returns a dict of the ones it found.
+        """
+
+        ret = {}
+        # Keys to load, with the shared generation to store them under;
+        # None for dirty keys, which mustn't be cached.
+        missing: dict[Hashable, int] = {}
+
+        for key in keys:
+            if self._is_dirty(key):
+                missing[key] = None
+
+                continue
+
+            value = self._local.get(key)
+
+            if value is None:
+                value, generation = self._get_shared(key)
+
+                if value is None:
+                    missing[key] = generation
+
+                    continue
+
+                self._local.set(key, value)
+
+            ret[key] = copy.deepcopy(value)
+
+        if missing:
+            for key, value in load_many(list(missing)).items():
+                if not self._is_dirty(key):
+                    cached = copy.deepcopy(value)
+                    self._set_shared(key, cached, missing.get(key))
+                    self._local.set(key, cached)
+
+                ret[key] = value
+
+        return ret
+
+    def invalidate(self,
+                   key: Hashable) -> None:
+        """
+        Drops key (and every entity embedding it) from all workers once
+        the current transaction commits.
+        """
+
+        if has_request_context():
+            g.setdefault("entity_cache_dirty", set()).add((self.name, key))
+
+        # Loaders resolve relations across entity types (a brand's product
+        # count, say), so anything they fetched may now be stale.
+        loader.clear()
+
+        for other in _entity_caches.values():
+            other.drop_local(self.name, key)
+
+        _clear_search_caches(self.name)
+        publish(ENTITY_CACHE_CHANNEL, f"{self.name}:{key}")
+        db.after_commit(lambda: _drop_shared(self.name, key))
+
+    def stats(self) -> dict:
+        return self._local.stats()
+
+
+class SearchCache:
+    """
+    Short-lived cache of search and listing responses in this worker.
+    An entry can't be traced back to the entities it contains, so any
+    write to an entity type listed in dependencies (entity cache names)
+    empties the whole cache, in every worker.
+    """
+
+    def __init__(self,
+                 name: str,
+                 max_size: int,
+                 ttl: float,
+                 dependencies: frozenset[str]) -> None:
+        self.dependencies = dependencies
+        self.name = name
+        self._local = LRUCache(max_size, ttl)
+
+    def _is_dirty(self) -> bool:
+        # Same as EntityCache: a request that wrote one of the dependencies
+        # mustn't read or fill the cache before it commits.
+        return has_request_context() and \
+            any(name in self.dependencies for name, _ in g.get("entity_cache_dirty", ()))
+
+    def clear(self) -> None:
+        self._local.clear()
+
+    def get(self,
+            key: Hashable,
+            load: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value for key, calling load() on a miss. Values
+        are shared, so callers must not modify them.
+        """
+
+        if self._is_dirty():
+            return load()
+
+        value = self._local.get(key)
+
+        if value is None:
+            value = load()
+
+            if value is not None:
+                self._local.set(key, value)
+
+        return value
+
+    def stats(self) -> dict:
+        return self._local.stats()
+
+
+class InvalidationListener(threading.Thread):
+    """
+    Listens for Postgres notifications on behalf of this worker process
+    and hands each payload to the callbacks subscribed to its channel.
+    If the connection drops, every callback is invoked with None once
+    the listener reconnects since notifications may have been missed in
+    the meantime.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.daemon = True
+        self.name = "InvalidationListener"
+        self._subscribers: dict[str, list[Callable[[str], None]]] = {}
+        self._lock = threading.Lock()
+        self._listening: set[str] = set()
+
+    def _dispatch(self,
+                  channel: str,
+                  payload: str) -> None:
+        with self._lock:
+            callbacks = list(self._subscribers.get(channel, []))
+
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception as e:
+                print(e)
+
+    def _listen(self,
+                conn) -> None:
+        with self._lock:
+            channels = set(self._subscribers) - self._listening
+
+        if channels:
+            cursor = conn.cursor()
+            try:
+                for channel in channels:
+                    cursor.execute(f"LISTEN \"{channel}\";")
+            finally:
+                cursor.close()
+
+            self._listening |= channels
+
+    def run(self) -> None:
+        reconnecting = False
+
+        while True:
+            conn = None
+
+            try:
+                conn = db.connect_unpooled(autocommit=True)
+                self._listening = set()
+                self._listen(conn)
+
+                if reconnecting:
+                    for channel in list(self._subscribers):
+                        self._dispatch(channel, None)
+
+                reconnecting = True
+
+                while True:
+                    # Wake up now and then to pick up new subscriptions.
+                    if select.select([conn], [], [], 5) != ([], [], []):
+                        conn.poll()
+
+                        while conn.notifies:
+                            notification = conn.notifies.pop(0)
+                            self._dispatch(notification.channel, notification.payload)
+
+                    self._listen(conn)
+            except Exception as e:
+                print(e)
+            finally:
+                if conn:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+            time.sleep(5)
+
+    def subscribe(self,
+                  channel: str,
+                  callback: Callable[[str], None]) -> None:
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+
+
+####################
+# MODULE FUNCTIONS #
+####################
+
+
+ENTITY_CACHE_CHANNEL = "entity_cache"
+_entity_caches: dict[str, EntityCache] = {}
+_listener: InvalidationListener = None
+_listener_lock = threading.Lock()
+_listener_pid: int = None
+_redis_client = None
+_redis_pid: int = None
+_search_caches: dict[str, SearchCache] = {}
+_subscriptions: list[tuple[str, Callable[[str], None]]] = []
+
+
+def _clear_search_caches(name: str) -> None:
+    for search_cache in _search_caches.values():
+        if name is None or name in search_cache.dependencies:
+            search_cache.clear()
+
+
+def _drop_shared(name: str,
+                 key: Hashable) -> None:
+    for other in _entity_caches.values():
+        other.drop_shared(name, key)
+
+
+def _get_listener() -> InvalidationListener:
+    """
+    Returns this process's listener, starting it if needed. Threads don't
+    survive fork() so each worker ends up with its own.
+    """
+
+    global _listener, _listener_pid
+
+    pid = os.getpid()
+
+    if _listener is not None and _listener_pid == pid:
+        return _listener
+
+    with _listener_lock:
+        if _listener is None or _listener_pid != pid:
+            listener = InvalidationListener()
+
+            for channel, callback in _subscriptions:
+                listener.subscribe(channel, callback)
+
+            listener.start()
+            _listener = listener
+            _listener_pid = pid
+
+    return _listener
+
+
+def _get_redis():
+    """
+    Returns this process's Redis client, or None when no shared cache is
+    configured.
+    """
+
+    global _redis_client, _redis_pid
+
+    if redis is None or not Configuration.REDIS_URL:
+        return None
+
+    pid = os.getpid()
+
+    if _redis_client is None or _redis_pid != pid:
+        _redis_client = redis.Redis.from_url(Configuration.REDIS_URL,
+                                             socket_connect_timeout=Configuration.REDIS_TIMEOUT,
+                                             socket_timeout=Configuration.REDIS_TIMEOUT)
+        _redis_pid = pid
+
+    return _redis_client
+
+
+def _on_entity_cache_notification(payload: str) -> None:
+    if payload is None:
+        for other in _entity_caches.values():
+            other.clear_local()
+
+        _clear_search_caches(None)
+    else:
+        name, key = payload.split(":", 1)
+
+        if key.isdigit():
+            key = int(key)
+
+        for other in _entity_caches.values():
+            other.drop_local(name, key)
+
+        _clear_search_caches(name)
+
+
+@app.before_request
+def ensure_listener() -> None:
+    _get_listener()
+
+
+def entity_cache(name: str,
+                 max_size: int,
+                 ttl: float,
+                 dependencies: dict[str, Callable[[Any, Hashable], bool]] = None) -> EntityCache:
+    """
+    Creates and registers the entity cache called name. Call once per
+    entity type at import time.
+    """
+
+    ret = EntityCache(name, max_size, ttl, dependencies)
+    _entity_caches[name] = ret
+
+    return ret
+
+
+def get_entity_cache_stats() -> dict[str, dict]:
+    return {name: entity_cache.stats() for name, entity_cache in _entity_caches.items()}
+
+
+def get_search_cache_stats() -> dict[str, dict]:
+    return {name: search_cache.stats() for name, search_cache in _search_caches.items()}
+
+
+def normalize_query(query: str) -> str:
+    """
+    Folds case and whitespace, neither of which changes what a full-text
+    search matches, so equivalent queries share a cache entry.
+    """
+
+    if not query:
+        return query
+
+    return " ".join(query.lower().split())
+
+
+def publish(channel: str,
+            payload: str) -> None:
+    """
+    Sends an invalidation to every worker (including this one). Inside a
+    request the notification goes out when the request's transaction
+    commits, so other workers never reload data that isn't visible yet.
+    """
+
+    conn = None
+    cursor = None
+
+    try:
+        conn = db.connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT pg_notify(%s, %s);
+            """,
+            (channel, payload)
+        )
+        conn.commit()
+    except Exception as e:
+        print(e)
+    finally:
+        if cursor:
+            cursor.close()
+
+        if conn:
+            conn.close()
+
+
+def search_cache(name: str,
+                 dependencies: frozenset[str],
+                 max_size: int = Configuration.SEARCH_CACHE_MAX_SIZE,
+                 ttl: float = Configuration.SEARCH_CACHE_TTL) -> SearchCache:
+    """
+    Creates and registers the search cache called name. Call once per
+    search at import time.
+    """
+
+    ret = SearchCache(name, max_size, ttl, dependencies)
+    _search_caches[name] = ret
+
+    return ret
+
+
+def subscribe(channel: str,
+              callback: Callable[[str], None]) -> None:
+    """
+    Registers callback for notifications published on channel. Typically
+    called at import time; the listener itself starts lazily per process.
+    """
+
+    with _listener_lock:
+        _subscriptions.append((channel, callback))
+
+        if _listener is not None and _listener_pid == os.getpid():
+            _listener.subscribe(channel, callback)
+
+
+subscribe(ENTITY_CACHE_CHANNEL, _on_entity_cache_notification)
@@ -1,4 +1,7 @@
+import base64
+import json
 import re
+from typing import Any, Callable
 
 from app.config import Configuration, DatabaseTable, ProtocolKey, \
     ResponseStatus
@@ -58,6 +61,138 @@ class Common:
 
         return ret
 
+    @staticmethod
+    def clamp_page_size(page_size: str) -> int:
+        """
+        Parses a client-supplied page size, falling back to the default
+        and never exceeding the maximum.
+        """
+
+        ret = Configuration.PAGE_SIZE
+
+        if page_size:
+            try:
+                ret = min(max(int(page_size), 1), Configuration.PAGE_SIZE_MAX)
+            except ValueError:
+                pass
+
+        return ret
+
+    @staticmethod
+    def decode_cursor(cursor: str,
+                      types: tuple) -> list:
+        """
+        Unpacks a cursor made by encode_cursor(). types holds the expected
+        type (or tuple of types) of each sort key value. An empty cursor
+        decodes to None (the first page); one that's malformed or doesn't
+        match types, say because another listing issued it, raises
+        ValueError rather than quietly restarting from the first page.
+        """
+
+        if not cursor:
+            return None
+
+        try:
+            padding = "=" * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        except (ValueError, TypeError):
+            values = None
+
+        if not isinstance(values, list) or len(values) != len(types) or \
+                not all(isinstance(value, expected) and not isinstance(value, bool)
+                        for value, expected in zip(values, types)):
+            raise ValueError("Argument 'cursor' is not a valid cursor for this listing.")
+
+        return values
+
+    @staticmethod
+    def encode_cursor(values: list) -> str:
+        """
+        Packs the sort key of the last row on a page into an opaque token
+        the client passes back to get the next page.
+        """
+
+        data = json.dumps(values, separators=(",", ":")).encode()
+
+        return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+    @staticmethod
+    def estimate_row_count(table: DatabaseTable,
+                           condition: str = None) -> int:
+        """
+        The planner's row estimate for table, or for its rows matching the
+        SQL condition, which is kept up to date by autovacuum and costs
+        nothing to read. None if the table has never been analysed.
+        """
+
+        ret: int = None
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+
+            if condition:
+                # Planned, not run: the estimate comes from the column
+                # statistics.
+                cursor.execute(
+                    f"""
+                    EXPLAIN (FORMAT JSON) SELECT 1 FROM {table}
+                    WHERE {condition};
+                    """
+                )
+                result = cursor.fetchone()
+                conn.commit()
+
+                if result:
+                    plan = result["QUERY PLAN"]
+
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+
+                    ret = int(plan[0]["Plan"]["Plan Rows"])
+            else:
+                cursor.execute(
+                    """
+                    SELECT reltuples::bigint AS estimate FROM pg_class
+                    WHERE oid = %s::regclass;
+                    """,
+                    (table.value,)
+                )
+                result = cursor.fetchone()
+                conn.commit()
+
+                if result and result["estimate"] >= 0:
+                    ret = result["estimate"]
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
+    @staticmethod
+    def paginate(results: list,
+                 limit: int,
+                 key: Callable[[Any], list]) -> tuple[list, str]:
+        """
+        Takes rows fetched with a limit of limit + 1 and returns the page
+        along with the cursor for the next one, which is None on the last
+        page.
+        """
+
+        if len(results) <= limit:
+            return (results, None)
+
+        results = results[:limit]
+
+        return (results, Common.encode_cursor(key(results[-1])))
+
 
 ####################
 # MODULE FUNCTIONS #
@@ -106,3 +241,21 @@ def check_alias(alias: str) -> tuple[dict, ResponseStatus]:
             }
 
     return (response, response_status)
+
+
+def invalid_cursor() -> tuple[dict, ResponseStatus]:
+    """
+    The response for a listing handed a cursor it can't decode. Falling
+    back to the first page instead would send a client following
+    next_cursor round in circles.
+    """
+
+    response_status = ResponseStatus.BAD_REQUEST
+    response = {
+        ProtocolKey.ERROR: {
+            ProtocolKey.ERROR_CODE: response_status.value,
+            ProtocolKey.ERROR_MESSAGE: "Invalid parameter: 'cursor' is not a valid cursor for this listing."
+        }
+    }
+
+    return (response, response_status)
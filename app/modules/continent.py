@@ -1,7 +1,7 @@
 from typing import Any, TypeVar, Type
 
-from app.config import DatabaseTable, ProtocolKey
-from app.modules import db
+from app.config import ProtocolKey
+from app.modules import reference_data
 
 
 ###########
@@ -58,35 +58,7 @@ class Continent:
         if not continent_code:
             raise ValueError("Argument 'continent_code' must be a non-empty string.")
 
-        ret: Type[T] = None
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.CONTINENT}
-                WHERE {ProtocolKey.CODE} = %s;
-                """,
-                (continent_code,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = cls(result)
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return reference_data.get().continents_by_code.get(continent_code)
 
     @classmethod
     def get_by_name(cls: Type[T],
@@ -97,32 +69,4 @@ class Continent:
         if not continent_name:
             raise ValueError("Argument 'continent_name' must be a non-empty string.")
 
-        ret: Type[T] = None
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.CONTINENT}
-                WHERE {ProtocolKey.NAME} = %s;
-                """,
-                (continent_name,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = cls(result)
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return reference_data.get().continents_by_name.get(continent_name)
@@ -1,7 +1,7 @@
 from typing import Any, TypeVar, Type
 
-from app.config import DatabaseTable, ProtocolKey, ResponseStatus
-from app.modules import db
+from app.config import ProtocolKey, ResponseStatus
+from app.modules import reference_data
 from app.modules.continent import Continent
 from app.modules.currency import Currency
 
@@ -88,36 +88,9 @@ class Country:
         if not alpha_2_code:
             raise ValueError("Argument 'alpha_2_code' must be a non-empty string.")
 
-        ret = False
-        conn = None
-        cursor = None
         alpha_2_code = alpha_2_code.strip().upper()
 
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.COUNTRY}
-                WHERE {ProtocolKey.ALPHA_2_CODE} = %s;
-                """,
-                (alpha_2_code,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = True
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return alpha_2_code in reference_data.get().countries_by_alpha_2_code
 
     @classmethod
     def get_all(cls: Type[T],
@@ -125,37 +98,12 @@ class Country:
         if not isinstance(enabled_only, bool):
             raise TypeError(f"Argument 'enabled_only' must be of type bool, not {type(enabled_only)}.")
 
-        ret = []
-        conn = None
-        cursor = None
+        registry = reference_data.get()
 
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-
-            if enabled_only:
-                cursor.execute(
-                    f"""
-                    SELECT * FROM {DatabaseTable.COUNTRY}
-                    WHERE {ProtocolKey.IS_ENABLED} = true;
-                    """
-                )
-            else:
-                cursor.execute(f"""SELECT * FROM {DatabaseTable.COUNTRY}""")
-
-            results = cursor.fetchall()
-            conn.commit()
-
-            for result in results:
-                ret.append(cls(result))
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
+        if enabled_only:
+            ret = list(registry.enabled_countries)
+        else:
+            ret = list(registry.countries)
 
         return ret
 
@@ -168,35 +116,7 @@ class Country:
         if not continent_code:
             raise ValueError("Argument 'continent_code' must be a non-empty string.")
 
-        ret = []
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.COUNTRY}
-                WHERE {ProtocolKey.CONTINENT_CODE} = %s;
-                """,
-                (continent_code,)
-            )
-            results = cursor.fetchall()
-            conn.commit()
-
-            for result in results:
-                ret.append(cls(result))
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return list(reference_data.get().countries_by_continent.get(continent_code, []))
 
     @classmethod
     def get_by_alpha_2_code(cls: Type[T],
@@ -207,35 +127,7 @@ class Country:
         if not alpha_2_code:
             raise ValueError("Argument 'alpha_2_code' must be a non-empty string.")
 
-        ret: Type[T] = None
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.COUNTRY}
-                WHERE {ProtocolKey.ALPHA_2_CODE} = %s;
-                """,
-                (alpha_2_code,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = cls(result)
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return reference_data.get().countries_by_alpha_2_code.get(alpha_2_code)
 
     @classmethod
     def get_by_alpha_3_code(cls: Type[T],
@@ -246,35 +138,7 @@ class Country:
         if not alpha_3_code:
             raise ValueError("Argument 'alpha_3_code' must be a non-empty string.")
 
-        ret: Type[T] = None
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.COUNTRY}
-                WHERE {ProtocolKey.ALPHA_3_CODE} = %s;
-                """,
-                (alpha_3_code,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = cls(result)
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return reference_data.get().countries_by_alpha_3_code.get(alpha_3_code)
 
     @classmethod
     def get_by_name(cls: Type[T],
@@ -285,35 +149,7 @@ class Country:
         if not country_name:
             raise ValueError("Argument 'country_name' must be a non-empty string.")
 
-        ret: Type[T] = None
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.COUNTRY}
-                WHERE {ProtocolKey.NAME} = %s;
-                """,
-                (country_name,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = cls(result)
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return reference_data.get().countries_by_name.get(country_name)
 
     @classmethod
     def get_by_numeric_3_code(cls: Type[T],
@@ -324,35 +160,7 @@ class Country:
         if not numeric_3_code:
             raise ValueError("Argument 'numeric_3_code' must be a non-empty string.")
 
-        ret: Type[T] = None
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.COUNTRY}
-                WHERE {ProtocolKey.NUMERIC_3_CODE} = %s;
-                """,
-                (numeric_3_code,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = cls(result)
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return reference_data.get().countries_by_numeric_3_code.get(numeric_3_code)
 
 
 ####################
@@ -382,3 +190,24 @@ def get_all(is_enabled: str = None) -> tuple[dict, ResponseStatus]:
     }
 
     return (response, response_status)
+
+
+def get_all_serialized(is_enabled: str = None) -> reference_data.SerializedBody:
+    """
+    Same response as get_all(), preserialized along with its ETag.
+    """
+
+    if is_enabled:
+        try:
+            is_enabled = bool(is_enabled)
+        except ValueError:
+            is_enabled = False
+    else:
+        is_enabled = False
+
+    if is_enabled:
+        ret = reference_data.get_body("countries:enabled")
+    else:
+        ret = reference_data.get_body("countries")
+
+    return ret
@@ -1,7 +1,7 @@
 from typing import Any, TypeVar, Type
 
-from app.config import DatabaseTable, ProtocolKey, ResponseStatus
-from app.modules import db
+from app.config import ProtocolKey, ResponseStatus
+from app.modules import reference_data
 from app.modules.country import Country
 
 
@@ -65,43 +65,12 @@ class CountryDialingCode:
         if not isinstance(enabled_only, bool):
             raise TypeError(f"Argument 'enabled_only' must be of type bool, not {type(enabled_only)}.")
 
-        ret = []
-        conn = None
-        cursor = None
+        registry = reference_data.get()
 
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-
-            if enabled_only:
-                cursor.execute(
-                    f"""
-                    SELECT * FROM {DatabaseTable.COUNTRY_DIALING_CODE}
-                    WHERE {ProtocolKey.ALPHA_2_CODE} IN
-                        (SELECT {ProtocolKey.ALPHA_2_CODE} FROM {DatabaseTable.COUNTRY}
-                        WHERE {ProtocolKey.IS_ENABLED} = true);
-                    """
-                )
-            else:
-                cursor.execute(
-                    f"""
-                    SELECT * FROM {DatabaseTable.COUNTRY_DIALING_CODE};
-                    """
-                )
-
-            results = cursor.fetchall()
-            conn.commit()
-
-            for result in results:
-                ret.append(cls(result))
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
+        if enabled_only:
+            ret = list(registry.enabled_dialing_codes)
+        else:
+            ret = list(registry.dialing_codes)
 
         return ret
 
@@ -114,35 +83,7 @@ class CountryDialingCode:
         if not alpha_2_code:
             raise ValueError("Argument 'alpha_2_code' must be a non-empty string.")
 
-        ret = []
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.COUNTRY_DIALING_CODE}
-                WHERE {ProtocolKey.ALPHA_2_CODE} = %s;
-                """,
-                (alpha_2_code,)
-            )
-            results = cursor.fetchall()
-            conn.commit()
-
-            for result in results:
-                ret.append(cls(result))
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return list(reference_data.get().dialing_codes_by_country.get(alpha_2_code, []))
 
     @classmethod
     def get_by_country_and_dialing_code(cls: Type[T],
@@ -160,35 +101,7 @@ class CountryDialingCode:
         if not dialing_code:
             raise ValueError("Argument 'dialing_code' must be a non-empty string.")
 
-        ret: Type[T] = None
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.COUNTRY_DIALING_CODE}
-                WHERE {ProtocolKey.ALPHA_2_CODE} = %s AND {ProtocolKey.CODE} = %s;
-                """,
-                (alpha_2_code, dialing_code,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = cls(result)
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return reference_data.get().dialing_codes_by_country_and_code.get((alpha_2_code, dialing_code))
 
     @classmethod
     def get_by_id(cls: Type[T],
@@ -199,35 +112,7 @@ class CountryDialingCode:
         if dialing_code_id <= 0:
             raise ValueError("Argument 'dialing_code_id' must be a positive, non-zero integer.")
 
-        ret: Type[T] = None
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.COUNTRY_DIALING_CODE}
-                WHERE {ProtocolKey.ID} = %s;
-                """,
-                (dialing_code_id,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = cls(result)
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return reference_data.get().dialing_codes_by_id.get(dialing_code_id)
 
 
 ####################
@@ -257,3 +142,24 @@ def get_all(is_enabled: str = None) -> tuple[dict, ResponseStatus]:
     }
 
     return (response, response_status)
+
+
+def get_all_serialized(is_enabled: str = None) -> reference_data.SerializedBody:
+    """
+    Same response as get_all(), preserialized along with its ETag.
+    """
+
+    if is_enabled:
+        try:
+            is_enabled = bool(is_enabled)
+        except ValueError:
+            is_enabled = False
+    else:
+        is_enabled = False
+
+    if is_enabled:
+        ret = reference_data.get_body("dialing_codes:enabled")
+    else:
+        ret = reference_data.get_body("dialing_codes")
+
+    return ret
@@ -1,7 +1,7 @@
 from typing import Any, TypeVar, Type
 
-from app.config import DatabaseTable, ProtocolKey
-from app.modules import db
+from app.config import ProtocolKey
+from app.modules import reference_data
 
 
 ###########
@@ -57,62 +57,13 @@ class Currency:
         if not currency_code:
             raise ValueError("Argument 'currency_code' must be a non-empty string.")
 
-        ret = False
-        conn = None
-        cursor = None
         currency_code = currency_code.strip().upper()
 
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.CURRENCY}
-                WHERE {ProtocolKey.CODE} = %s;
-                """,
-                (currency_code,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = True
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return currency_code in reference_data.get().currencies_by_code
 
     @classmethod
     def get_all(cls: Type[T]) -> list[T]:
-        ret = []
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(f"""SELECT * FROM {DatabaseTable.CURRENCY}""")
-            results = cursor.fetchall()
-            conn.commit()
-
-            for result in results:
-                ret.append(cls(result))
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return list(reference_data.get().currencies)
 
     @classmethod
     def get_by_code(cls: Type[T],
@@ -123,32 +74,4 @@ class Currency:
         if not currency_code:
             raise ValueError("Argument 'currency_code' must be a non-empty string.")
 
-        ret: Type[T] = None
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.CURRENCY}
-                WHERE {ProtocolKey.CODE} = %s;
-                """,
-                (currency_code,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = cls(result)
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return reference_data.get().currencies_by_code.get(currency_code)
@@ -1,11 +1,457 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable
+
 import psycopg2
+from flask import g, has_request_context, make_response, Response
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError
 
 from app import app
-from app.config import Configuration
+from app.config import Configuration, ProtocolKey, ResponseStatus
+
+
+###########
+# CLASSES #
+###########
+
+
+class _PoolEntry:
+    """
+    Bookkeeping for a single physical connection owned by a pool.
+    """
+
+    def __init__(self,
+                 conn) -> None:
+        self.conn = conn
+        self.creation_time: float = time.monotonic()
+        self.last_used: float = self.creation_time
+
+
+class PooledConnection:
+    """
+    Proxy handed out by connect(). It behaves like a regular psycopg2
+    connection except that close() returns the underlying connection
+    to the pool instead of closing it.
+    """
+
+    def __init__(self,
+                 pool: "ConnectionPool",
+                 entry: _PoolEntry) -> None:
+        self._entry = entry
+        self._pool = pool
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __getattr__(self, name: str):
+        if self._entry is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+
+        return getattr(self._entry.conn, name)
+
+    def close(self) -> None:
+        if self._entry is not None:
+            entry = self._entry
+            self._entry = None
+            self._pool.release(entry)
+
+    @property
+    def closed(self) -> int:
+        if self._entry is None:
+            return 1
+
+        return self._entry.conn.closed
+
+
+class _Savepoints:
+    """
+    The savepoints open on a request's connection, innermost last.
+    Releasing a savepoint also releases every one opened after it, so
+    one is only released once the views that opened it and everything
+    after it are closed. The release rides along with the next
+    statement; whatever is still open when the request ends goes with
+    the commit.
+    """
+
+    def __init__(self) -> None:
+        self.closed: set[str] = set()
+        self.count = 0
+        self.open: list[str] = []
+        self.pending_release: str = None
+
+    def close(self,
+              savepoint: str) -> None:
+        self.closed.add(savepoint)
+
+        while self.open and self.open[-1] in self.closed:
+            # Anything still pending was opened after this one, so this
+            # release covers it too.
+            self.pending_release = self.open.pop()
+            self.closed.discard(self.pending_release)
+
+    def flush(self) -> str:
+        if not self.pending_release:
+            return ""
+
+        ret = f"RELEASE SAVEPOINT {self.pending_release}; "
+        self.pending_release = None
+
+        return ret
+
+    def rolled_back(self,
+                    savepoint: str) -> None:
+        # Rolling back destroys every savepoint opened after this one,
+        # including any waiting to be released.
+        index = self.open.index(savepoint)
+
+        for other in self.open[index + 1:]:
+            self.closed.discard(other)
+
+        del self.open[index + 1:]
+        self.pending_release = None
+
+
+class RequestConnection:
+    """
+    A view onto the connection shared by everything running in the
+    current request. commit() and close() are no-ops; the transaction is
+    committed once when the request finishes. Each view opens a savepoint
+    with its first statement so a failed query only unwinds the work done
+    through that view, leaving the rest of the request's transaction
+    usable. The savepoint is released once the view is closed.
+    """
+
+    def __init__(self,
+                 conn: PooledConnection,
+                 savepoints: _Savepoints) -> None:
+        savepoints.count += 1
+
+        self._conn = conn
+        self._savepoint = f"sp_{savepoints.count}"
+        self._savepoint_set = False
+        self._savepoints = savepoints
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __getattr__(self, name: str):
+        return getattr(self._conn, name)
+
+    def _begin(self) -> str:
+        ret = self._savepoints.flush()
+
+        if not self._savepoint_set:
+            self._savepoint_set = True
+            self._savepoints.open.append(self._savepoint)
+            ret += f"SAVEPOINT {self._savepoint}; "
+
+        return ret
+
+    def _is_open(self) -> bool:
+        return self._savepoint_set and \
+            self._savepoint in self._savepoints.open and \
+            not self._conn.closed
+
+    def close(self) -> None:
+        if not self._is_open():
+            return
+
+        if self._conn.info.transaction_status == extensions.TRANSACTION_STATUS_INERROR:
+            self.rollback()
+
+        self._savepoints.close(self._savepoint)
+
+    def commit(self) -> None:
+        pass
+
+    def cursor(self, *args, **kwargs):
+        return _RequestCursor(self, self._conn.cursor(*args, **kwargs))
+
+    def rollback(self) -> None:
+        if self._is_open():
+            cursor = self._conn.cursor()
+            try:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {self._savepoint};")
+            finally:
+                cursor.close()
+
+            self._savepoints.rolled_back(self._savepoint)
+
+
+class _RequestCursor:
+    """
+    Cursor proxy that piggybacks its RequestConnection's savepoint onto
+    the first statement it runs, so it costs no extra round trip.
+    """
+
+    def __init__(self,
+                 conn: RequestConnection,
+                 cursor) -> None:
+        self._conn = conn
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._cursor.close()
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, query, vars=None):
+        prefix = self._conn._begin()
+
+        if prefix and isinstance(query, str):
+            query = prefix + query
+        elif prefix:
+            self._cursor.execute(prefix)
+
+        return self._cursor.execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        prefix = self._conn._begin()
+
+        if prefix:
+            self._cursor.execute(prefix)
+
+        return self._cursor.executemany(query, vars_list)
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of Postgres connections. Connections are recycled
+    once they outlive max_lifetime and are pinged before reuse if they
+    sat idle for longer than health_check_interval. When every connection
+    is checked out, callers block for up to timeout seconds.
+    """
+
+    def __init__(self,
+                 min_size: int,
+                 max_size: int,
+                 max_lifetime: int,
+                 health_check_interval: int,
+                 timeout: float,
+                 **connect_kwargs) -> None:
+        self.connect_kwargs = connect_kwargs
+        self.health_check_interval = health_check_interval
+        self.max_lifetime = max_lifetime
+        self.max_size = max(max_size, 1)
+        self.min_size = min(max(min_size, 0), self.max_size)
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._idle: deque[_PoolEntry] = deque()
+        self._size = 0
+        self._stats = {
+            "checkouts": 0,
+            "connections_created": 0,
+            "connections_recycled": 0,
+            "exhausted": 0,
+            "health_check_failures": 0,
+            "timeouts": 0,
+            "wait_time": 0.0
+        }
+
+    def _close_entry(self,
+                     entry: _PoolEntry) -> None:
+        try:
+            entry.conn.close()
+        except Exception as e:
+            print(e)
+
+        with self._condition:
+            self._size -= 1
+            self._stats["connections_recycled"] += 1
+            self._condition.notify()
+
+    def _is_expired(self,
+                    entry: _PoolEntry) -> bool:
+        return self.max_lifetime > 0 and \
+            time.monotonic() - entry.creation_time >= self.max_lifetime
+
+    def _is_healthy(self,
+                    entry: _PoolEntry) -> bool:
+        conn = entry.conn
+
+        if conn.closed:
+            return False
+
+        if self.health_check_interval <= 0 or \
+                time.monotonic() - entry.last_used < self.health_check_interval:
+            return True
+
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            conn.rollback()
+
+            return True
+        except Exception as e:
+            print(e)
+
+            with self._condition:
+                self._stats["health_check_failures"] += 1
 
+            return False
+        finally:
+            if cursor and not cursor.closed:
+                cursor.close()
 
-def connect():
+    def _open(self) -> _PoolEntry:
+        conn = psycopg2.connect(**self.connect_kwargs)
+
+        with self._condition:
+            self._stats["connections_created"] += 1
+
+        return _PoolEntry(conn)
+
+    def close_all(self) -> None:
+        with self._condition:
+            idle = list(self._idle)
+            self._idle.clear()
+
+        for entry in idle:
+            self._close_entry(entry)
+
+    def get(self) -> PooledConnection:
+        deadline = time.monotonic() + self.timeout
+        waited = False
+
+        while True:
+            entry = None
+
+            with self._condition:
+                while True:
+                    if self._idle:
+                        # LIFO keeps the hot connections hot and lets the
+                        # rest age out through max_lifetime.
+                        entry = self._idle.pop()
+                        break
+
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+
+                    if not waited:
+                        waited = True
+                        self._stats["exhausted"] += 1
+
+                    remaining = deadline - time.monotonic()
+
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        print(f"Database connection pool exhausted ({self.max_size} connections in use).")
+
+                        raise PoolError("connection pool exhausted")
+
+                    wait_start = time.monotonic()
+                    self._condition.wait(remaining)
+                    self._stats["wait_time"] += time.monotonic() - wait_start
+
+            if entry is None:
+                try:
+                    entry = self._open()
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+            elif self._is_expired(entry) or not self._is_healthy(entry):
+                self._close_entry(entry)
+                continue
+
+            with self._condition:
+                self._stats["checkouts"] += 1
+
+            return PooledConnection(self, entry)
+
+    def prefill(self) -> None:
+        """
+        Opens connections until the pool holds at least min_size of them.
+        """
+
+        while True:
+            with self._condition:
+                if self._size >= self.min_size:
+                    break
+
+                self._size += 1
+
+            try:
+                entry = self._open()
+            except Exception as e:
+                print(e)
+
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                break
+
+            self.release(entry)
+
+    def release(self,
+                entry: _PoolEntry) -> None:
+        conn = entry.conn
+        discard = bool(conn.closed) or self._is_expired(entry)
+
+        if not discard and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            # Never hand a connection with an open (or failed) transaction
+            # to the next caller.
+            try:
+                conn.rollback()
+            except Exception as e:
+                print(e)
+                discard = True
+
+        if discard:
+            self._close_entry(entry)
+        else:
+            entry.last_used = time.monotonic()
+
+            with self._condition:
+                self._idle.append(entry)
+                self._condition.notify()
+
+    def stats(self) -> dict:
+        with self._condition:
+            ret = dict(self._stats)
+            ret["idle"] = len(self._idle)
+            ret["in_use"] = self._size - len(self._idle)
+            ret["max_size"] = self.max_size
+            ret["size"] = self._size
+
+        return ret
+
+
+####################
+# MODULE FUNCTIONS #
+####################
+
+
+_pool: ConnectionPool = None
+_pool_lock = threading.Lock()
+_pool_pid: int = None
+# Pools inherited from a parent process across fork(). They're kept
+# referenced so their sockets (shared with the parent) are never
+# finalized from the child.
+_inherited_pools: list[ConnectionPool] = []
+
+
+def _connection_parameters() -> dict:
     if app.debug:
         host = "localhost"
         password = ""
@@ -13,10 +459,156 @@ def connect():
         host = Configuration.AWS_EC2_PROD_DATABASE_HOST
         password = Configuration.AWS_EC2_PROD_PASSWORD
 
-    conn = psycopg2.connect(host=host,
-                            database=Configuration.DATABASE_NAME,
-                            user=Configuration.DATABASE_USER,
-                            password=password,
-                            cursor_factory=RealDictCursor)
+    return {
+        "host": host,
+        "database": Configuration.DATABASE_NAME,
+        "user": Configuration.DATABASE_USER,
+        "password": password,
+        "cursor_factory": RealDictCursor
+    }
+
+
+def _get_pool() -> ConnectionPool:
+    global _pool, _pool_pid
+
+    pid = os.getpid()
+
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            if _pool is not None:
+                _inherited_pools.append(_pool)
+
+            _pool = ConnectionPool(min_size=Configuration.DATABASE_POOL_MIN_SIZE,
+                                   max_size=Configuration.DATABASE_POOL_MAX_SIZE,
+                                   max_lifetime=Configuration.DATABASE_POOL_MAX_LIFETIME,
+                                   health_check_interval=Configuration.DATABASE_POOL_HEALTH_CHECK_INTERVAL,
+                                   timeout=Configuration.DATABASE_POOL_TIMEOUT,
+                                   **_connection_parameters())
+            _pool_pid = pid
+            _pool.prefill()
+
+    return _pool
+
+
+def connect() -> PooledConnection | RequestConnection:
+    """
+    Inside a request, returns a view onto the request's connection
+    (checked out on first use). Elsewhere, e.g. in background jobs,
+    checks out a connection from this process's pool; calling close()
+    on it hands it back to the pool.
+    """
+
+    if not has_request_context():
+        return _get_pool().get()
+
+    conn = g.get("db_conn")
+
+    if conn is None:
+        conn = _get_pool().get()
+        g.db_conn = conn
+        g.db_savepoints = _Savepoints()
+
+    return RequestConnection(conn, g.db_savepoints)
+
+
+@app.after_request
+def end_request_transaction(response: Response) -> Response:
+    """
+    Commits the request's transaction before the response goes out so a
+    client never sees success for work that didn't persist. Errors roll
+    back everything the request did, unless it asked to keep its writes
+    with commit_on_client_error() and the error is the client's.
+    """
+
+    conn: PooledConnection = g.pop("db_conn", None)
+    callbacks: list[Callable[[], None]] = g.pop("db_after_commit", [])
+    keep_on_client_error = g.pop("db_commit_on_client_error", False)
+
+    if conn is not None:
+        try:
+            if response.status_code >= 500 or \
+                    (response.status_code >= 400 and not keep_on_client_error):
+                conn.rollback()
+            else:
+                conn.commit()
+
+                for callback in callbacks:
+                    try:
+                        callback()
+                    except Exception as e:
+                        print(e)
+        except Exception as e:
+            print(e)
+
+            error = {
+                ProtocolKey.ERROR: {
+                    ProtocolKey.ERROR_CODE: ResponseStatus.INTERNAL_SERVER_ERROR.value,
+                    ProtocolKey.ERROR_MESSAGE: "The request could not be completed."
+                }
+            }
+            response = make_response(error, 500)
+        finally:
+            conn.close()
+
+    return response
+
+
+@app.teardown_request
+def release_request_connection(exception: BaseException = None) -> None:
+    # Only reached with a connection still bound when after_request didn't
+    # run, i.e. the handler raised.
+    conn: PooledConnection = g.pop("db_conn", None)
+    g.pop("db_after_commit", None)
+    g.pop("db_commit_on_client_error", None)
+
+    if conn is not None:
+        try:
+            conn.rollback()
+        except Exception as e:
+            print(e)
+        finally:
+            conn.close()
+
+
+def after_commit(callback: Callable[[], None]) -> None:
+    """
+    Runs callback once the current request's transaction has committed,
+    and not at all if it rolls back. Outside a request, or before the
+    request has touched the database, it runs right away.
+    """
+
+    if has_request_context() and g.get("db_conn") is not None:
+        g.setdefault("db_after_commit", []).append(callback)
+    else:
+        callback()
+
+
+def commit_on_client_error() -> None:
+    """
+    Keeps the current request's writes even if it ends up responding
+    with a 4xx, for bookkeeping that has to stick when the client gets
+    something wrong, e.g. counting failed verification attempts.
+    """
+
+    if has_request_context():
+        g.db_commit_on_client_error = True
+
+
+def connect_unpooled(autocommit: bool = False):
+    """
+    Opens a dedicated connection that never enters the pool. Meant for
+    long-lived uses such as LISTEN, or one-offs outside any worker; the
+    caller must close it.
+    """
+
+    conn = psycopg2.connect(**_connection_parameters())
+    conn.autocommit = autocommit
 
     return conn
+
+
+def get_pool_stats() -> dict:
+    return _get_pool().stats()
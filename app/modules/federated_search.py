@@ -0,0 +1,221 @@
+from typing import Any, Callable
+
+from app.config import (Configuration, ContentVisibility, DatabaseTable,
+                        EntityType, ProtocolKey, ResponseStatus)
+from app.modules import cache, db
+from app.modules.brand import Brand
+from app.modules.product import Product
+from app.modules.store import Store
+from app.modules.user_account import UserAccount
+
+
+###########
+# CLASSES #
+###########
+
+
+class Search:
+    """
+    Federated full-text search over brands, products, stores and user
+    accounts. Every type is ranked against the same tsquery on its
+    generated ts_name/ts_alias column, capped at a per-type quota, and the
+    lot is merged into a single relevance-ordered list in one query.
+    """
+
+    # Per type: the key its entities are serialized under in results, and
+    # the batch function hydrating them by ID.
+    ENTITIES: dict[EntityType, tuple[ProtocolKey, Callable[[list[int]], dict]]] = {
+        EntityType.BRAND: (ProtocolKey.BRAND, Brand.get_all_by_ids),
+        EntityType.PRODUCT: (ProtocolKey.PRODUCT, Product.get_all_by_ids),
+        EntityType.STORE: (ProtocolKey.STORE, Store.get_all_by_ids),
+        EntityType.USER_ACCOUNT: (ProtocolKey.USER_ACCOUNT, UserAccount.get_all_by_ids)
+    }
+
+    @staticmethod
+    def get_ranked_ids(query: str,
+                       quota: int = Configuration.SEARCH_QUOTA_PER_TYPE,
+                       limit: int = Configuration.SEARCH_RESULT_LIMIT) -> list[tuple[EntityType, int]]:
+        """
+        Returns (type, ID) pairs for the best matches, most relevant first.
+        No type contributes more than quota results.
+        """
+
+        if not isinstance(query, str):
+            raise TypeError(f"Argument 'query' must be of type str, not {type(query)}.")
+
+        if not query:
+            raise ValueError("Argument 'query' must be a non-empty string.")
+
+        ret: list[tuple[EntityType, int]] = []
+        conn = None
+        cursor = None
+        visible = f"{ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})"
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                WITH q AS (
+                    SELECT plainto_tsquery('english', %(query)s) AS tsquery
+                )
+                SELECT * FROM
+                (
+                    (SELECT
+                        {EntityType.BRAND.value} AS {ProtocolKey.TYPE},
+                        b.{ProtocolKey.ID},
+                        ts_rank(b.{ProtocolKey.POSTGRES_SEARCH_NAME}, q.tsquery) AS rank
+                    FROM
+                        {DatabaseTable.BRAND} AS b, q
+                    WHERE
+                        b.{ProtocolKey.POSTGRES_SEARCH_NAME} @@ q.tsquery
+                    AND
+                        b.{visible}
+                    ORDER BY
+                        rank DESC, b.{ProtocolKey.ID} DESC
+                    LIMIT
+                        %(quota)s)
+                    UNION ALL
+                    (SELECT
+                        {EntityType.PRODUCT.value} AS {ProtocolKey.TYPE},
+                        p.{ProtocolKey.ID},
+                        ts_rank(p.{ProtocolKey.POSTGRES_SEARCH_NAME}, q.tsquery) AS rank
+                    FROM
+                        {DatabaseTable.PRODUCT} AS p, q
+                    WHERE
+                        (p.{ProtocolKey.POSTGRES_SEARCH_NAME} @@ q.tsquery OR p.{ProtocolKey.ALIAS} LIKE %(alias_pattern)s)
+                    AND
+                        p.{visible}
+                    ORDER BY
+                        rank DESC, p.{ProtocolKey.ID} DESC
+                    LIMIT
+                        %(quota)s)
+                    UNION ALL
+                    (SELECT
+                        {EntityType.STORE.value} AS {ProtocolKey.TYPE},
+                        s.{ProtocolKey.ID},
+                        ts_rank(s.{ProtocolKey.POSTGRES_SEARCH_NAME}, q.tsquery) AS rank
+                    FROM
+                        {DatabaseTable.STORE} AS s, q
+                    WHERE
+                        s.{ProtocolKey.POSTGRES_SEARCH_NAME} @@ q.tsquery
+                    AND
+                        s.{visible}
+                    ORDER BY
+                        rank DESC, s.{ProtocolKey.ID} DESC
+                    LIMIT
+                        %(quota)s)
+                    UNION ALL
+                    (SELECT
+                        {EntityType.USER_ACCOUNT.value} AS {ProtocolKey.TYPE},
+                        ua.{ProtocolKey.ID},
+                        ts_rank(ua.{ProtocolKey.POSTGRES_SEARCH_ALIAS}, q.tsquery) AS rank
+                    FROM
+                        {DatabaseTable.USER_ACCOUNT} AS ua, q
+                    WHERE
+                        ua.{ProtocolKey.POSTGRES_SEARCH_ALIAS} @@ q.tsquery
+                    ORDER BY
+                        rank DESC, ua.{ProtocolKey.ID} DESC
+                    LIMIT
+                        %(quota)s)
+                ) AS match
+                ORDER BY
+                    match.rank DESC, match.{ProtocolKey.TYPE}, match.{ProtocolKey.ID} DESC
+                LIMIT
+                    %(limit)s;
+                """,
+                {
+                    "alias_pattern": f"%{query.replace(' ', '').lower()}%",
+                    "limit": limit,
+                    "query": query,
+                    "quota": quota
+                }
+            )
+            results = cursor.fetchall()
+            conn.commit()
+
+            for result in results:
+                ret.append((EntityType(result[ProtocolKey.TYPE]), result[ProtocolKey.ID]))
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
+    @staticmethod
+    def get_results(query: str) -> list[tuple[EntityType, Any]]:
+        """
+        The ranked matches for query as (type, entity) pairs. Entities are
+        hydrated with one batch query per type present.
+        """
+
+        ret: list[tuple[EntityType, Any]] = []
+        ranked = Search.get_ranked_ids(query)
+        entities: dict[EntityType, dict[int, Any]] = {}
+
+        for entity_type, (_, get_all_by_ids) in Search.ENTITIES.items():
+            entity_ids = [entity_id for ranked_type, entity_id in ranked if ranked_type == entity_type]
+
+            if entity_ids:
+                entities[entity_type] = get_all_by_ids(entity_ids)
+
+        for entity_type, entity_id in ranked:
+            entity = entities.get(entity_type, {}).get(entity_id)
+
+            # Could have been deleted between the two queries.
+            if entity:
+                ret.append((entity_type, entity))
+
+        return ret
+
+
+####################
+# MODULE FUNCTIONS #
+####################
+
+
+search_cache = cache.search_cache(
+    "search",
+    dependencies=frozenset(["brand", "product", "store", "user_account"])
+)
+
+
+def search(query: str) -> tuple[dict, ResponseStatus]:
+    return search_cache.get(cache.normalize_query(query), lambda: _search(query))
+
+
+def _search(query: str) -> tuple[dict, ResponseStatus]:
+    if query:
+        query = query.strip()
+
+    if not query:
+        response_status = ResponseStatus.BAD_REQUEST
+        error_message = "Invalid or missing parameter: 'query' must be a non-empty string."
+
+        response = {
+            ProtocolKey.ERROR: {
+                ProtocolKey.ERROR_CODE: response_status.value,
+                ProtocolKey.ERROR_MESSAGE: error_message
+            }
+        }
+    else:
+        response_status = ResponseStatus.OK
+        serialized = []
+
+        for entity_type, entity in Search.get_results(query):
+            key, _ = Search.ENTITIES[entity_type]
+            serialized.append({
+                ProtocolKey.TYPE: entity_type.value,
+                key: entity.as_dict()
+            })
+
+        response = {
+            ProtocolKey.RESULTS: serialized
+        }
+
+    return (response, response_status)
@@ -0,0 +1,144 @@
+from typing import Any, Callable, Hashable, Iterable
+
+from flask import g, has_request_context
+
+
+###########
+# CLASSES #
+###########
+
+
+class BatchLoader:
+    """
+    Resolves keys through a batch function that takes a list of keys and
+    returns a dict mapping each key it found to its value. Keys queued up
+    front are fetched together the first time any of them is loaded, and
+    results are kept for the loader's lifetime so each key is fetched at
+    most once.
+    """
+
+    def __init__(self,
+                 batch_function: Callable[[list], dict]) -> None:
+        self.batch_function = batch_function
+        self._cache: dict[Hashable, Any] = {}
+        self._queue: dict[Hashable, None] = {}
+
+    def clear(self,
+              key: Hashable = None) -> None:
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+    def dispatch(self) -> None:
+        keys = [key for key in self._queue if key not in self._cache]
+        self._queue.clear()
+
+        if keys:
+            results = self.batch_function(keys)
+
+            for key in keys:
+                self._cache[key] = results.get(key)
+
+    def load(self,
+             key: Hashable) -> Any:
+        if key not in self._cache:
+            self._queue[key] = None
+            self.dispatch()
+
+        return self._cache.get(key)
+
+    def load_many(self,
+                  keys: Iterable[Hashable]) -> list:
+        keys = list(keys)
+        self.queue(keys)
+        self.dispatch()
+
+        return [self._cache.get(key) for key in keys]
+
+    def queue(self,
+              keys: Iterable[Hashable]) -> None:
+        for key in keys:
+            if key and key not in self._cache:
+                self._queue[key] = None
+
+
+####################
+# MODULE FUNCTIONS #
+####################
+
+
+_batch_functions: dict[Hashable, Callable[[list], dict]] = {}
+
+
+def get_loader(kind: Hashable) -> BatchLoader:
+    """
+    Returns the current request's loader for kind. Outside a request
+    every call gets a fresh loader, so nothing is memoised.
+    """
+
+    batch_function = _batch_functions[kind]
+
+    if not has_request_context():
+        return BatchLoader(batch_function)
+
+    loaders: dict[Hashable, BatchLoader] = g.setdefault("loaders", {})
+    ret = loaders.get(kind)
+
+    if ret is None:
+        ret = BatchLoader(batch_function)
+        loaders[kind] = ret
+
+    return ret
+
+
+def clear(kind: Hashable = None,
+          key: Hashable = None) -> None:
+    """
+    Forgets what the current request's loader for kind has fetched, or
+    every loader's if kind is None.
+    """
+
+    if not has_request_context():
+        return
+
+    loaders: dict[Hashable, BatchLoader] = g.get("loaders", {})
+
+    if kind is None:
+        for batch_loader in loaders.values():
+            batch_loader.clear()
+    elif kind in loaders:
+        loaders[kind].clear(key)
+
+
+def load(kind: Hashable,
+         key: Hashable) -> Any:
+    return get_loader(kind).load(key)
+
+
+def load_many(kind: Hashable,
+              keys: Iterable[Hashable]) -> list:
+    return get_loader(kind).load_many(keys)
+
+
+def prime(kind: Hashable,
+          keys: Iterable[Hashable]) -> None:
+    """
+    Queues keys so that the next load() of any of them fetches them all
+    in one go. A no-op outside a request.
+    """
+
+    if has_request_context():
+        get_loader(kind).queue(keys)
+
+
+def register(kind: Hashable,
+             batch_function: Callable[[list], dict]) -> None:
+    """
+    Registers the batch function resolving keys of kind. kind is an
+    EntityType for entities looked up by ID, or an (EntityType,
+    ProtocolKey) pair for a relation of that entity, e.g. a product's
+    tags.
+    """
+
+    _batch_functions[kind] = batch_function
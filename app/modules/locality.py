@@ -1,8 +1,12 @@
+import bisect
 from datetime import datetime
+import os
+import threading
 from typing import Any, TypeVar, Type
 
-from app.config import DatabaseTable, ProtocolKey, ResponseStatus
-from app.modules import db
+from app.config import (Configuration, DatabaseTable, EntityType,
+                        ProtocolKey, ResponseStatus)
+from app.modules import cache, db, loader
 from app.modules.country import Country
 
 
@@ -15,6 +19,9 @@ T = TypeVar("T", bound="Locality")
 
 
 class Locality:
+    # Whitespace and punctuation dropped from clean names.
+    CLEAN_TABLE = str.maketrans("", "", " ,;.-–_/\\()[]<>!?~'\"`|@#$%^*+=±{}")
+
     def __init__(self,
                  data: dict) -> None:
         self.country: Country = None
@@ -72,27 +79,7 @@ class Locality:
         characters.
         """
 
-        invisible = frozenset([" "])
-        punctuation = frozenset(
-            [",", ";", ".",
-             "-", "–", "_",
-             "/", "\\", "(",
-             ")", "[", "]",
-             "<", ">", "!",
-             "?", "~", "'",
-             "\"", "`", "|",
-             "@", "#", "$",
-             "%", "^", "*",
-             "+", "=", "±",
-             "{", "}"]
-        )
-        name_clean = name.strip()
-        name_clean = name_clean.replace("&", "and")
-        name_clean = "".join(char for char in name_clean if char not in invisible)
-        name_clean = "".join(char for char in name_clean if char not in punctuation)
-        name_clean = name_clean.lower()
-
-        return name_clean
+        return name.strip().replace("&", "and").translate(Locality.CLEAN_TABLE).lower()
 
     @classmethod
     def create(cls: Type[T],
@@ -131,6 +118,9 @@ class Locality:
 
             if result:
                 ret = cls(result)
+                # Every worker adds it to its index, this one included,
+                # once the transaction commits; a rollback sends nothing.
+                cache.publish(LOCALITY_CHANNEL, str(ret.id))
         except Exception as e:
             print(e)
         finally:
@@ -144,72 +134,65 @@ class Locality:
 
     @classmethod
     def get_all(cls: Type[T],
-                query: str) -> list[T]:
+                query: str,
+                alpha_2_code: str = None,
+                limit: int = Configuration.LOCALITY_RESULT_LIMIT) -> list[T]:
+        """
+        Returns the localities with a word starting with query (compared
+        clean), from this process's index rather than the database.
+        """
+
         if not isinstance(query, str):
             raise TypeError(f"Argument 'query' must be of type str, not {type(query)}.")
 
-        ret: list[T] = []
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT *, ts_rank(match.{ProtocolKey.POSTGRES_SEARCH_NAME}, plainto_tsquery('english', %s)) AS rank FROM
-                (SELECT * FROM {DatabaseTable.LOCALITY}
-                WHERE {ProtocolKey.POSTGRES_SEARCH_NAME} @@ plainto_tsquery('english', %s))
-                AS match
-                ORDER BY rank DESC
-                LIMIT 20;
-                """,
-                (query, query)
-            )
-            results = cursor.fetchall()
-            conn.commit()
-
-            for result in results:
-                ret.append(cls(result))
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return get_index().search(query, alpha_2_code=alpha_2_code, limit=limit)
 
     @classmethod
     def get_all_by_country(cls: Type[T],
-                           alpha_2_code: int) -> list[T]:
+                           alpha_2_code: str) -> list[T]:
         if not isinstance(alpha_2_code, str):
             raise TypeError(f"Argument 'alpha_2_code' must be of type str, not {type(alpha_2_code)}.")
 
         if not alpha_2_code:
             raise ValueError("Argument 'alpha_2_code' must be a non-empty string.")
 
-        ret = []
+        return list(get_index().localities_by_country.get(alpha_2_code, []))
+
+    @classmethod
+    def get_all_by_ids(cls: Type[T],
+                       locality_ids: list[int]) -> dict[int, T]:
+        if not isinstance(locality_ids, list):
+            raise TypeError(f"Argument 'locality_ids' must be of type list, not {type(locality_ids)}.")
+
+        # Served from the index where possible; the objects are shared and
+        # must be treated as read-only. Only localities it doesn't have
+        # yet, e.g. created earlier in this request, are queried.
+        localities_by_id = get_index().localities_by_id
+        ret: dict[int, T] = {locality_id: localities_by_id[locality_id] for locality_id in locality_ids
+                             if locality_id in localities_by_id}
+        locality_ids = [locality_id for locality_id in locality_ids if locality_id not in ret]
         conn = None
         cursor = None
 
+        if not locality_ids:
+            return ret
+
         try:
             conn = db.connect()
             cursor = conn.cursor()
             cursor.execute(
                 f"""
                 SELECT * FROM {DatabaseTable.LOCALITY}
-                WHERE {ProtocolKey.ALPHA_2_CODE} = %s;
+                WHERE {ProtocolKey.ID} = ANY(%s);
                 """,
-                (alpha_2_code,)
+                (locality_ids,)
             )
             results = cursor.fetchall()
             conn.commit()
 
             for result in results:
-                ret.append(cls(result))
+                locality = cls(result)
+                ret[locality.id] = locality
         except Exception as e:
             print(e)
         finally:
@@ -269,11 +252,15 @@ class Locality:
         if not locality_name:
             raise ValueError("Argument 'locality_name' must be a non-empty string.")
 
-        ret: Type[T] = None
         conn = None
         cursor = None
         locality_name = cls.clean(locality_name)
+        ret: Type[T] = get_index().localities_by_name_clean.get(locality_name)
 
+        if ret:
+            return ret
+
+        # Not in the index yet if another worker has only just created it.
         try:
             conn = db.connect()
             cursor = conn.cursor()
@@ -301,18 +288,198 @@ class Locality:
         return ret
 
 
+class LocalityIndex:
+    """
+    An immutable, in-process prefix index over every locality. Each
+    locality is filed under the clean form of every suffix of its name
+    that starts at a word ("Dubai Marina" under "dubaimarina" and
+    "marina"), kept sorted so the names starting with a prefix are a
+    contiguous run found by bisection. Objects handed out are shared
+    and must be treated as read-only.
+    """
+
+    def __init__(self,
+                 localities: list[Locality]) -> None:
+        self.localities_by_country: dict[str, list[Locality]] = {}
+        self.localities_by_id: dict[int, Locality] = {locality.id: locality for locality in localities}
+        self.localities_by_name_clean: dict[str, Locality] = {}
+        entries: list[tuple[str, int]] = []
+
+        for locality in localities:
+            if locality.country:
+                self.localities_by_country.setdefault(locality.country.alpha_2_code, []).append(locality)
+
+            if locality.name:
+                self.localities_by_name_clean.setdefault(Locality.clean(locality.name), locality)
+                words = locality.name.split()
+
+                for i in range(len(words)):
+                    key = Locality.clean(" ".join(words[i:]))
+
+                    if key:
+                        entries.append((key, locality.id))
+
+        entries.sort()
+        self._keys: list[str] = [key for key, _ in entries]
+        self._ids: list[int] = [locality_id for _, locality_id in entries]
+
+        for country_localities in self.localities_by_country.values():
+            country_localities.sort(key=lambda locality: locality.name or "")
+
+    @classmethod
+    def load(cls) -> "LocalityIndex":
+        """
+        Reads every locality. Raises if the database can't be reached so
+        an empty index never gets installed.
+        """
+
+        results = []
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT * FROM {DatabaseTable.LOCALITY};
+                """
+            )
+            results = cursor.fetchall()
+            conn.commit()
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return cls([Locality(result) for result in results])
+
+    def with_locality(self,
+                      locality: Locality) -> "LocalityIndex":
+        """
+        A copy of this index with locality added, built from the
+        localities already in memory rather than re-read from the table.
+        """
+
+        return LocalityIndex(list(self.localities_by_id.values()) + [locality])
+
+    def search(self,
+               query: str,
+               alpha_2_code: str = None,
+               limit: int = Configuration.LOCALITY_RESULT_LIMIT) -> list[Locality]:
+        """
+        Localities matching query, shortest matching name first (the
+        closest to what's been typed), then alphabetically.
+        """
+
+        ret: list[Locality] = []
+        prefix = Locality.clean(query)
+
+        if not prefix:
+            return ret
+
+        seen = set()
+        start = bisect.bisect_left(self._keys, prefix)
+        end = bisect.bisect_left(self._keys, prefix + "\uffff", lo=start)
+
+        for i in sorted(range(start, end), key=lambda i: (len(self._keys[i]), self._keys[i])):
+            locality = self.localities_by_id[self._ids[i]]
+
+            if locality.id in seen or \
+                    (alpha_2_code and (not locality.country or locality.country.alpha_2_code != alpha_2_code)):
+                continue
+
+            seen.add(locality.id)
+            ret.append(locality)
+
+            if len(ret) >= limit:
+                break
+
+        return ret
+
+
 ####################
 # MODULE FUNCTIONS #
 ####################
 
 
-def get_localities(query: str) -> tuple[dict, ResponseStatus]:
-    query = query.strip()
+LOCALITY_CHANNEL = "locality"
+loader.register(EntityType.LOCALITY, Locality.get_all_by_ids)
+_index: LocalityIndex = None
+_index_lock = threading.Lock()
+_index_pid: int = None
+
+
+def _on_locality_notification(payload: str) -> None:
+    global _index
+
+    if payload is None:
+        # The listener reconnected: something may have been missed.
+        reload_index()
+
+        return
+
+    locality_id = int(payload)
+
+    if _index is None or \
+            _index_pid != os.getpid() or \
+            locality_id in _index.localities_by_id:
+        # Either there's no index yet, and it'll read the locality when
+        # it's built, or it already has it.
+        return
+
+    # Only sent once the row has committed, so it can be read back.
+    locality = Locality.get_by_id(locality_id)
+
+    if locality:
+        with _index_lock:
+            if _index is not None and \
+                    locality_id not in _index.localities_by_id:
+                _index = _index.with_locality(locality)
+
+
+def get_index() -> LocalityIndex:
+    """
+    Returns this process's index, building it on first use. If the
+    database is unavailable an empty index is returned (but not kept) so
+    the next call tries again.
+    """
+
+    global _index, _index_pid
+
+    pid = os.getpid()
+
+    if _index is not None and _index_pid == pid:
+        return _index
+
+    with _index_lock:
+        if _index is None or _index_pid != pid:
+            try:
+                _index = LocalityIndex.load()
+                _index_pid = pid
+            except Exception as e:
+                print(e)
+
+                return LocalityIndex([])
+
+    return _index
+
+
+def get_localities(query: str,
+                   alpha_2_code: str = None) -> tuple[dict, ResponseStatus]:
+    query = query.strip() if query else ""
     response_status = ResponseStatus.OK
     serialized = []
 
+    if alpha_2_code:
+        alpha_2_code = alpha_2_code.strip().upper()
+    else:
+        alpha_2_code = None
+
     if query:
-        results = Locality.get_all(query)
+        results = Locality.get_all(query, alpha_2_code=alpha_2_code)
 
         for result in results:
             serialized.append(result.as_dict())
@@ -322,3 +489,25 @@ def get_localities(query: str) -> tuple[dict, ResponseStatus]:
     }
 
     return (response, response_status)
+
+
+def reload_index() -> None:
+    """
+    Builds a fresh index and swaps it in. On failure the old one stays.
+    """
+
+    global _index, _index_pid
+
+    try:
+        index = LocalityIndex.load()
+    except Exception as e:
+        print(e)
+
+        return
+
+    with _index_lock:
+        _index = index
+        _index_pid = os.getpid()
+
+
+cache.subscribe(LOCALITY_CHANNEL, _on_locality_notification)
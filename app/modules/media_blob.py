@@ -0,0 +1,284 @@
+from datetime import datetime
+import json
+from typing import Any, TypeVar, Type
+
+from app.config import DatabaseTable, MediaStatus, ProtocolKey
+from app.modules import db
+
+
+###########
+# CLASSES #
+###########
+
+
+T = TypeVar("T", bound="MediaBlob")
+
+
+class MediaBlob:
+    """
+    One distinct upload, identified by the SHA-256 of its bytes, and the
+    stored image made from it. Every medium or avatar using it holds a
+    reference; the stored files go once the last one is released.
+    """
+
+    # Where blobs are stored, relative to MEDIA_DIR. Media stored before
+    # blobs existed live under brand/ and product/ instead.
+    PREFIX = "media/"
+
+    def __init__(self,
+                 data: dict) -> None:
+        self.creation_timestamp: datetime = None
+        self.derivatives: list[dict] = []
+        # Relative to MEDIA_DIR. This is also the object key for S3.
+        self.file_path: str = None
+        self.hash: str = None
+        self.ref_count: int = 0
+        self.status: MediaStatus = MediaStatus.PENDING
+
+        if data:
+            if ProtocolKey.CREATION_TIMESTAMP in data:
+                self.creation_timestamp: datetime = data[ProtocolKey.CREATION_TIMESTAMP]
+
+            if ProtocolKey.DERIVATIVES in data and data[ProtocolKey.DERIVATIVES]:
+                self.derivatives: list[dict] = data[ProtocolKey.DERIVATIVES]
+
+            if ProtocolKey.FILE_PATH in data:
+                self.file_path: str = data[ProtocolKey.FILE_PATH]
+
+            if ProtocolKey.HASH in data:
+                self.hash: str = data[ProtocolKey.HASH]
+
+            if ProtocolKey.REF_COUNT in data:
+                self.ref_count: int = data[ProtocolKey.REF_COUNT]
+
+            if ProtocolKey.STATUS in data and data[ProtocolKey.STATUS]:
+                self.status: MediaStatus = MediaStatus(data[ProtocolKey.STATUS])
+
+    def __eq__(self,
+               __o: object) -> bool:
+        ret = False
+
+        if isinstance(__o, type(self)) and \
+                self.hash == __o.hash:
+            ret = True
+
+        return ret
+
+    def __hash__(self) -> int:
+        return hash(self.hash)
+
+    def __repr__(self) -> str:
+        return f"{self.hash} ({self.file_path}, {self.ref_count} references)"
+
+    @classmethod
+    def acquire(cls: Type[T],
+                content_hash: str) -> T:
+        """
+        Takes a reference to the blob for content_hash, creating it, still
+        pending, if this is the first upload of those bytes. A blob that
+        failed goes back to pending so the caller has it processed again;
+        the failure may have been an outage rather than a bad image.
+        """
+
+        if not isinstance(content_hash, str):
+            raise TypeError(f"Argument 'content_hash' must be of type str, not {type(content_hash)}.")
+
+        if not content_hash:
+            raise ValueError("Argument 'content_hash' must be a non-empty string.")
+
+        ret: Type[T] = None
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                INSERT INTO {DatabaseTable.MEDIA_BLOB}
+                ({ProtocolKey.HASH}, {ProtocolKey.FILE_PATH})
+                VALUES
+                (%s, %s)
+                ON CONFLICT ({ProtocolKey.HASH}) DO UPDATE
+                SET {ProtocolKey.REF_COUNT} = {DatabaseTable.MEDIA_BLOB}.{ProtocolKey.REF_COUNT} + 1,
+                {ProtocolKey.STATUS} = CASE
+                    WHEN {DatabaseTable.MEDIA_BLOB}.{ProtocolKey.STATUS} = %s THEN %s
+                    ELSE {DatabaseTable.MEDIA_BLOB}.{ProtocolKey.STATUS}
+                END
+                RETURNING *;
+                """,
+                (content_hash, MediaBlob.file_path_for(content_hash), MediaStatus.FAILED.value, MediaStatus.PENDING.value)
+            )
+            result = cursor.fetchone()
+            conn.commit()
+
+            if result:
+                ret = cls(result)
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
+    @staticmethod
+    def file_path_for(content_hash: str) -> str:
+        # We'd like to standardize all images to be in JPEG format.
+        return f"{MediaBlob.PREFIX}{content_hash}_full.jpg"
+
+    @classmethod
+    def get_by_file_path(cls: Type[T],
+                         file_path: str) -> T:
+        if not isinstance(file_path, str):
+            raise TypeError(f"Argument 'file_path' must be of type str, not {type(file_path)}.")
+
+        ret: Type[T] = None
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT * FROM {DatabaseTable.MEDIA_BLOB}
+                WHERE {ProtocolKey.FILE_PATH} = %s;
+                """,
+                (file_path,)
+            )
+            result = cursor.fetchone()
+            conn.commit()
+
+            if result:
+                ret = cls(result)
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
+    @staticmethod
+    def owns(file_path: str) -> bool:
+        return file_path.startswith(MediaBlob.PREFIX)
+
+    @classmethod
+    def release(cls: Type[T],
+                file_path: str) -> tuple[T, bool]:
+        """
+        Drops a reference to the blob stored at file_path. Returns the
+        blob, if there was one, and whether that was its last reference,
+        in which case the blob is gone and its stored files are the
+        caller's to delete.
+        """
+
+        if not isinstance(file_path, str):
+            raise TypeError(f"Argument 'file_path' must be of type str, not {type(file_path)}.")
+
+        ret: Type[T] = None
+        last = False
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                UPDATE {DatabaseTable.MEDIA_BLOB}
+                SET {ProtocolKey.REF_COUNT} = {ProtocolKey.REF_COUNT} - 1
+                WHERE {ProtocolKey.FILE_PATH} = %s
+                RETURNING *;
+                """,
+                (file_path,)
+            )
+            result = cursor.fetchone()
+
+            if result:
+                ret = cls(result)
+
+                if ret.ref_count <= 0:
+                    # The update above holds the row lock, so no one can
+                    # take a new reference before this commits.
+                    cursor.execute(
+                        f"""
+                        DELETE FROM {DatabaseTable.MEDIA_BLOB}
+                        WHERE {ProtocolKey.FILE_PATH} = %s
+                        AND {ProtocolKey.REF_COUNT} <= 0
+                        RETURNING *;
+                        """,
+                        (file_path,)
+                    )
+                    last = cursor.fetchone() is not None
+
+            conn.commit()
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return (ret, last)
+
+    def set_status(self,
+                   status: MediaStatus,
+                   derivatives: list[dict] = None) -> bool:
+        """
+        Also sets the blob's derivatives, if given. Returns False if the
+        blob no longer exists because its last reference was released
+        while it was being processed.
+        """
+
+        if not self.hash:
+            raise Exception("Blob has no hash associated with it.")
+
+        if not isinstance(status, MediaStatus):
+            raise TypeError(f"Argument 'status' must be of type MediaStatus, not {type(status)}.")
+
+        if derivatives is not None and not isinstance(derivatives, list):
+            raise TypeError(f"Argument 'derivatives' must be of type list, not {type(derivatives)}.")
+
+        ret = False
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                UPDATE {DatabaseTable.MEDIA_BLOB}
+                SET {ProtocolKey.STATUS} = %s, {ProtocolKey.DERIVATIVES} = COALESCE(%s::jsonb, {ProtocolKey.DERIVATIVES})
+                WHERE {ProtocolKey.HASH} = %s;
+                """,
+                (status.value, json.dumps(derivatives) if derivatives is not None else None, self.hash)
+            )
+            ret = cursor.rowcount > 0
+            conn.commit()
+
+            if ret:
+                self.status = status
+
+                if derivatives is not None:
+                    self.derivatives = derivatives
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
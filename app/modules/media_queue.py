@@ -0,0 +1,549 @@
+from concurrent.futures import ThreadPoolExecutor
+import fcntl
+import hashlib
+import json
+import os
+from PIL import Image
+import shutil
+import tempfile
+import threading
+from typing import IO, Any, Callable, NamedTuple, TypeVar, Type
+import uuid
+from werkzeug.datastructures import FileStorage
+
+try:
+    # Teaches Pillow to write AVIF.
+    import pillow_avif
+except ImportError:
+    pillow_avif = None
+
+from app import app
+from app.config import (Configuration, EntityType, MediaMode, MediaStatus,
+                        ProtocolKey)
+from app.modules import db, worker
+from app.modules.media_blob import MediaBlob
+from app.modules.s3 import s3
+
+
+###########
+# CLASSES #
+###########
+
+
+T = TypeVar("T", bound="MediaJob")
+
+
+class Rendition(NamedTuple):
+    data: IO[bytes]
+    # Relative to MEDIA_DIR. This is also the object key for S3.
+    file_path: str
+    height: int
+    mime_type: str
+    width: int
+
+    def as_dict(self) -> dict[ProtocolKey, Any]:
+        return {
+            ProtocolKey.FILE_PATH: self.file_path,
+            ProtocolKey.HEIGHT: self.height,
+            ProtocolKey.MIME_TYPE: self.mime_type,
+            ProtocolKey.WIDTH: self.width
+        }
+
+
+class MediaJob:
+    """
+    An accepted upload waiting to be converted and stored. Its raw bytes
+    and a JSON manifest stay in the spool directory until it's done, so
+    a job outlives the worker that accepted it.
+    """
+
+    # Pillow's name, the file extension and the MIME type of each format
+    # derivatives can be rendered in.
+    FORMATS = {
+        "avif": ("AVIF", "avif", "image/avif"),
+        "jpeg": ("JPEG", "jpg", "image/jpeg"),
+        "webp": ("WEBP", "webp", "image/webp")
+    }
+
+    def __init__(self,
+                 data: dict) -> None:
+        self.attempts: int = 0
+        # Filled in once the job has been processed.
+        self.derivatives: list[dict] = []
+        self.editor_id: int = None
+        self.entity_id: int = None
+        self.entity_type: EntityType = None
+        # Relative to MEDIA_DIR. This is also the object key for S3.
+        self.file_path: str = None
+        self.id: str = None
+        self.media_mode: MediaMode = None
+        self.medium_id: int = None
+
+        if data:
+            if ProtocolKey.ATTEMPTS in data:
+                self.attempts: int = data[ProtocolKey.ATTEMPTS]
+
+            if ProtocolKey.EDITOR_ID in data:
+                self.editor_id: int = data[ProtocolKey.EDITOR_ID]
+
+            if ProtocolKey.ENTITY_ID in data:
+                self.entity_id: int = data[ProtocolKey.ENTITY_ID]
+
+            if ProtocolKey.ENTITY_TYPE in data and data[ProtocolKey.ENTITY_TYPE]:
+                self.entity_type: EntityType = EntityType(data[ProtocolKey.ENTITY_TYPE])
+
+            if ProtocolKey.FILE_PATH in data:
+                self.file_path: str = data[ProtocolKey.FILE_PATH]
+
+            if ProtocolKey.ID in data:
+                self.id: str = data[ProtocolKey.ID]
+
+            if ProtocolKey.MEDIA_MODE in data and data[ProtocolKey.MEDIA_MODE]:
+                self.media_mode: MediaMode = MediaMode(data[ProtocolKey.MEDIA_MODE])
+
+            if ProtocolKey.MEDIUM_ID in data:
+                self.medium_id: int = data[ProtocolKey.MEDIUM_ID]
+
+    def __repr__(self) -> str:
+        return f"{self.id} ({self.file_path})"
+
+    @staticmethod
+    def _encode(pil_image: Image.Image,
+                image_format: str,
+                file_path: str,
+                **params) -> Rendition:
+        pil_format, _, mime_type = MediaJob.FORMATS[image_format]
+        data = tempfile.SpooledTemporaryFile(max_size=Configuration.MEDIA_BUFFER_MAX_SIZE)
+
+        try:
+            pil_image.save(data, pil_format, **params)
+        except Exception:
+            data.close()
+            raise
+
+        data.seek(0)
+
+        return Rendition(data, file_path, pil_image.height, mime_type, pil_image.width)
+
+    @staticmethod
+    def _formats() -> list[str]:
+        Image.init()
+
+        return [image_format for image_format in Configuration.MEDIA_DERIVATIVE_FORMATS
+                if MediaJob.FORMATS[image_format][0] in Image.SAVE]
+
+    def as_dict(self) -> dict[ProtocolKey, Any]:
+        return {
+            ProtocolKey.ATTEMPTS: self.attempts,
+            ProtocolKey.EDITOR_ID: self.editor_id,
+            ProtocolKey.ENTITY_ID: self.entity_id,
+            ProtocolKey.ENTITY_TYPE: self.entity_type,
+            ProtocolKey.FILE_PATH: self.file_path,
+            ProtocolKey.ID: self.id,
+            ProtocolKey.MEDIA_MODE: self.media_mode,
+            ProtocolKey.MEDIUM_ID: self.medium_id
+        }
+
+    @classmethod
+    def create(cls: Type[T],
+               data: IO[bytes],
+               editor_id: int,
+               entity_id: int,
+               entity_type: EntityType,
+               file_path: str,
+               media_mode: MediaMode = None,
+               medium_id: int = None) -> T:
+        """
+        Copies the upload from data, read from its current position, into
+        the spool along with the job's manifest, both flushed to disk, and
+        returns the job. It isn't queued until enqueue() is called.
+        """
+
+        if not callable(getattr(data, "read", None)):
+            raise TypeError(f"Argument 'data' must be a binary file object, not {type(data)}.")
+
+        if not isinstance(editor_id, int):
+            raise TypeError(f"Argument 'editor_id' must be of type int, not {type(editor_id)}.")
+
+        if not isinstance(entity_id, int):
+            raise TypeError(f"Argument 'entity_id' must be of type int, not {type(entity_id)}.")
+
+        if entity_id <= 0:
+            raise ValueError("Argument 'entity_id' must be a positive, non-zero integer.")
+
+        if not isinstance(entity_type, EntityType):
+            raise TypeError(f"Argument 'entity_type' must be of type EntityType, not {type(entity_type)}.")
+
+        if not isinstance(file_path, str):
+            raise TypeError(f"Argument 'file_path' must be of type str, not {type(file_path)}.")
+
+        if not file_path:
+            raise ValueError("Argument 'file_path' must be a non-empty string.")
+
+        if media_mode and not isinstance(media_mode, MediaMode):
+            raise TypeError(f"Argument 'media_mode' must be of type MediaMode, not {type(media_mode)}.")
+
+        if medium_id and not isinstance(medium_id, int):
+            raise TypeError(f"Argument 'medium_id' must be of type int, not {type(medium_id)}.")
+
+        ret = cls({
+            ProtocolKey.EDITOR_ID: editor_id,
+            ProtocolKey.ENTITY_ID: entity_id,
+            ProtocolKey.ENTITY_TYPE: entity_type,
+            ProtocolKey.FILE_PATH: file_path,
+            ProtocolKey.ID: uuid.uuid4().hex,
+            ProtocolKey.MEDIA_MODE: media_mode,
+            ProtocolKey.MEDIUM_ID: medium_id
+        })
+
+        os.makedirs(Configuration.MEDIA_SPOOL_DIR, exist_ok=True)
+
+        with open(ret.upload_path(), mode="wb") as file:
+            shutil.copyfileobj(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+
+        ret.save()
+
+        return ret
+
+    def delete(self) -> None:
+        """
+        [NOTE] This method removes the job's files from the spool.
+        """
+
+        for path in (self.manifest_path(), self.upload_path()):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def manifest_path(self) -> str:
+        return os.path.join(Configuration.MEDIA_SPOOL_DIR, f"{self.id}.json")
+
+    def render(self) -> list[Rendition]:
+        """
+        Re-encodes the upload as a JPEG at file_path, followed by its
+        derivatives: every MEDIA_DERIVATIVE_WIDTHS narrower than the
+        original, plus the original width, in each derivative format
+        Pillow can write. They're named after file_path, e.g.
+        product/1/<hash>_media_640.webp. Each comes in a buffer, rewound
+        and ready to be stored; the caller closes them. Raises OSError if
+        the upload isn't an image PIL can read.
+        """
+
+        ret: list[Rendition] = []
+        stem = os.path.splitext(self.file_path)[0].removesuffix("_full")
+
+        try:
+            with Image.open(self.upload_path()) as pil_image:
+                # JPEG has neither an alpha channel nor a palette.
+                if pil_image.mode not in ("L", "RGB"):
+                    pil_image = pil_image.convert("RGB")
+
+                ret.append(MediaJob._encode(pil_image, "jpeg", self.file_path))
+
+                widths = {width for width in Configuration.MEDIA_DERIVATIVE_WIDTHS if width < pil_image.width}
+                widths.add(pil_image.width)
+
+                for width in sorted(widths):
+                    if width == pil_image.width:
+                        resized = pil_image
+                    else:
+                        height = max(round(pil_image.height * width / pil_image.width), 1)
+                        resized = pil_image.resize((width, height), Image.Resampling.LANCZOS)
+
+                    for image_format in MediaJob._formats():
+                        if resized is pil_image and image_format == "jpeg":
+                            # That's the full image.
+                            continue
+
+                        file_path = f"{stem}_{width}.{MediaJob.FORMATS[image_format][1]}"
+                        ret.append(MediaJob._encode(resized, image_format, file_path,
+                                                    quality=Configuration.MEDIA_DERIVATIVE_QUALITY))
+        except Exception:
+            for rendition in ret:
+                rendition.data.close()
+
+            raise
+
+        return ret
+
+    def save(self) -> None:
+        """
+        Writes the manifest. It's replaced atomically, so a crash leaves
+        either the old one or the new one, never half of either.
+        """
+
+        file_path_tmp = f"{self.manifest_path()}.tmp"
+
+        with open(file_path_tmp, mode="w") as file:
+            json.dump(self.as_dict(), file)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(file_path_tmp, self.manifest_path())
+
+        # Make the rename itself durable.
+        dir_fd = os.open(Configuration.MEDIA_SPOOL_DIR, os.O_RDONLY)
+
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def store(self,
+              renditions: list[Rendition]) -> None:
+        if app.debug:
+            # Served from the static folder instead.
+            for rendition in renditions:
+                file_path_final = os.path.join(Configuration.MEDIA_DIR, rendition.file_path)
+                os.makedirs(os.path.dirname(file_path_final), exist_ok=True)
+
+                with open(file_path_final, mode="wb") as file:
+                    shutil.copyfileobj(rendition.data, file)
+        else:
+            s3.upload_media_batch([(rendition.data, rendition.file_path, rendition.mime_type)
+                                   for rendition in renditions])
+
+    def upload_path(self) -> str:
+        return os.path.join(Configuration.MEDIA_SPOOL_DIR, f"{self.id}.upload")
+
+
+####################
+# MODULE FUNCTIONS #
+####################
+
+
+_executor: ThreadPoolExecutor = None
+_executor_lock = threading.Lock()
+_executor_pid: int = None
+_handlers: dict[EntityType, Callable[[MediaJob, MediaStatus], None]] = {}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """
+    Returns this process's worker pool, starting it on first use along
+    with whatever the spool still holds from before a restart. Threads
+    don't survive fork(), so every worker process runs its own.
+    """
+
+    global _executor, _executor_pid
+
+    pid = os.getpid()
+
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers=Configuration.MEDIA_QUEUE_WORKERS,
+                                               thread_name_prefix="media_queue")
+                _executor_pid = pid
+                _recover()
+
+    return _executor
+
+
+def _delete_stored(file_path: str,
+                   derivatives: list[dict]) -> None:
+    try:
+        delete_stored(file_path, derivatives)
+    except Exception as e:
+        print(e)
+
+
+def _recover() -> None:
+    try:
+        names = os.listdir(Configuration.MEDIA_SPOOL_DIR)
+    except FileNotFoundError:
+        return
+
+    for name in names:
+        if name.endswith(".json"):
+            _executor.submit(_run, os.path.join(Configuration.MEDIA_SPOOL_DIR, name))
+
+
+def _run(manifest_path: str) -> None:
+    """
+    Processes the job at manifest_path unless another thread or worker
+    process already has it. Jobs are claimed with a lock on the manifest,
+    which the kernel releases if its holder dies, so a crashed job is
+    picked up again by the next recovery.
+    """
+
+    try:
+        file = open(manifest_path, mode="r")
+    except FileNotFoundError:
+        # Already done.
+        return
+
+    try:
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+
+        try:
+            if os.stat(manifest_path).st_ino != os.fstat(file.fileno()).st_ino:
+                # Finished or rewritten while we waited for the lock.
+                return
+        except FileNotFoundError:
+            return
+
+        job = MediaJob(json.load(file))
+        handler = _handlers.get(job.entity_type)
+        blob = None
+
+        if MediaBlob.owns(job.file_path):
+            blob = MediaBlob.get_by_file_path(job.file_path)
+
+            if not blob:
+                # Every reference was released before it got processed.
+                job.delete()
+
+                return
+
+        if blob and blob.status != MediaStatus.PENDING:
+            # Another upload of the same image got there first.
+            job.derivatives = blob.derivatives
+            status = blob.status
+        else:
+            try:
+                renditions = job.render()
+            except OSError as e:
+                # Not an image after all; retrying won't change that.
+                print(e)
+                status = MediaStatus.FAILED
+            else:
+                try:
+                    job.store(renditions)
+                    job.derivatives = [rendition.as_dict() for rendition in renditions[1:]]
+                    status = MediaStatus.READY
+                except Exception as e:
+                    print(e)
+                    job.attempts += 1
+
+                    if job.attempts < Configuration.MEDIA_QUEUE_MAX_ATTEMPTS:
+                        job.save()
+                        retry = threading.Timer(Configuration.MEDIA_QUEUE_RETRY_DELAY * job.attempts,
+                                                _submit,
+                                                (manifest_path,))
+                        retry.daemon = True
+                        retry.start()
+
+                        return
+
+                    status = MediaStatus.FAILED
+                finally:
+                    for rendition in renditions:
+                        rendition.data.close()
+
+            if blob and \
+                    not blob.set_status(status, job.derivatives) and \
+                    status == MediaStatus.READY:
+                # Its last reference went while it was being processed.
+                delete_stored(job.file_path, job.derivatives)
+
+        if handler:
+            handler(job, status)
+
+        job.delete()
+    except Exception as e:
+        print(e)
+    finally:
+        file.close()
+
+
+def _submit(manifest_path: str) -> None:
+    _get_executor().submit(_run, manifest_path)
+
+
+def delete_stored(file_path: str,
+                  derivatives: list[dict] = None) -> None:
+    """
+    Deletes an image stored by the queue, along with its derivatives.
+    """
+
+    for path in [file_path] + [derivative[ProtocolKey.FILE_PATH] for derivative in derivatives or []]:
+        if app.debug:
+            try:
+                os.remove(os.path.join(Configuration.MEDIA_DIR, path))
+            except OSError:
+                pass
+        else:
+            s3.delete_media(path)
+
+
+def enqueue(job: MediaJob) -> None:
+    """
+    Queues the job once the current request's transaction commits, so
+    its handler finds the records the request created.
+    """
+
+    db.after_commit(lambda: _submit(job.manifest_path()))
+
+
+def get_queue_stats() -> dict:
+    try:
+        spooled = sum(1 for name in os.listdir(Configuration.MEDIA_SPOOL_DIR) if name.endswith(".json"))
+    except FileNotFoundError:
+        spooled = 0
+
+    return {
+        "spooled": spooled,
+        "workers": Configuration.MEDIA_QUEUE_WORKERS
+    }
+
+
+def read_upload(file: FileStorage) -> tuple[IO[bytes], str]:
+    """
+    Copies an upload into a buffer, hashing it on the way, and returns
+    the buffer, rewound, along with the upload's SHA-256 hex digest. Up
+    to MEDIA_BUFFER_MAX_SIZE bytes are kept in memory; past that it
+    spills to an anonymous temporary file. The caller closes it.
+    """
+
+    buffer = tempfile.SpooledTemporaryFile(max_size=Configuration.MEDIA_BUFFER_MAX_SIZE)
+    sha256 = hashlib.sha256()
+
+    for chunk in iter(lambda: file.stream.read(64 * 1024), b""):
+        sha256.update(chunk)
+        buffer.write(chunk)
+
+    buffer.seek(0)
+
+    return (buffer, sha256.hexdigest())
+
+
+def release(file_path: str,
+            derivatives: list[dict] = None) -> None:
+    """
+    Drops a reference to a stored image. Once nothing uses it any more,
+    it's deleted along with its derivatives in the background after the
+    current request's transaction commits. Images stored before blobs
+    existed belong to a single medium or avatar and go straight away.
+    """
+
+    if MediaBlob.owns(file_path):
+        blob, last = MediaBlob.release(file_path)
+
+        if not last:
+            return
+
+        derivatives = blob.derivatives
+
+    db.after_commit(lambda: _get_executor().submit(_delete_stored, file_path, derivatives))
+
+
+def register(entity_type: EntityType,
+             handler: Callable[[MediaJob, MediaStatus], None]) -> None:
+    """
+    Sets the function called with each finished job of entity_type and
+    whether it succeeded. It runs on a queue thread, outside any request.
+    """
+
+    _handlers[entity_type] = handler
+
+
+# Pick up jobs a previous run left in the spool as soon as each worker
+# starts rather than on its first upload.
+worker.post_fork(_get_executor)
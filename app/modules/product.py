@@ -1,28 +1,26 @@
 from datetime import datetime
 from dateutil import parser as date_parser
 from flask import request
-import hashlib
 import json
-import os
 from PIL import Image
 import re
 import string
-from typing import Any, TypeVar, Type
+from typing import IO, Any, TypeVar, Type
 from urllib.parse import urlparse
-from werkzeug.utils import secure_filename
 
-from app import app
 from app.config import (Configuration, ContentVisibility, DatabaseTable,
                         EditAccessLevel, EntityType, Field, MediaMode,
-                        ProductStatus, ProtocolKey, ResponseStatus,
-                        UserAction)
-from app.modules import db
-from app.modules.brand import Brand
+                        MediaStatus, ProductStatus, ProtocolKey,
+                        ResponseStatus, UserAction)
+from app.modules import cache, db, loader, media_queue
+from app.modules.brand import Brand, brand_cache
+from app.modules.common import Common, invalid_cursor
+from app.modules.media_blob import MediaBlob
+from app.modules.media_queue import MediaJob
 from app.modules.product_color import ProductColor
 from app.modules.product_material import ProductMaterial
 from app.modules.product_medium import ProductMedium
-from app.modules.s3 import s3
-from app.modules.tag import Tag
+from app.modules.tag import Tag, get_tagged
 from app.modules.user_account import UserAccount
 
 
@@ -165,6 +163,271 @@ class Product:
 
         return ret
 
+    @classmethod
+    def _get_by_id(cls: Type[T],
+                   product_id: int) -> T:
+        """
+        Uncached get_by_id().
+        """
+
+        ret: Type[T] = None
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                Product._hydrated_select(f"p.{ProtocolKey.ID} = %s"),
+                (product_id,)
+            )
+            result = cursor.fetchone()
+            conn.commit()
+
+            if result:
+                ret = cls._from_hydrated_row(result)
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
+    @classmethod
+    def _from_hydrated_row(cls: Type[T],
+                           result: dict) -> T:
+        """
+        Builds a product from a row produced by _hydrated_select().
+        """
+
+        main_color = result.pop(ProtocolKey.MAIN_COLOR, None)
+        material = result.pop(ProtocolKey.MATERIAL, None)
+        tags = result.pop(ProtocolKey.TAGS, None)
+        variant_count = result.pop(ProtocolKey.PRODUCT_VARIANT_COUNT, 0)
+        variants = result.pop(ProtocolKey.PRODUCT_VARIANTS, None)
+        ret = cls(result)
+        ret.tags = [Tag(tag) for tag in tags or []]
+        ret.variant_count = variant_count or 0
+
+        if main_color:
+            ret.main_color = ProductColor(main_color)
+
+        if material:
+            ret.material = ProductMaterial(material)
+
+        if ret.variant_count > 0:
+            ret.variants = [cls(variant) for variant in variants or []]
+
+        brand = result.get(ProtocolKey.BRAND)
+
+        # Only present when the brand was hydrated in full.
+        if ret.brand and ProtocolKey.PRODUCT_COUNT in brand:
+            if brand[ProtocolKey.CREATOR]:
+                ret.brand.creator = UserAccount(brand[ProtocolKey.CREATOR])
+
+            ret.brand.product_count = brand[ProtocolKey.PRODUCT_COUNT] or 0
+            ret.brand.tags = [Tag(tag) for tag in brand[ProtocolKey.TAGS] or []]
+
+            if ret.brand.product_count > 0:
+                ret.brand.products = [cls(product) for product in brand[ProtocolKey.PRODUCTS] or []]
+
+        return ret
+
+    @staticmethod
+    def _hydrated_select(condition: str,
+                         full_brand: bool = False) -> str:
+        """
+        SQL selecting the products matching condition (which refers to the
+        product as p) along with everything a product page shows: brand,
+        creator, parent hierarchy, tags, colour, material, variant count
+        and the first few variants. With full_brand the brand comes with
+        its creator, tags, product count and first few products, i.e. what
+        Brand.get_by_id() loads.
+        """
+
+        if full_brand:
+            brand_select = f"""
+                (
+                    SELECT
+                        ROW_TO_JSON(hb)::jsonb || jsonb_build_object(
+                            '{ProtocolKey.CREATOR}', {UserAccount.json_select(f"hb.{ProtocolKey.CREATOR_ID}")},
+                            '{ProtocolKey.PRODUCT_COUNT}', (
+                                SELECT
+                                    COUNT(*)
+                                FROM
+                                    {DatabaseTable.PRODUCT} AS hbp
+                                WHERE
+                                    hbp.{ProtocolKey.BRAND_ID} = hb.{ProtocolKey.ID}
+                                AND
+                                    hbp.{ProtocolKey.PARENT_PRODUCT_ID} IS NULL
+                            ),
+                            '{ProtocolKey.TAGS}', (
+                                SELECT
+                                    JSON_AGG(ROW_TO_JSON(hbt))
+                                FROM
+                                    {DatabaseTable.TAG} AS hbt
+                                INNER JOIN
+                                    {DatabaseTable.BRAND_TAG} AS hbbt
+                                ON
+                                    hbbt.{ProtocolKey.TAG_ID} = hbt.{ProtocolKey.ID}
+                                WHERE
+                                    hbbt.{ProtocolKey.BRAND_ID} = hb.{ProtocolKey.ID}
+                            ),
+                            '{ProtocolKey.PRODUCTS}', {Product._summary_select(
+                                "hbsp",
+                                f"hbsp.{ProtocolKey.BRAND_ID} = hb.{ProtocolKey.ID} AND hbsp.{ProtocolKey.PARENT_PRODUCT_ID} IS NULL",
+                                f"hbsp.{ProtocolKey.NAME} ASC"
+                            )}
+                        )
+                    FROM
+                        {DatabaseTable.BRAND} AS hb
+                    WHERE
+                        hb.{ProtocolKey.ID} = p.{ProtocolKey.BRAND_ID}
+                )
+            """
+        else:
+            brand_select = f"""
+                (
+                    SELECT
+                        ROW_TO_JSON(hb)
+                    FROM
+                        {DatabaseTable.BRAND} AS hb
+                    WHERE
+                        hb.{ProtocolKey.ID} = p.{ProtocolKey.BRAND_ID}
+                )
+            """
+
+        # This query uses a recursive plpgsql function to nest the full parent product
+        # hierarchy.
+        return f"""
+            SELECT
+                p.*,
+                {brand_select} AS {ProtocolKey.BRAND},
+                {UserAccount.json_select(f"p.{ProtocolKey.CREATOR_ID}")} AS {ProtocolKey.CREATOR},
+                get_parent_product_hierarchy(p.{ProtocolKey.PARENT_PRODUCT_ID}) AS {ProtocolKey.PARENT_PRODUCT},
+                (
+                    SELECT
+                        JSON_AGG(ROW_TO_JSON(ht))
+                    FROM
+                        {DatabaseTable.TAG} AS ht
+                    INNER JOIN
+                        {DatabaseTable.PRODUCT_TAG} AS hpt
+                    ON
+                        hpt.{ProtocolKey.TAG_ID} = ht.{ProtocolKey.ID}
+                    WHERE
+                        hpt.{ProtocolKey.PRODUCT_ID} = p.{ProtocolKey.ID}
+                ) AS {ProtocolKey.TAGS},
+                (
+                    SELECT
+                        COUNT(*)
+                    FROM
+                        {DatabaseTable.PRODUCT} AS hv
+                    WHERE
+                        hv.{ProtocolKey.PARENT_PRODUCT_ID} = p.{ProtocolKey.ID}
+                ) AS {ProtocolKey.PRODUCT_VARIANT_COUNT},
+                (
+                    SELECT
+                        ROW_TO_JSON(hc)
+                    FROM
+                        {DatabaseTable.PRODUCT_COLOR} AS hc
+                    WHERE
+                        hc.{ProtocolKey.HEX} = p.{ProtocolKey.MAIN_COLOR_CODE}
+                ) AS {ProtocolKey.MAIN_COLOR},
+                (
+                    SELECT
+                        ROW_TO_JSON(hm)
+                    FROM
+                        {DatabaseTable.PRODUCT_MATERIAL} AS hm
+                    WHERE
+                        hm.{ProtocolKey.ID} = p.{ProtocolKey.MATERIAL_ID}
+                ) AS {ProtocolKey.MATERIAL},
+                {Product._summary_select(
+                    "hsv",
+                    f"hsv.{ProtocolKey.PARENT_PRODUCT_ID} = p.{ProtocolKey.ID}",
+                    f"hsv_b.{ProtocolKey.NAME}, hsv.{ProtocolKey.NAME} ASC"
+                )} AS {ProtocolKey.PRODUCT_VARIANTS}
+            FROM
+                {DatabaseTable.PRODUCT} AS p
+            WHERE
+                {condition};
+        """
+
+    @staticmethod
+    def _load_brands(products: list[T]) -> None:
+        """
+        Fills in the brands of products through the brand cache, for
+        listings that leave brands out of their query or whose search
+        documents only keep a brand's name and visibility current.
+        """
+
+        brands = loader.load_many(EntityType.BRAND, [product.brand_id for product in products])
+
+        for product, brand in zip(products, brands):
+            product.brand = brand
+
+    @staticmethod
+    def _name_sort_key(row: dict) -> list:
+        """
+        Cursor values for listings ordered by brand name, product name and
+        ID, matching the COALESCEs in their ORDER BY.
+        """
+
+        brand = row.get(ProtocolKey.BRAND) or {}
+
+        return [brand.get(ProtocolKey.NAME) or "", row[ProtocolKey.NAME] or "", row[ProtocolKey.ID]]
+
+    @staticmethod
+    def _summary_select(alias: str,
+                        condition: str,
+                        order: str,
+                        count: int = 3) -> str:
+        """
+        SQL for a scalar subquery returning, as a JSON array, the first count
+        visible products matching condition in the shape get_some_products()
+        and get_some_variants() load them. condition and order refer to the
+        product as alias and to its brand as alias_b.
+        """
+
+        return f"""
+            (
+                SELECT
+                    JSON_AGG({alias}_row ORDER BY {alias}_row.ordinal)
+                FROM (
+                    SELECT
+                        {alias}.*,
+                        ROW_TO_JSON({alias}_b) AS {ProtocolKey.BRAND},
+                        {UserAccount.json_select(f"{alias}.{ProtocolKey.CREATOR_ID}")} AS {ProtocolKey.CREATOR},
+                        (
+                            SELECT
+                                ROW_TO_JSON({alias}_pp)
+                            FROM
+                                {DatabaseTable.PRODUCT} AS {alias}_pp
+                            WHERE
+                                {alias}_pp.{ProtocolKey.ID} = {alias}.{ProtocolKey.PARENT_PRODUCT_ID}
+                        ) AS {ProtocolKey.PARENT_PRODUCT},
+                        ROW_NUMBER() OVER (ORDER BY {order}) AS ordinal
+                    FROM
+                        {DatabaseTable.PRODUCT} AS {alias}
+                    LEFT JOIN
+                        {DatabaseTable.BRAND} AS {alias}_b
+                    ON
+                        {alias}_b.{ProtocolKey.ID} = {alias}.{ProtocolKey.BRAND_ID}
+                    WHERE
+                        {condition}
+                    AND
+                        {alias}.{ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
+                    ORDER BY
+                        {order}
+                    LIMIT
+                        {int(count)}
+                ) AS {alias}_row
+            )
+        """
+
     @staticmethod
     def add_history(product_id: int = 0,
                     editor_id: int = 0,
@@ -448,6 +711,13 @@ class Product:
                     (ret.id, alias, EntityType.PRODUCT)
                 )
 
+                # The brand's product count and the parent's variants
+                # have changed.
+                brand_cache.invalidate(ret.brand_id)
+
+                if ret.parent_product_id:
+                    product_cache.invalidate(ret.parent_product_id)
+
                 ret.brand = Brand.get_by_id(ret.brand_id)
                 ret.creator = UserAccount.get_by_id(ret.creator_id)
 
@@ -537,6 +807,7 @@ class Product:
                     (self.id, tag_id)
                 )
                 conn.commit()
+                product_cache.invalidate(self.id)
             except Exception as e:
                 print(e)
             finally:
@@ -583,6 +854,12 @@ class Product:
                 )
 
             conn.commit()
+
+            if self.id:
+                product_cache.invalidate(self.id)
+
+            if self.brand_id:
+                brand_cache.invalidate(self.brand_id)
         except Exception as e:
             print(e)
         finally:
@@ -621,6 +898,7 @@ class Product:
                 (self.id, tag_id)
             )
             conn.commit()
+            product_cache.invalidate(self.id)
         except Exception as e:
             print(e)
         finally:
@@ -634,9 +912,12 @@ class Product:
     def get_all(cls: Type[T],
                 query: str = None,
                 brand_id: int = None,
-                offset: int = 0) -> list[T]:
+                page_cursor: str = None,
+                limit: int = Configuration.PAGE_SIZE) -> tuple[list[T], str]:
         """
         This method does not return product variants unless in response to a query.
+        Returns a page of products along with the cursor for the next page (None
+        on the last one). Without a query products are listed by name.
         """
 
         if query and not isinstance(query, str):
@@ -650,8 +931,11 @@ class Product:
                 raise ValueError("Argument 'brand_id' must be a positive, non-zero integer.")
 
         ret: list[T] = []
+        next_cursor: str = None
         conn = None
         cursor = None
+        # Decoded outside the try so that a bad cursor reaches the caller.
+        after = Common.decode_cursor(page_cursor, ((float, int), int) if query else (str, int))
 
         try:
             conn = db.connect()
@@ -659,48 +943,54 @@ class Product:
 
             if query:
                 alias_pattern = f"%{query.replace(' ', '').lower()}%"
+                keyset = ""
+                params = [query, query, alias_pattern]
+
+                if after:
+                    keyset = f"WHERE (match.rank, match.{ProtocolKey.ID}) < (%s::real, %s)"
+                    params += after
 
+                params.append(limit + 1)
                 cursor.execute(
                     f"""
                     SELECT
-                        *, ts_rank(match.{ProtocolKey.POSTGRES_SEARCH_NAME}, plainto_tsquery('english', %s)) AS rank
+                        *
                     FROM
                     (
-                        SELECT 
-                            p.*,
-                            b.{ProtocolKey.BRAND},
-                            pp.{ProtocolKey.PARENT_PRODUCT}
-                        FROM 
-                            {DatabaseTable.PRODUCT} AS p
-                        LEFT JOIN (
-                            SELECT
-                                {ProtocolKey.ID},
-                                ROW_TO_JSON(b) AS {ProtocolKey.BRAND}
-                            FROM 
-                                {DatabaseTable.BRAND} AS b
-                        ) AS b ON p.{ProtocolKey.BRAND_ID} = b.{ProtocolKey.ID}
-                        LEFT JOIN (
-                            SELECT
-                                {ProtocolKey.ID},
-                                ROW_TO_JSON(pp) AS {ProtocolKey.PARENT_PRODUCT}
-                            FROM 
-                                {DatabaseTable.PRODUCT} AS pp
-                        ) AS pp ON p.{ProtocolKey.PARENT_PRODUCT_ID} = pp.{ProtocolKey.ID}
+                        SELECT
+                            s.{ProtocolKey.ID},
+                            s.{ProtocolKey.DOCUMENT},
+                            ts_rank(s.{ProtocolKey.POSTGRES_SEARCH_NAME}, plainto_tsquery('english', %s)) AS rank
+                        FROM
+                            {DatabaseTable.PRODUCT_SEARCH} AS s
                         WHERE
-                            (p.{ProtocolKey.POSTGRES_SEARCH_NAME} @@ plainto_tsquery('english', %s) OR p.{ProtocolKey.ALIAS} LIKE %s)
+                            (s.{ProtocolKey.POSTGRES_SEARCH_NAME} @@ plainto_tsquery('english', %s) OR s.{ProtocolKey.ALIAS} LIKE %s)
                         AND
-                            p.{ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
+                            s.{ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
                     ) AS match
+                    {keyset}
                     ORDER BY
-                        rank DESC
+                        match.rank DESC, match.{ProtocolKey.ID} DESC
                     LIMIT
-                        20
-                    OFFSET
                         %s;
                     """,
-                    (query, query, alias_pattern, offset)
+                    params
                 )
+                results, next_cursor = Common.paginate(cursor.fetchall(), limit,
+                                                       lambda row: [row["rank"], row[ProtocolKey.ID]])
+                results = [result[ProtocolKey.DOCUMENT] for result in results]
             elif brand_id:
+                keyset = ""
+                params = [brand_id]
+
+                if after:
+                    keyset = f"""
+                    AND
+                        (COALESCE(p.{ProtocolKey.NAME}, ''), p.{ProtocolKey.ID}) > (%s, %s)
+                    """
+                    params += after
+
+                params.append(limit + 1)
                 cursor.execute(
                     f"""
                     SELECT 
@@ -721,40 +1011,107 @@ class Product:
                         p.{ProtocolKey.PARENT_PRODUCT_ID} IS NULL
                     AND 
                         p.{ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
+                    {keyset}
                     ORDER BY
-                        b.{ProtocolKey.BRAND}->>'{ProtocolKey.NAME}', p.{ProtocolKey.NAME} ASC;
+                        COALESCE(p.{ProtocolKey.NAME}, ''), p.{ProtocolKey.ID}
+                    LIMIT
+                        %s;
                     """,
-                    (brand_id,)
+                    params
                 )
+                results, next_cursor = Common.paginate(cursor.fetchall(), limit,
+                                                       lambda row: [row[ProtocolKey.NAME] or "", row[ProtocolKey.ID]])
             else:
+                keyset = ""
+                params = []
+
+                # Ordered by product name alone and without brands so the
+                # page is read straight off product_name_id_idx; brands are
+                # filled in from their cache below.
+                if after:
+                    keyset = f"""
+                    AND
+                        (COALESCE({ProtocolKey.NAME}, ''), {ProtocolKey.ID}) > (%s, %s)
+                    """
+                    params += after
+
+                params.append(limit + 1)
                 cursor.execute(
                     f"""
-                    SELECT 
-                        p.*,
-                        b.{ProtocolKey.BRAND}
-                    FROM 
-                        {DatabaseTable.PRODUCT} AS p
-                    LEFT JOIN (
-                        SELECT
-                            {ProtocolKey.ID},
-                            ROW_TO_JSON(b) AS {ProtocolKey.BRAND}
-                        FROM 
-                            {DatabaseTable.BRAND} AS b
-                    ) AS b ON p.{ProtocolKey.BRAND_ID} = b.{ProtocolKey.ID}
+                    SELECT
+                        *
+                    FROM
+                        {DatabaseTable.PRODUCT}
                     WHERE
-                        p.{ProtocolKey.PARENT_PRODUCT_ID} IS NULL
+                        {ProtocolKey.PARENT_PRODUCT_ID} IS NULL
                     AND
-                        p.{ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
+                        {ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
+                    {keyset}
                     ORDER BY
-                        b.{ProtocolKey.BRAND}->>'{ProtocolKey.NAME}', p.{ProtocolKey.NAME} ASC;
-                    """
+                        COALESCE({ProtocolKey.NAME}, ''), {ProtocolKey.ID}
+                    LIMIT
+                        %s;
+                    """,
+                    params
                 )
+                results, next_cursor = Common.paginate(cursor.fetchall(), limit,
+                                                       lambda row: [row[ProtocolKey.NAME] or "", row[ProtocolKey.ID]])
 
+            conn.commit()
+
+            for result in results:
+                # Search documents come with their tags.
+                tags = result.pop(ProtocolKey.TAGS, None)
+                product = cls(result)
+
+                if tags:
+                    product.tags = [Tag(tag) for tag in tags]
+
+                ret.append(product)
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        if not brand_id:
+            Product._load_brands(ret)
+
+        return (ret, next_cursor)
+
+    @classmethod
+    def get_all_by_ids(cls: Type[T],
+                       product_ids: list[int]) -> dict[int, T]:
+        """
+        Batch counterpart of get_by_id(), keyed by product ID.
+        """
+
+        if not isinstance(product_ids, list):
+            raise TypeError(f"Argument 'product_ids' must be of type list, not {type(product_ids)}.")
+
+        ret: dict[int, T] = {}
+        conn = None
+        cursor = None
+
+        if not product_ids:
+            return ret
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                Product._hydrated_select(f"p.{ProtocolKey.ID} = ANY(%s)"),
+                (product_ids,)
+            )
             results = cursor.fetchall()
             conn.commit()
 
             for result in results:
-                ret.append(cls(result))
+                product = cls._from_hydrated_row(result)
+                ret[product.id] = product
         except Exception as e:
             print(e)
         finally:
@@ -766,12 +1123,100 @@ class Product:
 
         return ret
 
+    @classmethod
+    def get_all_by_tags(cls: Type[T],
+                        tag_ids: list[int],
+                        match_all: bool = False,
+                        page_cursor: str = None,
+                        limit: int = Configuration.PAGE_SIZE) -> tuple[list[T], str]:
+        """
+        Returns a page of products tagged with all (match_all) or any of
+        the tags, newest first, along with the cursor for the next page.
+        """
+
+        if not isinstance(tag_ids, list):
+            raise TypeError(f"Argument 'tag_ids' must be of type list, not {type(tag_ids)}.")
+
+        if not tag_ids:
+            raise ValueError("Argument 'tag_ids' must be a non-empty list.")
+
+        if not isinstance(match_all, bool):
+            raise TypeError(f"Argument 'match_all' must be of type bool, not {type(match_all)}.")
+
+        ret: list[T] = []
+        next_cursor: str = None
+        conn = None
+        cursor = None
+        after = Common.decode_cursor(page_cursor, (int,))
+        keyset = ""
+        params = [tag_ids, len(tag_ids) if match_all else 1]
+
+        if after:
+            keyset = f"""
+            AND
+                s.{ProtocolKey.ID} < %s
+            """
+            params += after
+
+        params.append(limit + 1)
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT
+                    s.{ProtocolKey.ID},
+                    s.{ProtocolKey.DOCUMENT}
+                FROM
+                    {DatabaseTable.PRODUCT_SEARCH} AS s
+                WHERE
+                    {Tag.membership_condition(EntityType.PRODUCT, f"s.{ProtocolKey.ID}")}
+                AND
+                    s.{ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
+                {keyset}
+                ORDER BY
+                    s.{ProtocolKey.ID} DESC
+                LIMIT
+                    %s;
+                """,
+                params
+            )
+            results, next_cursor = Common.paginate(cursor.fetchall(), limit,
+                                                   lambda row: [row[ProtocolKey.ID]])
+            conn.commit()
+
+            for result in results:
+                document = result[ProtocolKey.DOCUMENT]
+                tags = document.pop(ProtocolKey.TAGS, None)
+                product = cls(document)
+
+                if tags:
+                    product.tags = [Tag(tag) for tag in tags]
+
+                ret.append(product)
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        Product._load_brands(ret)
+
+        return (ret, next_cursor)
+
     @classmethod
     def get_all_by_user(cls: Type[T],
                         user_id: int,
-                        offset: int = 0) -> list[T]:
+                        page_cursor: str = None,
+                        limit: int = Configuration.PAGE_SIZE) -> tuple[list[T], str]:
         """
-        This method does not return product variants.
+        This method does not return product variants. Returns a page of
+        products along with the cursor for the next page (None on the last
+        one).
         """
 
         if not isinstance(user_id, int):
@@ -781,8 +1226,21 @@ class Product:
             raise ValueError("Argument 'user_id' must be a positive, non-zero integer.")
 
         ret: list[T] = []
+        next_cursor: str = None
         conn = None
         cursor = None
+        after = Common.decode_cursor(page_cursor, (str, str, int))
+        keyset = ""
+        params = [user_id]
+
+        if after:
+            keyset = f"""
+                AND
+                    (COALESCE(b.{ProtocolKey.NAME}, ''), COALESCE(p.{ProtocolKey.NAME}, ''), p.{ProtocolKey.ID}) > (%s, %s, %s)
+            """
+            params += after
+
+        params.append(limit + 1)
 
         try:
             conn = db.connect()
@@ -798,6 +1256,7 @@ class Product:
                 LEFT JOIN (
                     SELECT
                         {ProtocolKey.ID},
+                        {ProtocolKey.NAME},
                         ROW_TO_JSON(b) AS {ProtocolKey.BRAND}
                     FROM 
                         {DatabaseTable.BRAND} AS b
@@ -811,16 +1270,15 @@ class Product:
                 ) AS pp ON p.{ProtocolKey.PARENT_PRODUCT_ID} = pp.{ProtocolKey.ID}
                 WHERE
                     p.{ProtocolKey.CREATOR_ID} = %s
+                {keyset}
                 ORDER BY
-                    b.{ProtocolKey.BRAND}->>'{ProtocolKey.NAME}', p.{ProtocolKey.NAME} ASC
+                    COALESCE(b.{ProtocolKey.NAME}, ''), COALESCE(p.{ProtocolKey.NAME}, ''), p.{ProtocolKey.ID}
                 LIMIT
-                    20 
-                OFFSET
                     %s;
                 """,
-                (user_id, offset)
+                params
             )
-            results = cursor.fetchall()
+            results, next_cursor = Common.paginate(cursor.fetchall(), limit, Product._name_sort_key)
             conn.commit()
 
             for result in results:
@@ -834,12 +1292,20 @@ class Product:
             if conn:
                 conn.close()
 
-        return ret
+        return (ret, next_cursor)
 
     @classmethod
     def get_all_variants(cls: Type[T],
                          parent_product_id: int,
-                         offset: int = 0):
+                         page_cursor: str = None,
+                         offset: int = 0,
+                         limit: int = Configuration.PAGE_SIZE) -> tuple[list[T], str]:
+        """
+        Returns a page of variants along with the cursor for the next page
+        (None on the last one). offset is only honoured without a cursor,
+        for clients that predate cursors.
+        """
+
         if not isinstance(parent_product_id, int):
             raise TypeError(f"Argument 'parent_product_id' must be of type int, not {type(parent_product_id)}.")
 
@@ -847,8 +1313,22 @@ class Product:
             raise ValueError("Argument 'parent_product_id' must be a positive, non-zero integer.")
 
         ret: list[T] = []
+        next_cursor: str = None
         conn = None
         cursor = None
+        after = Common.decode_cursor(page_cursor, (str, str, int))
+        keyset = ""
+        params = [parent_product_id]
+
+        if after:
+            keyset = f"""
+                AND
+                    (COALESCE(b.{ProtocolKey.NAME}, ''), COALESCE(p.{ProtocolKey.NAME}, ''), p.{ProtocolKey.ID}) > (%s, %s, %s)
+            """
+            params += after
+            offset = 0
+
+        params += [limit + 1, offset]
 
         try:
             conn = db.connect()
@@ -864,6 +1344,7 @@ class Product:
                 LEFT JOIN (
                     SELECT
                         {ProtocolKey.ID},
+                        {ProtocolKey.NAME},
                         ROW_TO_JSON(b) AS {ProtocolKey.BRAND}
                     FROM 
                         {DatabaseTable.BRAND} AS b
@@ -879,16 +1360,17 @@ class Product:
                     p.{ProtocolKey.PARENT_PRODUCT_ID} = %s
                 AND
                     p.{ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
+                {keyset}
                 ORDER BY
-                    b.{ProtocolKey.BRAND}->>'{ProtocolKey.NAME}', p.{ProtocolKey.NAME} ASC
+                    COALESCE(b.{ProtocolKey.NAME}, ''), COALESCE(p.{ProtocolKey.NAME}, ''), p.{ProtocolKey.ID}
                 LIMIT
-                    20
+                    %s
                 OFFSET
                     %s;
                 """,
-                (parent_product_id, offset)
+                params
             )
-            results = cursor.fetchall()
+            results, next_cursor = Common.paginate(cursor.fetchall(), limit, Product._name_sort_key)
             conn.commit()
 
             for result in results:
@@ -902,7 +1384,7 @@ class Product:
             if conn:
                 conn.close()
 
-        return ret
+        return (ret, next_cursor)
 
     @classmethod
     def get_by_alias(cls: Type[T],
@@ -921,57 +1403,18 @@ class Product:
         try:
             conn = db.connect()
             cursor = conn.cursor()
-            # This query uses a recursive plpgsql function to nest the full parent product
-            # hierarchy.
             cursor.execute(
-                f"""
-                SELECT
-                    p.*,
-                    b.{ProtocolKey.BRAND},
-                    c.{ProtocolKey.CREATOR},
-                    get_parent_product_hierarchy(p.{ProtocolKey.PARENT_PRODUCT_ID}) AS {ProtocolKey.PARENT_PRODUCT}
-                FROM
-                    {DatabaseTable.PRODUCT} p
-                LEFT JOIN (
-                    SELECT
-                        {ProtocolKey.ID},
-                        ROW_TO_JSON(b) AS {ProtocolKey.BRAND}
-                    FROM
-                        {DatabaseTable.BRAND} b
-                ) b ON p.{ProtocolKey.BRAND_ID} = b.{ProtocolKey.ID}
-                LEFT JOIN (
-                    SELECT
-                        {ProtocolKey.ID},
-                        ROW_TO_JSON(c) AS {ProtocolKey.CREATOR}
-                    FROM 
-                        {DatabaseTable.USER_ACCOUNT} AS c
-                ) AS c ON p.{ProtocolKey.CREATOR_ID} = c.{ProtocolKey.ID}
-                WHERE
-                    p.{ProtocolKey.ALIAS} = %s;
-                """,
+                Product._hydrated_select(f"p.{ProtocolKey.ALIAS} = %s", full_brand=True),
                 (alias,)
             )
             result = cursor.fetchone()
             conn.commit()
 
             if result:
-                ret = cls(result)
-                ret.brand = Brand.get_by_id(ret.brand_id)
-                ret.creator = UserAccount.get_by_id(ret.creator_id)
-                ret.tags = Product.get_tags(ret.id)
-                ret.variant_count = ret.get_variant_count()
-
-                if ret.main_color_code:
-                    ret.main_color = ProductColor.get_by_code(ret.main_color_code)
-
-                if ret.material_id:
-                    ret.material = ProductMaterial.get_by_id(ret.material_id)
+                ret = cls._from_hydrated_row(result)
 
                 if ret.parent_product_id:
                     ret.parent_product = Product.get_by_id(ret.parent_product_id)
-
-                if ret.variant_count > 0:
-                    ret.variants = Product.get_some_variants(ret.id)
         except Exception as e:
             print(e)
         finally:
@@ -992,59 +1435,40 @@ class Product:
         if product_id <= 0:
             raise ValueError("Argument 'product_id' must be a positive, non-zero integer.")
 
-        ret: Type[T] = None
+        return product_cache.get(product_id, cls._get_by_id)
+
+    @staticmethod
+    def get_id_for_alias(alias: str) -> int:
+        if not isinstance(alias, str):
+            raise TypeError(f"Argument 'alias' must be of type str, not {type(alias)}.")
+
+        if not alias:
+            raise ValueError("Argument 'alias' must be a non-empty string.")
+
+        ret: int = 0
         conn = None
         cursor = None
+        alias = alias.lower()
 
         try:
             conn = db.connect()
             cursor = conn.cursor()
-            # This query uses a recursive plpgsql function to nest the full parent product
-            # hierarchy.
             cursor.execute(
                 f"""
                 SELECT
-                    p.*,
-                    b.{ProtocolKey.BRAND},
-                    c.{ProtocolKey.CREATOR},
-                    get_parent_product_hierarchy(p.{ProtocolKey.PARENT_PRODUCT_ID}) AS {ProtocolKey.PARENT_PRODUCT}
+                    *
                 FROM
-                    {DatabaseTable.PRODUCT} p
-                LEFT JOIN (
-                    SELECT
-                        {ProtocolKey.ID},
-                        ROW_TO_JSON(b) AS {ProtocolKey.BRAND}
-                    FROM
-                        {DatabaseTable.BRAND} b
-                ) b ON p.{ProtocolKey.BRAND_ID} = b.{ProtocolKey.ID}
-                LEFT JOIN (
-                    SELECT
-                        {ProtocolKey.ID},
-                        ROW_TO_JSON(c) AS {ProtocolKey.CREATOR}
-                    FROM 
-                        {DatabaseTable.USER_ACCOUNT} AS c
-                ) AS c ON p.{ProtocolKey.CREATOR_ID} = c.{ProtocolKey.ID}
+                    {DatabaseTable.PRODUCT}
                 WHERE
-                    p.{ProtocolKey.ID} = %s;
+                    {ProtocolKey.ALIAS} = %s;
                 """,
-                (product_id,)
+                (alias,)
             )
             result = cursor.fetchone()
             conn.commit()
 
             if result:
-                ret = cls(result)
-                ret.tags = Product.get_tags(ret.id)
-                ret.variant_count = ret.get_variant_count()
-
-                if ret.main_color_code:
-                    ret.main_color = ProductColor.get_by_code(ret.main_color_code)
-
-                if ret.material_id:
-                    ret.material = ProductMaterial.get_by_id(ret.material_id)
-
-                if ret.variant_count > 0:
-                    ret.variants = Product.get_some_variants(ret.id)
+                ret = result[ProtocolKey.ID]
         except Exception as e:
             print(e)
         finally:
@@ -1057,17 +1481,24 @@ class Product:
         return ret
 
     @staticmethod
-    def get_id_for_alias(alias: str) -> int:
-        if not isinstance(alias, str):
-            raise TypeError(f"Argument 'alias' must be of type str, not {type(alias)}.")
+    def get_product_count(brand_id: int,
+                          visible_only: bool = False) -> int:
+        if not isinstance(brand_id, int):
+            raise TypeError(f"Argument 'brand_id' must be of type int, not {type(brand_id)}.")
 
-        if not alias:
-            raise ValueError("Argument 'alias' must be a non-empty string.")
+        if brand_id <= 0:
+            raise ValueError("Argument 'brand_id' must be a positive, non-zero integer.")
 
         ret: int = 0
         conn = None
         cursor = None
-        alias = alias.lower()
+        visibility = ""
+
+        if visible_only:
+            visibility = f"""
+                AND
+                    {ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
+            """
 
         try:
             conn = db.connect()
@@ -1075,19 +1506,23 @@ class Product:
             cursor.execute(
                 f"""
                 SELECT
-                    *
+                    COUNT(*)
                 FROM
                     {DatabaseTable.PRODUCT}
                 WHERE
-                    {ProtocolKey.ALIAS} = %s;
+                    {ProtocolKey.BRAND_ID} = %s
+                AND
+                    {ProtocolKey.PARENT_PRODUCT_ID} IS NULL
+                {visibility};
                 """,
-                (alias,)
+                (brand_id,)
             )
             result = cursor.fetchone()
             conn.commit()
 
             if result:
-                ret = result[ProtocolKey.ID]
+                for item in result.values():
+                    ret = item
         except Exception as e:
             print(e)
         finally:
@@ -1100,39 +1535,45 @@ class Product:
         return ret
 
     @staticmethod
-    def get_product_count(brand_id: int) -> int:
-        if not isinstance(brand_id, int):
-            raise TypeError(f"Argument 'brand_id' must be of type int, not {type(brand_id)}.")
+    def get_product_counts(brand_ids: list[int]) -> dict[int, int]:
+        """
+        Batch counterpart of get_product_count(), keyed by brand ID.
+        """
 
-        if brand_id <= 0:
-            raise ValueError("Argument 'brand_id' must be a positive, non-zero integer.")
+        if not isinstance(brand_ids, list):
+            raise TypeError(f"Argument 'brand_ids' must be of type list, not {type(brand_ids)}.")
 
-        ret: int = 0
+        ret: dict[int, int] = {brand_id: 0 for brand_id in brand_ids}
         conn = None
         cursor = None
 
+        if not brand_ids:
+            return ret
+
         try:
             conn = db.connect()
             cursor = conn.cursor()
             cursor.execute(
                 f"""
                 SELECT
-                    COUNT(*)
+                    {ProtocolKey.BRAND_ID},
+                    COUNT(*) AS {ProtocolKey.PRODUCT_COUNT}
                 FROM
                     {DatabaseTable.PRODUCT}
                 WHERE
-                    {ProtocolKey.BRAND_ID} = %s
+                    {ProtocolKey.BRAND_ID} = ANY(%s)
                 AND
-                    {ProtocolKey.PARENT_PRODUCT_ID} IS NULL;
+                    {ProtocolKey.PARENT_PRODUCT_ID} IS NULL
+                GROUP BY
+                    {ProtocolKey.BRAND_ID};
                 """,
-                (brand_id,)
+                (brand_ids,)
             )
-            result = cursor.fetchone()
+            results = cursor.fetchall()
             conn.commit()
 
-            if result:
-                for item in result.values():
-                    ret = item
+            for result in results:
+                ret[result[ProtocolKey.BRAND_ID]] = result[ProtocolKey.PRODUCT_COUNT]
         except Exception as e:
             print(e)
         finally:
@@ -1220,6 +1661,60 @@ class Product:
 
         return ret
 
+    @classmethod
+    def get_some_products_for_brands(cls: Type[T],
+                                     brand_ids: list[int],
+                                     count: int = 3) -> dict[int, list[T]]:
+        """
+        Batch counterpart of get_some_products(), keyed by brand ID.
+        """
+
+        if not isinstance(brand_ids, list):
+            raise TypeError(f"Argument 'brand_ids' must be of type list, not {type(brand_ids)}.")
+
+        ret: dict[int, list[T]] = {brand_id: [] for brand_id in brand_ids}
+        conn = None
+        cursor = None
+
+        if not brand_ids:
+            return ret
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT
+                    b.{ProtocolKey.ID},
+                    {Product._summary_select(
+                        "bsp",
+                        f"bsp.{ProtocolKey.BRAND_ID} = b.{ProtocolKey.ID} AND bsp.{ProtocolKey.PARENT_PRODUCT_ID} IS NULL",
+                        f"bsp.{ProtocolKey.NAME} ASC",
+                        count
+                    )} AS {ProtocolKey.PRODUCTS}
+                FROM
+                    {DatabaseTable.BRAND} AS b
+                WHERE
+                    b.{ProtocolKey.ID} = ANY(%s);
+                """,
+                (brand_ids,)
+            )
+            results = cursor.fetchall()
+            conn.commit()
+
+            for result in results:
+                ret[result[ProtocolKey.ID]] = [cls(product) for product in result[ProtocolKey.PRODUCTS] or []]
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
     @classmethod
     def get_some_variants(cls: Type[T],
                           parent_product_id: int,
@@ -1393,6 +1888,52 @@ class Product:
 
         return ret
 
+    @staticmethod
+    def get_tags_for_products(product_ids: list[int]) -> dict[int, list[Tag]]:
+        if not isinstance(product_ids, list):
+            raise TypeError(f"Argument 'product_ids' must be of type list, not {type(product_ids)}.")
+
+        ret: dict[int, list[Tag]] = {product_id: [] for product_id in product_ids}
+        conn = None
+        cursor = None
+
+        if not product_ids:
+            return ret
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT
+                    *
+                FROM
+                    {DatabaseTable.TAG}
+                INNER JOIN
+                    {DatabaseTable.PRODUCT_TAG}
+                ON
+                    {DatabaseTable.PRODUCT_TAG}.{ProtocolKey.TAG_ID} = {DatabaseTable.TAG}.{ProtocolKey.ID}
+                WHERE
+                    {DatabaseTable.PRODUCT_TAG}.{ProtocolKey.PRODUCT_ID} = ANY(%s);
+                """,
+                (product_ids,)
+            )
+            results = cursor.fetchall()
+            conn.commit()
+
+            for result in results:
+                ret[result[ProtocolKey.PRODUCT_ID]].append(Tag(result))
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
     def get_variant_count(self) -> int:
         if not self.id:
             raise Exception("Product has no ID associated with it.")
@@ -1595,6 +2136,7 @@ class Product:
                 (edit_access_level.value, self.id)
             )
             conn.commit()
+            product_cache.invalidate(self.id)
         except Exception as e:
             print(e)
         finally:
@@ -1637,6 +2179,10 @@ class Product:
                 (visibility.value, self.id)
             )
             conn.commit()
+            product_cache.invalidate(self.id)
+
+            if self.brand_id:
+                brand_cache.invalidate(self.brand_id)
         except Exception as e:
             print(e)
         finally:
@@ -1680,6 +2226,7 @@ class Product:
                  self.upc, self.url, self.id)
             )
             conn.commit()
+            product_cache.invalidate(self.id)
         except Exception as e:
             print(e)
         finally:
@@ -1721,6 +2268,40 @@ class ProductEditHistory:
 ####################
 
 
+loader.register(EntityType.PRODUCT, Product.get_all_by_ids)
+loader.register((EntityType.BRAND, ProtocolKey.PRODUCT_COUNT), Product.get_product_counts)
+loader.register((EntityType.BRAND, ProtocolKey.PRODUCTS), Product.get_some_products_for_brands)
+loader.register((EntityType.PRODUCT, ProtocolKey.TAGS), Product.get_tags_for_products)
+product_cache = cache.entity_cache(
+    "product",
+    max_size=Configuration.PRODUCT_CACHE_MAX_SIZE,
+    ttl=Configuration.PRODUCT_CACHE_TTL,
+    dependencies={
+        "brand": lambda product, brand_id: product.brand_id == brand_id,
+        "product": lambda product, product_id: (product.parent_product_id == product_id or
+                                                any(variant.id == product_id for variant in product.variants or [])),
+        "user_account": lambda product, account_id: product.creator_id == account_id
+    }
+)
+product_search_cache = cache.search_cache(
+    "product",
+    dependencies=frozenset(["brand", "product", "user_account"])
+)
+
+
+def _on_media_processed(job: MediaJob,
+                        status: MediaStatus) -> None:
+    medium = ProductMedium({
+        ProtocolKey.ID: job.medium_id,
+        ProtocolKey.PRODUCT_ID: job.entity_id
+    })
+
+    # Nothing to do if the medium was deleted in the meantime; deleting
+    # it released its image.
+    if medium.set_status(status, job.derivatives):
+        product_cache.invalidate(job.entity_id)
+
+
 def allowed_media_file(filename: str) -> bool:
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in Configuration.ALLOWED_PRODUCT_MEDIA_FILE_EXTENSIONS
@@ -2063,7 +2644,8 @@ def get_product(alias: str = None,
 
 
 def get_product_variants(offset: str = None,
-                         parent_product_id: str = None) -> tuple[dict, ResponseStatus]:
+                         parent_product_id: str = None,
+                         cursor: str = None) -> tuple[dict, ResponseStatus]:
     if parent_product_id:
         try:
             parent_product_id = int(parent_product_id)
@@ -2100,51 +2682,94 @@ def get_product_variants(offset: str = None,
         response_status = ResponseStatus.OK
         serialized = []
 
-        variants = Product.get_all_variants(parent_product_id, offset=offset)
+        try:
+            variants, next_cursor = Product.get_all_variants(parent_product_id, page_cursor=cursor, offset=offset)
+        except ValueError:
+            return invalid_cursor()
+
+        loader.prime(EntityType.PRODUCT, [variant.parent_product_id for variant in variants])
 
         for variant in variants:
             if variant.parent_product_id:
-                variant.parent_product = Product.get_by_id(variant.parent_product_id)
+                variant.parent_product = loader.load(EntityType.PRODUCT, variant.parent_product_id)
 
             serialized.append(variant.as_dict())
 
         response = {
-            ProtocolKey.PRODUCT_VARIANTS: serialized
+            ProtocolKey.PRODUCT_VARIANTS: serialized,
+            ProtocolKey.NEXT_CURSOR: next_cursor
         }
 
     return (response, response_status)
 
 
 def get_products(query: str = None,
-                 brand_id: str = None) -> tuple[dict, ResponseStatus]:
+                 brand_id: str = None,
+                 cursor: str = None,
+                 page_size: str = None) -> tuple[dict, ResponseStatus]:
+    key = (cache.normalize_query(query), brand_id, cursor, page_size)
+
+    return product_search_cache.get(key, lambda: _get_products(query, brand_id, cursor, page_size))
+
+
+def _get_products(query: str = None,
+                  brand_id: str = None,
+                  cursor: str = None,
+                  page_size: str = None) -> tuple[dict, ResponseStatus]:
     response_status = ResponseStatus.OK
     serialized = []
+    next_cursor = None
+    total_count = None
+    page_size = Common.clamp_page_size(page_size)
 
     if isinstance(query, str):
         query = query.strip()
-        results = Product.get_all(query=query)
+
+        try:
+            results, next_cursor = Product.get_all(query=query, page_cursor=cursor, limit=page_size)
+        except ValueError:
+            return invalid_cursor()
 
         for result in results:
             serialized.append(result.as_dict())
     elif brand_id:
         try:
             brand_id = int(brand_id)
+        except ValueError:
+            brand_id = None
 
-            if brand_id > 0:
-                results = Product.get_all(brand_id=brand_id)
+        if brand_id and brand_id > 0:
+            try:
+                results, next_cursor = Product.get_all(brand_id=brand_id, page_cursor=cursor, limit=page_size)
+            except ValueError:
+                return invalid_cursor()
 
-                for result in results:
-                    serialized.append(result.as_dict())
-        except ValueError:
-            pass
+            for result in results:
+                serialized.append(result.as_dict())
+
+            # One brand's products are few enough to count exactly.
+            if not cursor:
+                total_count = Product.get_product_count(brand_id, visible_only=True)
 
     response = {
-        ProtocolKey.PRODUCTS: serialized
+        ProtocolKey.PRODUCTS: serialized,
+        ProtocolKey.NEXT_CURSOR: next_cursor
     }
 
+    if total_count is not None:
+        response[ProtocolKey.TOTAL_COUNT] = total_count
+        response[ProtocolKey.TOTAL_COUNT_IS_ESTIMATE] = False
+
     return (response, response_status)
 
 
+def get_products_by_tags(tags: str,
+                         match: str = None,
+                         cursor: str = None,
+                         page_size: str = None) -> tuple[dict, ResponseStatus]:
+    return get_tagged(tags, match, cursor, page_size, EntityType.PRODUCT, Product.get_all_by_tags, ProtocolKey.PRODUCTS)
+
+
 def remove_product(product_id: str) -> tuple[dict, ResponseStatus]:
     if product_id:
         try:
@@ -2268,6 +2893,8 @@ def update_media(media_mode: str,
             session_id = request.cookies.get(ProtocolKey.USER_ACCOUNT_SESSION_ID.value)
             user = UserAccount.get_by_session(session_id)
             existing_media = ProductMedium.get_all(product_id)
+            upload_data: dict[str, IO[bytes]] = {}
+            upload_hashes: dict[str, str] = {}
             uploaded_media: dict[str, ProductMedium] = {}
 
             # Pre-processing step.
@@ -2293,29 +2920,17 @@ def update_media(media_mode: str,
             if response_status == ResponseStatus.OK:
                 for key, file in request.files.items():
                     if allowed_media_file(file.filename):
-                        medium_bytes = file.read()
-                        medium_hash = hashlib.sha256(medium_bytes).hexdigest()
-                        # Not necessarily on the local filesystem.
-                        medium_path = f"product/{product_id}/{medium_hash}_media_full.jpg"
-                        # This is also the object key for S3.
-                        medium_metadata = uploaded_media[key]
-                        medium_metadata.file_path = medium_path
-
-                        product_media_dir = os.path.join(Configuration.PRODUCT_MEDIA_DIR, f"{product_id}")
-                        os.makedirs(product_media_dir, exist_ok=True)
-                        # We'd like to standardize all product images to be in JPEG format.
-                        file_path_final = os.path.join(product_media_dir, f"{medium_hash}_media_full.jpg")
-
-                        medium_filename = secure_filename(file.filename)
-                        file_path_tmp = os.path.join("/tmp", medium_filename)
-                        file.stream.seek(0)
-                        file.save(file_path_tmp)
+                        medium_data, medium_hash = media_queue.read_upload(file)
+                        upload_data[key] = medium_data
+                        upload_hashes[key] = medium_hash
 
                         try:
-                            # Convert to JPEG.
-                            pil_image = Image.open(file_path_tmp)
-                            pil_image.save(file_path_final)
-                        except IOError:
+                            # Only reads the headers; the conversion itself happens in the media queue.
+                            with Image.open(medium_data) as pil_image:
+                                pil_image.verify()
+
+                            medium_data.seek(0)
+                        except Exception:
                             # File is not an image file.
                             response_status = ResponseStatus.BAD_REQUEST
                             response = {
@@ -2324,19 +2939,33 @@ def update_media(media_mode: str,
                                     ProtocolKey.ERROR_MESSAGE: f"Invalid file. Allowed media formats: {', '.join(Configuration.ALLOWED_PRODUCT_MEDIA_FILE_EXTENSIONS)}"
                                 }
                             }
-                        finally:
-                            # Clean up.
-                            os.remove(file_path_tmp)
-
-                            if response_status != ResponseStatus.OK:
-                                break
+                            break
 
             if response_status == ResponseStatus.OK:
                 final: list[ProductMedium] = []
 
                 for key, medium in uploaded_media.items():
                     if key in request.files.keys():
-                        # New upload.
+                        if key not in upload_hashes:
+                            # Not an allowed file type.
+                            continue
+
+                        # New upload. Identical images share one stored copy.
+                        blob = MediaBlob.acquire(upload_hashes[key])
+
+                        if not blob:
+                            # Fail the whole request so it rolls back and
+                            # can be retried as is.
+                            response_status = ResponseStatus.INTERNAL_SERVER_ERROR
+                            response = {
+                                ProtocolKey.ERROR: {
+                                    ProtocolKey.ERROR_CODE: response_status.value,
+                                    ProtocolKey.ERROR_MESSAGE: "The media could not be saved."
+                                }
+                            }
+                            break
+
+                        medium.file_path = blob.file_path
                         new_medium = ProductMedium.create(
                             medium.attribution,
                             user.id,
@@ -2344,15 +2973,29 @@ def update_media(media_mode: str,
                             medium.index,
                             media_mode,
                             medium.media_type,
-                            product_id
+                            product_id,
+                            derivatives=blob.derivatives,
+                            status=blob.status
                         )
+
+                        if not new_medium:
+                            media_queue.release(blob.file_path)
+                            continue
+
                         final.append(new_medium)
 
-                        if not app.debug:
-                            file_path_final = os.path.join(Configuration.MEDIA_DIR, medium.file_path)
-                            s3.upload_media(file_path_final, medium.file_path)
-                            # Don't need the local file anymore.
-                            os.remove(file_path_final)
+                        if blob.status == MediaStatus.PENDING:
+                            # Conversion and storage happen in the background;
+                            # the medium turns ready once they're done.
+                            job = MediaJob.create(
+                                upload_data[key],
+                                user.id,
+                                product_id,
+                                EntityType.PRODUCT,
+                                medium.file_path,
+                                medium_id=new_medium.id
+                            )
+                            media_queue.enqueue(job)
 
                         Product.add_history(
                             product_id,
@@ -2373,49 +3016,45 @@ def update_media(media_mode: str,
                             medium.attribution
                         )
 
-                # Check which media are in existing but not in upload.
-                # These need to be deleted.
-                for existing in existing_media:
-                    exists = False
-
-                    for uploaded in uploaded_media.values():
-                        if uploaded.id == existing.id:
-                            uploaded.creation_timestamp = existing.creation_timestamp
-                            uploaded.creator = existing.creator
-                            uploaded.creator_id = existing.creator_id
-                            uploaded.file_path = existing.file_path
-                            exists = True
-                            break
+                if response_status == ResponseStatus.OK:
+                    # Check which media are in existing but not in upload.
+                    # These need to be deleted.
+                    for existing in existing_media:
+                        exists = False
+
+                        for uploaded in uploaded_media.values():
+                            if uploaded.id == existing.id:
+                                uploaded.creation_timestamp = existing.creation_timestamp
+                                uploaded.creator = existing.creator
+                                uploaded.creator_id = existing.creator_id
+                                uploaded.file_path = existing.file_path
+                                exists = True
+                                break
 
-                    if not exists:
-                        existing.delete()
+                        if not exists:
+                            existing.delete()
+                            media_queue.release(existing.file_path, existing.derivatives)
 
-                        if app.debug:
-                            # Delete the local file.
-                            try:
-                                os.remove(os.path.join(Configuration.MEDIA_DIR, existing.file_path))
-                            except OSError:
-                                pass
-                        else:
-                            s3.delete_media(existing.file_path)
+                            Product.add_history(
+                                product_id,
+                                user.id,
+                                UserAction.DELETED,
+                                Field.PRODUCT_MEDIA,
+                                existing.file_path
+                            )
 
-                        Product.add_history(
-                            product_id,
-                            user.id,
-                            UserAction.DELETED,
-                            Field.PRODUCT_MEDIA,
-                            existing.file_path
-                        )
+                    final_serialized = []
 
-                final_serialized = []
+                    for medium in final:
+                        final_serialized.append(medium.as_dict())
 
-                for medium in final:
-                    final_serialized.append(medium.as_dict())
+                    response = {
+                        ProtocolKey.MEDIA: final_serialized,
+                        ProtocolKey.PRODUCT_ID: product_id
+                    }
 
-                response = {
-                    ProtocolKey.MEDIA: final_serialized,
-                    ProtocolKey.PRODUCT_ID: product_id
-                }
+            for medium_data in upload_data.values():
+                medium_data.close()
         else:
             response_status = ResponseStatus.NOT_FOUND
             response = {
@@ -2872,3 +3511,6 @@ def update_product(description: str,
                 }
 
     return (response, response_status)
+
+
+media_queue.register(EntityType.PRODUCT, _on_media_processed)
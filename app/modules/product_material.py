@@ -1,7 +1,7 @@
 from typing import Any, TypeVar, Type
 
-from app.config import DatabaseTable, ProtocolKey, ResponseStatus
-from app.modules import db
+from app.config import ProtocolKey, ResponseStatus
+from app.modules import reference_data
 
 
 ###########
@@ -51,34 +51,7 @@ class ProductMaterial:
 
     @classmethod
     def get_all(cls: Type[T]) -> list[T]:
-        ret = []
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.PRODUCT_MATERIAL}
-                ORDER BY {ProtocolKey.NAME} ASC;
-                """
-            )
-            results = cursor.fetchall()
-            conn.commit()
-
-            for result in results:
-                ret.append(cls(result))
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return list(reference_data.get().product_materials)
 
     @classmethod
     def get_by_id(cls: Type[T],
@@ -89,35 +62,7 @@ class ProductMaterial:
         if material_id <= 0:
             raise ValueError("Argument 'material_id' must be a positive, non-zero integer.")
 
-        ret: Type[T] = None
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.PRODUCT_MATERIAL}
-                WHERE {ProtocolKey.ID} = %s;
-                """,
-                (material_id,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = cls(result)
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return reference_data.get().product_materials_by_id.get(material_id)
 
 
 ####################
@@ -139,3 +84,11 @@ def get_all() -> tuple[dict, ResponseStatus]:
     }
 
     return (response, response_status)
+
+
+def get_all_serialized() -> reference_data.SerializedBody:
+    """
+    Same response as get_all(), preserialized along with its ETag.
+    """
+
+    return reference_data.get_body("product_materials")
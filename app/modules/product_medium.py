@@ -1,9 +1,10 @@
 from datetime import datetime
+import json
 from typing import Any, TypeVar, Type
 
-from app.config import DatabaseTable, MediaMode, MediaType, \
-    ProtocolKey
-from app.modules import db
+from app.config import DatabaseTable, EntityType, MediaMode, \
+    MediaStatus, MediaType, ProtocolKey
+from app.modules import db, loader
 from app.modules.user_account import UserAccount
 
 
@@ -22,12 +23,14 @@ class ProductMedium:
         self.creation_timestamp: datetime = None
         self.creator: UserAccount = None
         self.creator_id: int = None
+        self.derivatives: list[dict] = []
         self.file_path: str = None
         self.id: str = None
         self.index: int = None
         self.media_mode: MediaMode = None
         self.media_type: MediaType = None
         self.product_id: int = None
+        self.status: MediaStatus = MediaStatus.READY
 
         if data:
             if ProtocolKey.ATTRIBUTION in data:
@@ -39,6 +42,9 @@ class ProductMedium:
             if ProtocolKey.CREATOR_ID in data:
                 self.creator_id: int = data[ProtocolKey.CREATOR_ID]
 
+            if ProtocolKey.DERIVATIVES in data and data[ProtocolKey.DERIVATIVES]:
+                self.derivatives: list[dict] = data[ProtocolKey.DERIVATIVES]
+
             if ProtocolKey.FILE_PATH in data:
                 self.file_path: str = data[ProtocolKey.FILE_PATH]
 
@@ -57,6 +63,9 @@ class ProductMedium:
             if ProtocolKey.PRODUCT_ID in data:
                 self.product_id: int = data[ProtocolKey.PRODUCT_ID]
 
+            if ProtocolKey.STATUS in data and data[ProtocolKey.STATUS]:
+                self.status: MediaStatus = MediaStatus(data[ProtocolKey.STATUS])
+
     def __eq__(self,
                __o: object) -> bool:
         ret = False
@@ -77,12 +86,14 @@ class ProductMedium:
         serialized = {
             ProtocolKey.ATTRIBUTION: self.attribution,
             ProtocolKey.CREATOR_ID: self.creator_id,
+            ProtocolKey.DERIVATIVES: self.derivatives,
             ProtocolKey.FILE_PATH: self.file_path,
             ProtocolKey.ID: self.id,
             ProtocolKey.INDEX: self.index,
             ProtocolKey.MEDIA_MODE: self.media_mode,
             ProtocolKey.MEDIA_TYPE: self.media_type,
-            ProtocolKey.PRODUCT_ID: self.product_id
+            ProtocolKey.PRODUCT_ID: self.product_id,
+            ProtocolKey.STATUS: self.status
         }
 
         if self.creation_timestamp:
@@ -101,7 +112,9 @@ class ProductMedium:
                index: int,
                media_mode: MediaMode,
                media_type: MediaType,
-               product_id: int) -> T:
+               product_id: int,
+               derivatives: list[dict] = None,
+               status: MediaStatus = MediaStatus.READY) -> T:
         if attribution and not isinstance(attribution, str):
             raise TypeError(f"Argument 'attribution' must be of type str, not {type(attribution)}.")
 
@@ -135,6 +148,14 @@ class ProductMedium:
         if product_id <= 0:
             raise ValueError("Argument 'product_id' must be a positive, non-zero integer.")
 
+        if derivatives is None:
+            derivatives = []
+        elif not isinstance(derivatives, list):
+            raise TypeError(f"Argument 'derivatives' must be of type list, not {type(derivatives)}.")
+
+        if not isinstance(status, MediaStatus):
+            raise TypeError(f"Argument 'status' must be of type MediaStatus, not {type(status)}.")
+
         ret: Type[T] = None
         conn = None
         cursor = None
@@ -145,18 +166,18 @@ class ProductMedium:
             cursor.execute(
                 f"""
                 INSERT INTO {DatabaseTable.PRODUCT_MEDIUM}
-                ({ProtocolKey.ATTRIBUTION}, {ProtocolKey.CREATOR_ID}, {ProtocolKey.FILE_PATH},
-                {ProtocolKey.INDEX}, {ProtocolKey.MEDIA_MODE}, {ProtocolKey.MEDIA_TYPE},
-                {ProtocolKey.PRODUCT_ID})
+                ({ProtocolKey.ATTRIBUTION}, {ProtocolKey.CREATOR_ID}, {ProtocolKey.DERIVATIVES},
+                {ProtocolKey.FILE_PATH}, {ProtocolKey.INDEX}, {ProtocolKey.MEDIA_MODE},
+                {ProtocolKey.MEDIA_TYPE}, {ProtocolKey.PRODUCT_ID}, {ProtocolKey.STATUS})
                 VALUES
-                (%s, %s, %s, 
+                (%s, %s, %s::jsonb,
                  %s, %s, %s,
-                 %s)
+                 %s, %s, %s)
                  RETURNING *;
                 """,
-                (attribution, creator_id, file_path,
-                 index, media_mode.value, media_type.value,
-                 product_id)
+                (attribution, creator_id, json.dumps(derivatives),
+                 file_path, index, media_mode.value,
+                 media_type.value, product_id, status.value)
             )
 
             result = cursor.fetchone()
@@ -217,28 +238,98 @@ class ProductMedium:
         if product_id <= 0:
             raise ValueError("Argument 'product_id' must be a positive, non-zero integer.")
 
-        ret: list[T] = []
+        return cls.get_all_for_products([product_id]).get(product_id, [])
+
+    @classmethod
+    def get_all_for_products(cls: Type[T],
+                             product_ids: list[int]) -> dict[int, list[T]]:
+        """
+        Batch counterpart of get_all(), keyed by product ID. Creators are
+        resolved through the loader so they cost one query in total.
+        """
+
+        if not isinstance(product_ids, list):
+            raise TypeError(f"Argument 'product_ids' must be of type list, not {type(product_ids)}.")
+
+        ret: dict[int, list[T]] = {product_id: [] for product_id in product_ids}
         conn = None
         cursor = None
 
+        if not product_ids:
+            return ret
+
         try:
             conn = db.connect()
             cursor = conn.cursor()
             cursor.execute(
                 f"""
                 SELECT * FROM {DatabaseTable.PRODUCT_MEDIUM}
-                WHERE {ProtocolKey.PRODUCT_ID} = %s
+                WHERE {ProtocolKey.PRODUCT_ID} = ANY(%s)
                 ORDER BY {ProtocolKey.INDEX} ASC;
                 """,
-                (product_id,)
+                (product_ids,)
             )
             results = cursor.fetchall()
             conn.commit()
 
-            for result in results:
-                medium = cls(result)
-                medium.creator = UserAccount.get_by_id(medium.creator_id)
-                ret.append(medium)
+            media = [cls(result) for result in results]
+            creators = loader.load_many(EntityType.USER_ACCOUNT, [medium.creator_id for medium in media])
+
+            for medium, creator in zip(media, creators):
+                medium.creator = creator
+                ret[medium.product_id].append(medium)
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
+    def set_status(self,
+                   status: MediaStatus,
+                   derivatives: list[dict] = None) -> bool:
+        """
+        Also sets the medium's derivatives, if given. Returns False if the
+        medium no longer exists, e.g. because it was deleted while it was
+        being processed.
+        """
+
+        if not self.id:
+            raise Exception("Medium has no ID associated with it.")
+
+        if not isinstance(status, MediaStatus):
+            raise TypeError(f"Argument 'status' must be of type MediaStatus, not {type(status)}.")
+
+        if derivatives is not None and not isinstance(derivatives, list):
+            raise TypeError(f"Argument 'derivatives' must be of type list, not {type(derivatives)}.")
+
+        ret = False
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                UPDATE {DatabaseTable.PRODUCT_MEDIUM}
+                SET {ProtocolKey.STATUS} = %s, {ProtocolKey.DERIVATIVES} = COALESCE(%s::jsonb, {ProtocolKey.DERIVATIVES})
+                WHERE {ProtocolKey.ID} = %s;
+                """,
+                (status.value, json.dumps(derivatives) if derivatives is not None else None, self.id)
+            )
+            ret = cursor.rowcount > 0
+            conn.commit()
+
+            if ret:
+                self.status = status
+
+                if derivatives is not None:
+                    self.derivatives = derivatives
         except Exception as e:
             print(e)
         finally:
@@ -282,3 +373,6 @@ class ProductMedium:
 ####################
 # MODULE FUNCTIONS #
 ####################
+
+
+loader.register((EntityType.PRODUCT, ProtocolKey.MEDIA), ProductMedium.get_all_for_products)
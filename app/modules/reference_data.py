@@ -0,0 +1,234 @@
+import hashlib
+import threading
+from typing import Any, NamedTuple
+
+from app import app
+from app.config import DatabaseTable, ProtocolKey
+from app.modules import cache, db
+
+
+###########
+# CLASSES #
+###########
+
+
+class SerializedBody(NamedTuple):
+    body: bytes
+    etag: str
+
+
+class ReferenceData:
+    """
+    An immutable snapshot of the reference tables (continents, currencies,
+    countries, dialing codes, product colours and materials), indexed by
+    every key they get looked up by. List responses are serialized once
+    up front along with an ETag derived from their content.
+
+    The objects handed out are shared by every request in the process and
+    must be treated as read-only.
+    """
+
+    def __init__(self,
+                 data: dict[DatabaseTable, list[dict]]) -> None:
+        from app.modules.continent import Continent
+        from app.modules.country import Country
+        from app.modules.country_dialing_code import CountryDialingCode
+        from app.modules.currency import Currency
+        from app.modules.product_color import ProductColor
+        from app.modules.product_material import ProductMaterial
+
+        self.continents: list[Continent] = [Continent(row) for row in data.get(DatabaseTable.CONTINENT, [])]
+        self.continents_by_code: dict[str, Continent] = {continent.code: continent for continent in self.continents}
+        self.continents_by_name: dict[str, Continent] = {continent.name: continent for continent in self.continents}
+
+        self.currencies: list[Currency] = [Currency(row) for row in data.get(DatabaseTable.CURRENCY, [])]
+        self.currencies_by_code: dict[str, Currency] = {currency.code: currency for currency in self.currencies}
+
+        # Countries and dialing codes are built without their relation
+        # codes so their constructors don't look them up; the relations
+        # are wired up from the indexes above instead.
+        self.countries: list[Country] = []
+        self.enabled_countries: list[Country] = []
+
+        for row in data.get(DatabaseTable.COUNTRY, []):
+            country = Country({key: value for key, value in row.items()
+                               if key not in (ProtocolKey.CONTINENT_CODE, ProtocolKey.CURRENCY_CODE)})
+            country.continent = self.continents_by_code.get(row.get(ProtocolKey.CONTINENT_CODE))
+            country.currency = self.currencies_by_code.get(row.get(ProtocolKey.CURRENCY_CODE))
+            self.countries.append(country)
+
+            if row.get(ProtocolKey.IS_ENABLED):
+                self.enabled_countries.append(country)
+
+        self.countries_by_alpha_2_code: dict[str, Country] = {country.alpha_2_code: country for country in self.countries}
+        self.countries_by_alpha_3_code: dict[str, Country] = {country.alpha_3_code: country for country in self.countries}
+        self.countries_by_continent: dict[str, list[Country]] = {}
+        self.countries_by_name: dict[str, Country] = {country.name: country for country in self.countries}
+        self.countries_by_numeric_3_code: dict[str, Country] = {country.numeric_3_code: country for country in self.countries}
+
+        for country in self.countries:
+            if country.continent:
+                self.countries_by_continent.setdefault(country.continent.code, []).append(country)
+
+        self.dialing_codes: list[CountryDialingCode] = []
+
+        for row in data.get(DatabaseTable.COUNTRY_DIALING_CODE, []):
+            dialing_code = CountryDialingCode({key: value for key, value in row.items()
+                                               if key != ProtocolKey.ALPHA_2_CODE})
+            dialing_code.country = self.countries_by_alpha_2_code.get(row.get(ProtocolKey.ALPHA_2_CODE))
+            self.dialing_codes.append(dialing_code)
+
+        enabled_countries = set(self.enabled_countries)
+        self.enabled_dialing_codes: list[CountryDialingCode] = [dialing_code for dialing_code in self.dialing_codes
+                                                                if dialing_code.country in enabled_countries]
+        self.dialing_codes_by_country: dict[str, list[CountryDialingCode]] = {}
+        self.dialing_codes_by_country_and_code: dict[tuple[str, str], CountryDialingCode] = {}
+        self.dialing_codes_by_id: dict[int, CountryDialingCode] = {dialing_code.id: dialing_code
+                                                                   for dialing_code in self.dialing_codes}
+
+        for dialing_code in self.dialing_codes:
+            if dialing_code.country:
+                alpha_2_code = dialing_code.country.alpha_2_code
+                self.dialing_codes_by_country.setdefault(alpha_2_code, []).append(dialing_code)
+                self.dialing_codes_by_country_and_code[(alpha_2_code, dialing_code.code)] = dialing_code
+
+        self.product_colors: list[ProductColor] = [ProductColor(row) for row in data.get(DatabaseTable.PRODUCT_COLOR, [])]
+        self.product_colors_by_hex: dict[str, ProductColor] = {color.hex: color for color in self.product_colors}
+
+        self.product_materials: list[ProductMaterial] = [ProductMaterial(row) for row in data.get(DatabaseTable.PRODUCT_MATERIAL, [])]
+        self.product_materials_by_id: dict[int, ProductMaterial] = {material.id: material for material in self.product_materials}
+
+        self.bodies: dict[str, SerializedBody] = {
+            "countries": self._serialize(ProtocolKey.COUNTRIES, self.countries),
+            "countries:enabled": self._serialize(ProtocolKey.COUNTRIES, self.enabled_countries),
+            "dialing_codes": self._serialize(ProtocolKey.DIALING_CODES, self.dialing_codes),
+            "dialing_codes:enabled": self._serialize(ProtocolKey.DIALING_CODES, self.enabled_dialing_codes),
+            "product_colors": self._serialize(ProtocolKey.PRODUCT_COLORS, self.product_colors),
+            "product_materials": self._serialize(ProtocolKey.PRODUCT_MATERIALS, self.product_materials)
+        }
+
+    @staticmethod
+    def _serialize(key: ProtocolKey,
+                   items: list[Any]) -> SerializedBody:
+        # Encoded with the app's JSON provider, like every other response
+        # body, though without the indentation jsonify adds in debug mode.
+        body = f"{app.json.dumps({key: [item.as_dict() for item in items]})}\n".encode()
+        etag = hashlib.sha1(body).hexdigest()
+
+        return SerializedBody(body, etag)
+
+    @classmethod
+    def load(cls) -> "ReferenceData":
+        """
+        Reads every reference table in one go. Raises if the database
+        can't be reached so a half-empty snapshot never gets installed.
+
+        Uses a connection of its own: this runs at startup, before the
+        workers fork, where a pool would be wasted, and reloads shouldn't
+        join whatever request happens to trigger them.
+        """
+
+        data = {}
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect_unpooled()
+            cursor = conn.cursor()
+
+            for table, order in (
+                (DatabaseTable.CONTINENT, ProtocolKey.CODE),
+                (DatabaseTable.CURRENCY, ProtocolKey.CODE),
+                (DatabaseTable.COUNTRY, ProtocolKey.NAME),
+                (DatabaseTable.COUNTRY_DIALING_CODE, ProtocolKey.ID),
+                (DatabaseTable.PRODUCT_COLOR, ProtocolKey.NAME),
+                (DatabaseTable.PRODUCT_MATERIAL, ProtocolKey.NAME)
+            ):
+                cursor.execute(
+                    f"""
+                    SELECT * FROM {table}
+                    ORDER BY {order} ASC;
+                    """
+                )
+                data[table] = cursor.fetchall()
+
+            conn.commit()
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return cls(data)
+
+
+####################
+# MODULE FUNCTIONS #
+####################
+
+
+REFERENCE_DATA_CHANNEL = "reference_data"
+_registry: ReferenceData = None
+_registry_lock = threading.Lock()
+
+
+def _on_reference_data_notification(payload: str) -> None:
+    # Also called with None after the listener reconnects, in which case
+    # a change may have gone by unnoticed.
+    reload()
+
+
+def get() -> ReferenceData:
+    """
+    Returns the snapshot built at startup. Should that have failed, it's
+    loaded on first use instead; if the database is still unavailable an
+    empty snapshot is returned (but not kept) so the next call tries
+    again.
+    """
+
+    global _registry
+
+    if _registry is not None:
+        return _registry
+
+    with _registry_lock:
+        if _registry is None:
+            try:
+                _registry = ReferenceData.load()
+            except Exception as e:
+                print(e)
+
+                return ReferenceData({})
+
+    return _registry
+
+
+def get_body(name: str) -> SerializedBody:
+    return get().bodies[name]
+
+
+def reload() -> None:
+    """
+    Builds a fresh snapshot and swaps it in. Requests already holding the
+    old one keep using it; on failure the old one stays in place.
+    """
+
+    global _registry
+
+    try:
+        registry = ReferenceData.load()
+    except Exception as e:
+        print(e)
+
+        return
+
+    with _registry_lock:
+        _registry = registry
+
+
+cache.subscribe(REFERENCE_DATA_CHANNEL, _on_reference_data_notification)
+# Build the snapshot at startup. The snapshot is never modified, so
+# workers forked afterwards share it as is; each one's listener keeps
+# its copy current from then on.
+reload()
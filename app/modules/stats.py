@@ -0,0 +1,30 @@
+from app.config import ProtocolKey, ResponseStatus
+from app.modules import cache, db, media_queue, store_map
+from app.modules.user_account_session import session_cache
+
+
+####################
+# MODULE FUNCTIONS #
+####################
+
+
+def get_stats() -> tuple[dict, ResponseStatus]:
+    """
+    Counters for the connection pool and caches of the worker process
+    handling the request; each worker keeps its own. These are internal,
+    so the route serving them is restricted to admins.
+    """
+
+    response_status = ResponseStatus.OK
+    response = {
+        ProtocolKey.STATS: {
+            "db_pool": db.get_pool_stats(),
+            "entity_caches": cache.get_entity_cache_stats(),
+            "media_queue": media_queue.get_queue_stats(),
+            "search_caches": cache.get_search_cache_stats(),
+            "session_cache": session_cache.stats(),
+            "store_map_cache": store_map.get_tile_cache_stats()
+        }
+    }
+
+    return (response, response_status)
@@ -10,8 +10,9 @@ from urllib.parse import urlparse
 from app.config import Configuration, ContentVisibility, DatabaseTable, \
     EditAccessLevel, EntityType, ProtocolKey, \
     ResponseStatus, StoreStatus
-from app.modules import db
+from app.modules import cache, db, loader, store_map
 from app.modules.brand import Brand
+from app.modules.common import Common, invalid_cursor
 from app.modules.country import Country
 from app.modules.locality import Locality
 from app.modules.tag import Tag
@@ -116,6 +117,7 @@ class Store:
         self.creator: UserAccount = None
         self.creator_id: int = 0
         self.description: str = None
+        self.distance: float = None
         self.edit_access_level: EditAccessLevel = EditAccessLevel.OPEN
         self.id: int = 0
         self.name: str = None
@@ -129,7 +131,7 @@ class Store:
                 self.alias: str = data[ProtocolKey.ALIAS]
 
             if ProtocolKey.BRAND_ID in data and data[ProtocolKey.BRAND_ID]:
-                self.brand = Brand.get_by_id(data[ProtocolKey.BRAND_ID])
+                self.brand = loader.load(EntityType.BRAND, data[ProtocolKey.BRAND_ID])
 
             if ProtocolKey.BUILDING in data:
                 self.address.building: str = data[ProtocolKey.BUILDING]
@@ -146,6 +148,9 @@ class Store:
             if ProtocolKey.DESCRIPTION in data:
                 self.description: str = data[ProtocolKey.DESCRIPTION]
 
+            if ProtocolKey.DISTANCE in data:
+                self.distance: float = data[ProtocolKey.DISTANCE]
+
             if ProtocolKey.EDIT_ACCESS_LEVEL in data and data[ProtocolKey.EDIT_ACCESS_LEVEL]:
                 self.edit_access_level = EditAccessLevel(data[ProtocolKey.EDIT_ACCESS_LEVEL])
 
@@ -156,7 +161,7 @@ class Store:
                 self.id: int = data[ProtocolKey.ID]
 
             if ProtocolKey.LOCALITY_ID in data and data[ProtocolKey.LOCALITY_ID]:
-                self.address.locality = Locality.get_by_id(data[ProtocolKey.LOCALITY_ID])
+                self.address.locality = loader.load(EntityType.LOCALITY, data[ProtocolKey.LOCALITY_ID])
 
             if ProtocolKey.NAME in data:
                 self.name: str = data[ProtocolKey.NAME]
@@ -200,6 +205,66 @@ class Store:
 
         return ret
 
+    @classmethod
+    def _get_by_id(cls: Type[T],
+                   store_id: int) -> T:
+        """
+        Uncached get_by_id().
+        """
+
+        ret: Type[T] = None
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT *, ST_AsText(coordinates) as {ProtocolKey.COORDINATES_TEXT}
+                FROM {DatabaseTable.STORE}
+                WHERE {ProtocolKey.ID} = %s;
+                """,
+                (store_id,)
+            )
+            result = cursor.fetchone()
+            conn.commit()
+
+            if result:
+                ret = cls(result)
+                ret.creator = UserAccount.get_by_id(ret.creator_id)
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
+    def _invalidate_map_tiles(self) -> None:
+        """
+        Drops the cached map tiles showing the store or covering its
+        current location.
+        """
+
+        if self.address.coordinates:
+            store_map.invalidate(self.id, self.address.coordinates.x, self.address.coordinates.y)
+        else:
+            store_map.invalidate(self.id)
+
+    @staticmethod
+    def _prime_relations(results: list[dict]) -> None:
+        """
+        Queues the brands and localities referenced by results so that
+        constructing the stores fetches each kind with a single query.
+        """
+
+        loader.prime(EntityType.BRAND, [result.get(ProtocolKey.BRAND_ID) for result in results])
+        loader.prime(EntityType.LOCALITY, [result.get(ProtocolKey.LOCALITY_ID) for result in results])
+
     @staticmethod
     def alias_exists(alias: str) -> bool:
         """
@@ -287,6 +352,9 @@ class Store:
         if self.creator:
             serialized[ProtocolKey.CREATOR] = self.creator.as_dict()
 
+        if self.distance is not None:
+            serialized[ProtocolKey.DISTANCE] = self.distance
+
         if self.edit_access_level:
             serialized[ProtocolKey.EDIT_ACCESS_LEVEL] = self.edit_access_level.value
 
@@ -383,6 +451,10 @@ class Store:
                     """,
                     (ret.id, alias, EntityType.STORE)
                 )
+
+                # Drops cached searches and map tiles that might now include it.
+                store_cache.invalidate(ret.id)
+                store_map.invalidate(ret.id, coordinates.x, coordinates.y)
                 conn.commit()
         except Exception as e:
             print(e)
@@ -464,6 +536,10 @@ class Store:
                 )
 
             conn.commit()
+
+            if self.id:
+                store_cache.invalidate(self.id)
+                self._invalidate_map_tiles()
         except Exception as e:
             print(e)
         finally:
@@ -475,31 +551,53 @@ class Store:
 
     @classmethod
     def get_all(cls: Type[T],
-                query: str) -> list[T]:
+                query: str,
+                page_cursor: str = None,
+                limit: int = Configuration.PAGE_SIZE) -> tuple[list[T], str]:
+        """
+        Returns a page of stores ranked by relevance along with the cursor
+        for the next page (None on the last one).
+        """
+
         if not isinstance(query, str):
             raise TypeError(f"Argument 'query' must be of type str, not {type(query)}.")
 
         ret: list[T] = []
+        next_cursor: str = None
         conn = None
         cursor = None
+        after = Common.decode_cursor(page_cursor, ((float, int), int))
+        keyset = ""
+        params = [query, query]
+
+        if after:
+            keyset = f"WHERE (match.rank, match.{ProtocolKey.ID}) < (%s::real, %s)"
+            params += after
+
+        params.append(limit + 1)
 
         try:
             conn = db.connect()
             cursor = conn.cursor()
             cursor.execute(
                 f"""
-                SELECT *, ts_rank(match.{ProtocolKey.POSTGRES_SEARCH_NAME}, plainto_tsquery('english', %s)) AS rank FROM
-                (SELECT *, ST_AsText(coordinates) as {ProtocolKey.COORDINATES_TEXT}
+                SELECT * FROM
+                (SELECT *, ST_AsText(coordinates) as {ProtocolKey.COORDINATES_TEXT},
+                ts_rank({ProtocolKey.POSTGRES_SEARCH_NAME}, plainto_tsquery('english', %s)) AS rank
                 FROM {DatabaseTable.STORE}
                 WHERE {ProtocolKey.POSTGRES_SEARCH_NAME} @@ plainto_tsquery('english', %s)
                 AND {ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value}))
                 AS match
-                ORDER BY rank DESC;
+                {keyset}
+                ORDER BY match.rank DESC, match.{ProtocolKey.ID} DESC
+                LIMIT %s;
                 """,
-                (query, query)
+                params
             )
-            results = cursor.fetchall()
+            results, next_cursor = Common.paginate(cursor.fetchall(), limit,
+                                                   lambda row: [row["rank"], row[ProtocolKey.ID]])
             conn.commit()
+            Store._prime_relations(results)
 
             for result in results:
                 ret.append(cls(result))
@@ -512,6 +610,54 @@ class Store:
             if conn:
                 conn.close()
 
+        return (ret, next_cursor)
+
+    @classmethod
+    def get_all_by_ids(cls: Type[T],
+                       store_ids: list[int]) -> dict[int, T]:
+        """
+        Batch counterpart of get_by_id(), keyed by store ID.
+        """
+
+        if not isinstance(store_ids, list):
+            raise TypeError(f"Argument 'store_ids' must be of type list, not {type(store_ids)}.")
+
+        ret: dict[int, T] = {}
+        conn = None
+        cursor = None
+
+        if not store_ids:
+            return ret
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT *, ST_AsText(coordinates) as {ProtocolKey.COORDINATES_TEXT}
+                FROM {DatabaseTable.STORE}
+                WHERE {ProtocolKey.ID} = ANY(%s);
+                """,
+                (store_ids,)
+            )
+            results = cursor.fetchall()
+            conn.commit()
+            Store._prime_relations(results)
+            stores = [cls(result) for result in results]
+            creators = loader.load_many(EntityType.USER_ACCOUNT, [store.creator_id for store in stores])
+
+            for store, creator in zip(stores, creators):
+                store.creator = creator
+                ret[store.id] = store
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
         return ret
 
     @classmethod
@@ -540,6 +686,7 @@ class Store:
             )
             results = cursor.fetchall()
             conn.commit()
+            Store._prime_relations(results)
 
             for result in results:
                 ret.append(cls(result))
@@ -605,37 +752,7 @@ class Store:
         if store_id <= 0:
             raise ValueError("Argument 'store_id' must be a positive, non-zero integer.")
 
-        ret: Type[T] = None
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT *, ST_AsText(coordinates) as {ProtocolKey.COORDINATES_TEXT}
-                FROM {DatabaseTable.STORE}
-                WHERE {ProtocolKey.ID} = %s;
-                """,
-                (store_id,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = cls(result)
-                ret.creator = UserAccount.get_by_id(ret.creator_id)
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return store_cache.get(store_id, cls._get_by_id)
 
     @staticmethod
     def get_id_for_alias(alias: str) -> int:
@@ -678,8 +795,15 @@ class Store:
     @classmethod
     def get_nearby(cls: Type[T],
                    coordinates: Point,
-                   radius: int = 1000) -> list[T]:
+                   radius: int = Configuration.STORE_NEARBY_RADIUS,
+                   page_cursor: str = None,
+                   limit: int = Configuration.PAGE_SIZE) -> tuple[list[T], str]:
         """
+        Returns a page of the stores within radius of coordinates, nearest
+        first, each with its distance, along with the cursor for the next
+        page (None on the last one). The GiST index hands rows back in
+        distance order (<->), so only the page is ever read.
+
         :param radius: The search radius in meters.
         :type radius: int
         """
@@ -690,27 +814,55 @@ class Store:
         if not isinstance(radius, int):
             raise TypeError(f"Argument 'radius' must be of type int, not {type(radius)}.")
 
+        if radius <= 0:
+            raise ValueError("Argument 'radius' must be a positive, non-zero integer.")
+
         ret: list[T] = []
+        next_cursor: str = None
         conn = None
         cursor = None
+        after = Common.decode_cursor(page_cursor, ((float, int), int))
+        keyset = ""
+        params = {
+            "limit": limit + 1,
+            "origin": coordinates,
+            "radius": min(radius, Configuration.STORE_NEARBY_RADIUS_MAX)
+        }
+
+        if after:
+            keyset = f"""
+            AND
+                ({ProtocolKey.COORDINATES} <-> ST_GeogFromText(%(origin)s), {ProtocolKey.ID}) > (%(distance)s::float8, %(id)s)
+            """
+            params["distance"], params["id"] = after
 
         try:
             conn = db.connect()
             cursor = conn.cursor()
             cursor.execute(
                 f"""
-                SELECT *, ST_AsText(coordinates) as {ProtocolKey.COORDINATES_TEXT}
-                FROM {DatabaseTable.STORE}
-                WHERE ST_DWithin({ProtocolKey.COORDINATES}::geography,
-                                 ST_GeogFromText(%s),
-                                 %s, false)
-                AND {ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
-                LIMIT 20;
+                SELECT
+                    *,
+                    ST_AsText({ProtocolKey.COORDINATES}) AS {ProtocolKey.COORDINATES_TEXT},
+                    {ProtocolKey.COORDINATES} <-> ST_GeogFromText(%(origin)s) AS {ProtocolKey.DISTANCE}
+                FROM
+                    {DatabaseTable.STORE}
+                WHERE
+                    ST_DWithin({ProtocolKey.COORDINATES}, ST_GeogFromText(%(origin)s), %(radius)s, false)
+                AND
+                    {ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
+                {keyset}
+                ORDER BY
+                    {ProtocolKey.COORDINATES} <-> ST_GeogFromText(%(origin)s), {ProtocolKey.ID}
+                LIMIT
+                    %(limit)s;
                 """,
-                (coordinates, radius)
+                params
             )
-            results = cursor.fetchall()
+            results, next_cursor = Common.paginate(cursor.fetchall(), limit,
+                                                   lambda row: [row[ProtocolKey.DISTANCE], row[ProtocolKey.ID]])
             conn.commit()
+            Store._prime_relations(results)
 
             for result in results:
                 ret.append(cls(result))
@@ -723,7 +875,7 @@ class Store:
             if conn:
                 conn.close()
 
-        return ret
+        return (ret, next_cursor)
 
     @staticmethod
     def get_tags(store_id: int) -> list[Tag]:
@@ -765,6 +917,46 @@ class Store:
 
         return ret
 
+    @staticmethod
+    def get_tags_for_stores(store_ids: list[int]) -> dict[int, list[Tag]]:
+        if not isinstance(store_ids, list):
+            raise TypeError(f"Argument 'store_ids' must be of type list, not {type(store_ids)}.")
+
+        ret: dict[int, list[Tag]] = {store_id: [] for store_id in store_ids}
+        conn = None
+        cursor = None
+
+        if not store_ids:
+            return ret
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT *
+                FROM {DatabaseTable.TAG}
+                INNER JOIN {DatabaseTable.STORE_TAG} ON {DatabaseTable.STORE_TAG}.{ProtocolKey.TAG_ID} = {DatabaseTable.TAG}.{ProtocolKey.ID}
+                WHERE {DatabaseTable.STORE_TAG}.{ProtocolKey.STORE_ID} = ANY(%s);
+                """,
+                (store_ids,)
+            )
+            results = cursor.fetchall()
+            conn.commit()
+
+            for result in results:
+                ret[result[ProtocolKey.STORE_ID]].append(Tag(result))
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
     @staticmethod
     def id_exists(store_id: int) -> bool:
         if not isinstance(store_id, int):
@@ -910,6 +1102,7 @@ class Store:
                 (edit_access_level.value, self.id)
             )
             conn.commit()
+            store_cache.invalidate(self.id)
         except Exception as e:
             print(e)
         finally:
@@ -949,6 +1142,8 @@ class Store:
                 (visibility.value, self.id)
             )
             conn.commit()
+            store_cache.invalidate(self.id)
+            self._invalidate_map_tiles()
         except Exception as e:
             print(e)
         finally:
@@ -978,7 +1173,7 @@ class Store:
                 f"""
                 UPDATE {DatabaseTable.STORE}
                 SET {ProtocolKey.BUILDING} = %s, {ProtocolKey.COORDINATES} = %s, {ProtocolKey.FLOOR} = %s,
-                {ProtocolKey.LOCALITY_ID} = %s, {ProtocolKey.POST_CODE} = %s, {ProtocolKey.STATUS} = %s
+                {ProtocolKey.LOCALITY_ID} = %s, {ProtocolKey.POST_CODE} = %s, {ProtocolKey.STATUS} = %s,
                 {ProtocolKey.STREET} = %s, {ProtocolKey.UNIT} = %s, {ProtocolKey.DESCRIPTION} = %s, 
                 {ProtocolKey.NAME} = %s, {ProtocolKey.WEBSITE} = %s
                 WHERE {ProtocolKey.ID} = %s;
@@ -989,6 +1184,8 @@ class Store:
                  self.name, self.website, self.id)
             )
             conn.commit()
+            store_cache.invalidate(self.id)
+            self._invalidate_map_tiles()
         except Exception as e:
             print(e)
         finally:
@@ -998,11 +1195,29 @@ class Store:
             if conn:
                 conn.close()
 
+
 ####################
 # MODULE FUNCTIONS #
 ####################
 
 
+loader.register(EntityType.STORE, Store.get_all_by_ids)
+loader.register((EntityType.STORE, ProtocolKey.TAGS), Store.get_tags_for_stores)
+store_cache = cache.entity_cache(
+    "store",
+    max_size=Configuration.STORE_CACHE_MAX_SIZE,
+    ttl=Configuration.STORE_CACHE_TTL,
+    dependencies={
+        "brand": lambda store, brand_id: store.brand is not None and store.brand.id == brand_id,
+        "user_account": lambda store, account_id: store.creator_id == account_id
+    }
+)
+store_search_cache = cache.search_cache(
+    "store",
+    dependencies=frozenset(["brand", "store", "user_account"])
+)
+
+
 def create_store(alias: str,
                  brand_id: str,
                  latitude: str,
@@ -1288,7 +1503,21 @@ def get_store(alias: str = None,
 
 def get_stores(query: str = None,
                latitude: str = None,
-               longitude: str = None) -> tuple[dict, ResponseStatus]:
+               longitude: str = None,
+               radius: str = None,
+               cursor: str = None,
+               page_size: str = None) -> tuple[dict, ResponseStatus]:
+    key = (cache.normalize_query(query), latitude, longitude, radius, cursor, page_size)
+
+    return store_search_cache.get(key, lambda: _get_stores(query, latitude, longitude, radius, cursor, page_size))
+
+
+def _get_stores(query: str = None,
+                latitude: str = None,
+                longitude: str = None,
+                radius: str = None,
+                cursor: str = None,
+                page_size: str = None) -> tuple[dict, ResponseStatus]:
     if latitude:
         try:
             latitude = float(latitude)
@@ -1305,10 +1534,27 @@ def get_stores(query: str = None,
     else:
         longitude = None
 
+    if radius:
+        try:
+            radius = int(radius)
+
+            if radius <= 0:
+                radius = None
+        except ValueError:
+            radius = None
+    else:
+        radius = Configuration.STORE_NEARBY_RADIUS
+
     if (longitude and not latitude) or \
-            (latitude and not longitude):
+            (latitude and not longitude) or \
+            not radius:
         response_status = ResponseStatus.BAD_REQUEST
-        error_message = "Invalid or missing parameter: coordinates must include latitude and longitude."
+        error_message = "Invalid or missing parameter"
+
+        if not radius:
+            error_message += ": 'radius' must be a positive, non-zero integer (meters)."
+        else:
+            error_message += ": coordinates must include latitude and longitude."
 
         response = {
             ProtocolKey.ERROR: {
@@ -1320,20 +1566,28 @@ def get_stores(query: str = None,
         response_status = ResponseStatus.OK
         serialized = []
 
-        if latitude and longitude:
-            coordinates = Point(longitude, latitude)
-            results = Store.get_nearby(coordinates)
-        elif query:
-            query = query.strip()
-            results = Store.get_all(query)
-        else:
-            results = []
+        next_cursor = None
+        page_size = Common.clamp_page_size(page_size)
+
+        try:
+            if latitude and longitude:
+                coordinates = Point(longitude, latitude)
+                # Larger radii are capped rather than refused.
+                results, next_cursor = Store.get_nearby(coordinates, radius=radius, page_cursor=cursor, limit=page_size)
+            elif query:
+                query = query.strip()
+                results, next_cursor = Store.get_all(query, page_cursor=cursor, limit=page_size)
+            else:
+                results = []
+        except ValueError:
+            return invalid_cursor()
 
         for result in results:
             serialized.append(result.as_dict())
 
         response = {
-            ProtocolKey.STORES: serialized
+            ProtocolKey.STORES: serialized,
+            ProtocolKey.NEXT_CURSOR: next_cursor
         }
 
     return (response, response_status)
@@ -0,0 +1,389 @@
+import math
+from typing import Any, NamedTuple
+
+from app.config import (Configuration, ContentVisibility, DatabaseTable,
+                        ProtocolKey, ResponseStatus)
+from app.modules import cache, db
+
+
+###########
+# CLASSES #
+###########
+
+
+class TileContent(NamedTuple):
+    # Either stores or clusters, already serialized.
+    items: list[dict]
+    # Every store counted in the tile, so an update to one can find the
+    # tiles showing it without knowing where it used to be.
+    store_ids: frozenset[int]
+
+
+class Tile:
+    """
+    A slippy-map (Web Mercator XYZ) tile: the same grid map clients draw,
+    so a viewport maps onto a handful of tiles that can be cached and
+    shared between everyone looking at the same area.
+    """
+
+    # Web Mercator doesn't reach the poles.
+    MAX_LATITUDE = 85.05112878
+
+    def __init__(self,
+                 zoom: int,
+                 x: int,
+                 y: int) -> None:
+        self.x = x
+        self.y = y
+        self.zoom = zoom
+
+    def __eq__(self,
+               __o: object) -> bool:
+        ret = False
+
+        if isinstance(__o, type(self)) and \
+                self.key() == __o.key():
+            ret = True
+
+        return ret
+
+    def __hash__(self) -> int:
+        return hash(self.key())
+
+    def __repr__(self) -> str:
+        return f"Tile {self.zoom}/{self.x}/{self.y}"
+
+    @staticmethod
+    def _x(longitude: float,
+           zoom: int) -> int:
+        count = 1 << zoom
+
+        return min(max(int((longitude + 180) / 360 * count), 0), count - 1)
+
+    @staticmethod
+    def _y(latitude: float,
+           zoom: int) -> int:
+        count = 1 << zoom
+        latitude = min(max(latitude, -Tile.MAX_LATITUDE), Tile.MAX_LATITUDE)
+        y = (1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * count
+
+        return min(max(int(y), 0), count - 1)
+
+    def bounds(self) -> tuple[float, float, float, float]:
+        """
+        Returns (min longitude, min latitude, max longitude, max latitude).
+        """
+
+        count = 1 << self.zoom
+
+        def latitude(y: int) -> float:
+            return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / count))))
+
+        return (self.x / count * 360 - 180,
+                latitude(self.y + 1),
+                (self.x + 1) / count * 360 - 180,
+                latitude(self.y))
+
+    @classmethod
+    def containing(cls,
+                   longitude: float,
+                   latitude: float,
+                   zoom: int) -> "Tile":
+        return cls(zoom, Tile._x(longitude, zoom), Tile._y(latitude, zoom))
+
+    @classmethod
+    def covering(cls,
+                 min_longitude: float,
+                 min_latitude: float,
+                 max_longitude: float,
+                 max_latitude: float,
+                 zoom: int) -> list["Tile"]:
+        ret = []
+        # Tile rows count down from the north.
+        min_x, max_x = Tile._x(min_longitude, zoom), Tile._x(max_longitude, zoom)
+        min_y, max_y = Tile._y(max_latitude, zoom), Tile._y(min_latitude, zoom)
+
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                ret.append(cls(zoom, x, y))
+
+        return ret
+
+    def key(self) -> tuple[int, int, int]:
+        return (self.zoom, self.x, self.y)
+
+    def load(self) -> TileContent:
+        """
+        Reads the visible stores in the tile. At zoom levels below
+        STORE_MAP_CLUSTER_ZOOM they come back as clusters instead: counts
+        per cell of a grid laid over the tile, positioned at the mean of
+        their stores' coordinates. Clusters are aggregated by the
+        database, so only one row per cell leaves it.
+        """
+
+        items = []
+        store_ids = set()
+        is_clustered = self.zoom < Configuration.STORE_MAP_CLUSTER_ZOOM
+
+        if is_clustered:
+            cells_per_side = 1 << Configuration.STORE_MAP_CLUSTER_GRID
+        else:
+            # One cell: the tile itself.
+            cells_per_side = 1
+
+        # Cells are tiles of a deeper zoom level; stores are placed in them
+        # with the same arithmetic as containing(). The bounding box test
+        # is loose, so only the stores that really fall in this tile are
+        # kept, and none shows up in two.
+        count = (1 << self.zoom) * cells_per_side
+        latitude = f"LEAST(GREATEST({ProtocolKey.LATITUDE}, {-Tile.MAX_LATITUDE}), {Tile.MAX_LATITUDE})"
+        cells = f"""
+            WITH cell AS (
+                SELECT
+                    *,
+                    LEAST(GREATEST(FLOOR(({ProtocolKey.LONGITUDE} + 180) / 360 * {count}), 0), {count - 1})::int AS cell_x,
+                    LEAST(GREATEST(FLOOR((1 - ASINH(TAN(RADIANS({latitude}))) / PI()) / 2 * {count}), 0), {count - 1})::int AS cell_y
+                FROM (
+                    SELECT
+                        {ProtocolKey.ID},
+                        {ProtocolKey.ALIAS},
+                        {ProtocolKey.NAME},
+                        {ProtocolKey.STATUS},
+                        ST_X({ProtocolKey.COORDINATES}::geometry) AS {ProtocolKey.LONGITUDE},
+                        ST_Y({ProtocolKey.COORDINATES}::geometry) AS {ProtocolKey.LATITUDE}
+                    FROM
+                        {DatabaseTable.STORE}
+                    WHERE
+                        {ProtocolKey.COORDINATES}::geometry && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+                    AND
+                        {ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value})
+                ) AS store
+            )
+        """
+        in_tile = f"cell_x / {cells_per_side} = %s AND cell_y / {cells_per_side} = %s"
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+
+            if is_clustered:
+                cursor.execute(
+                    f"""
+                    {cells}
+                    SELECT
+                        COUNT(*) AS {ProtocolKey.COUNT},
+                        AVG({ProtocolKey.LONGITUDE}) AS {ProtocolKey.LONGITUDE},
+                        AVG({ProtocolKey.LATITUDE}) AS {ProtocolKey.LATITUDE},
+                        ARRAY_AGG({ProtocolKey.ID}) AS store_ids
+                    FROM
+                        cell
+                    WHERE
+                        {in_tile}
+                    GROUP BY
+                        cell_x, cell_y;
+                    """,
+                    (*self.bounds(), self.x, self.y)
+                )
+            else:
+                cursor.execute(
+                    f"""
+                    {cells}
+                    SELECT * FROM cell
+                    WHERE {in_tile};
+                    """,
+                    (*self.bounds(), self.x, self.y)
+                )
+
+            results = cursor.fetchall()
+            conn.commit()
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        if is_clustered:
+            for result in results:
+                items.append({
+                    ProtocolKey.COORDINATES: {
+                        ProtocolKey.LATITUDE: result[ProtocolKey.LATITUDE],
+                        ProtocolKey.LONGITUDE: result[ProtocolKey.LONGITUDE]
+                    },
+                    ProtocolKey.COUNT: result[ProtocolKey.COUNT]
+                })
+                store_ids.update(result["store_ids"])
+        else:
+            for result in results:
+                items.append({
+                    ProtocolKey.ALIAS: result[ProtocolKey.ALIAS],
+                    ProtocolKey.COORDINATES: {
+                        ProtocolKey.LATITUDE: result[ProtocolKey.LATITUDE],
+                        ProtocolKey.LONGITUDE: result[ProtocolKey.LONGITUDE]
+                    },
+                    ProtocolKey.ID: result[ProtocolKey.ID],
+                    ProtocolKey.NAME: result[ProtocolKey.NAME],
+                    ProtocolKey.STATUS: result[ProtocolKey.STATUS]
+                })
+                store_ids.add(result[ProtocolKey.ID])
+
+        return TileContent(items, frozenset(store_ids))
+
+
+####################
+# MODULE FUNCTIONS #
+####################
+
+
+STORE_MAP_CHANNEL = "store_map"
+tile_cache = cache.LRUCache(max_size=Configuration.STORE_MAP_CACHE_MAX_SIZE,
+                            ttl=Configuration.STORE_MAP_CACHE_TTL)
+
+
+def _drop_tiles(store_id: int,
+                longitude: float = None,
+                latitude: float = None) -> None:
+    keys = set()
+
+    if longitude is not None and latitude is not None:
+        keys = {Tile.containing(longitude, latitude, zoom).key() for zoom in Configuration.STORE_MAP_ZOOM_LEVELS}
+
+    tile_cache.delete_where(lambda key, content: key in keys or store_id in content.store_ids)
+
+
+def _on_store_map_notification(payload: str) -> None:
+    if payload is None:
+        tile_cache.clear()
+    else:
+        store_id, *point = payload.split(":")
+
+        if point:
+            _drop_tiles(int(store_id), float(point[0]), float(point[1]))
+        else:
+            _drop_tiles(int(store_id))
+
+
+def _zoom_level(zoom: int,
+                min_longitude: float,
+                min_latitude: float,
+                max_longitude: float,
+                max_latitude: float) -> int:
+    """
+    Snaps zoom down to the nearest cached level, then further down while
+    the viewport would need more than STORE_MAP_MAX_TILES tiles. Returns
+    None if it needs more than that even at the lowest level.
+    """
+
+    levels = sorted(Configuration.STORE_MAP_ZOOM_LEVELS)
+    candidates = [level for level in levels if level <= zoom] or levels[:1]
+
+    for level in reversed(candidates):
+        if len(Tile.covering(min_longitude, min_latitude, max_longitude, max_latitude, level)) <= Configuration.STORE_MAP_MAX_TILES:
+            return level
+
+    return None
+
+
+def get_store_map(min_latitude: str,
+                  min_longitude: str,
+                  max_latitude: str,
+                  max_longitude: str,
+                  zoom: str) -> tuple[dict, ResponseStatus]:
+    bounds = []
+
+    for value in (min_longitude, min_latitude, max_longitude, max_latitude):
+        try:
+            bounds.append(float(value))
+        except (TypeError, ValueError):
+            bounds.append(None)
+
+    if zoom:
+        try:
+            zoom = int(zoom)
+        except ValueError:
+            zoom = None
+    else:
+        zoom = None
+
+    if None in bounds or \
+            not -180 <= bounds[0] <= bounds[2] <= 180 or \
+            not -90 <= bounds[1] <= bounds[3] <= 90 or \
+            zoom is None or zoom < 0:
+        response_status = ResponseStatus.BAD_REQUEST
+        error_message = "Invalid or missing parameter"
+
+        if zoom is None or zoom < 0:
+            error_message += ": 'zoom' must be a non-negative integer."
+        else:
+            error_message += ": the viewport must be given as min/max latitude and longitude, minimums first."
+
+        response = {
+            ProtocolKey.ERROR: {
+                ProtocolKey.ERROR_CODE: response_status.value,
+                ProtocolKey.ERROR_MESSAGE: error_message
+            }
+        }
+    elif (level := _zoom_level(zoom, *bounds)) is None:
+        response_status = ResponseStatus.BAD_REQUEST
+        response = {
+            ProtocolKey.ERROR: {
+                ProtocolKey.ERROR_CODE: response_status.value,
+                ProtocolKey.ERROR_MESSAGE: f"Invalid parameter: the viewport needs more than {Configuration.STORE_MAP_MAX_TILES} tiles even at zoom level {min(Configuration.STORE_MAP_ZOOM_LEVELS)}."
+            }
+        }
+    else:
+        response_status = ResponseStatus.OK
+        items = []
+
+        for tile in Tile.covering(*bounds, level):
+            content: TileContent = tile_cache.get(tile.key())
+
+            if content is None:
+                try:
+                    content = tile.load()
+                except Exception as e:
+                    print(e)
+
+                    continue
+
+                tile_cache.set(tile.key(), content)
+
+            items += content.items
+
+        if level >= Configuration.STORE_MAP_CLUSTER_ZOOM:
+            key = ProtocolKey.STORES
+        else:
+            key = ProtocolKey.CLUSTERS
+
+        response = {
+            key: items,
+            ProtocolKey.ZOOM: level
+        }
+
+    return (response, response_status)
+
+
+def get_tile_cache_stats() -> dict:
+    return tile_cache.stats()
+
+
+def invalidate(store_id: int,
+               longitude: float = None,
+               latitude: float = None) -> None:
+    """
+    Drops the cached tiles showing the store, in every worker, plus the
+    ones containing the given point so a store that was just added or
+    moved there shows up.
+    """
+
+    _drop_tiles(store_id, longitude, latitude)
+
+    if longitude is not None and latitude is not None:
+        cache.publish(STORE_MAP_CHANNEL, f"{store_id}:{longitude}:{latitude}")
+    else:
+        cache.publish(STORE_MAP_CHANNEL, f"{store_id}")
+
+
+cache.subscribe(STORE_MAP_CHANNEL, _on_store_map_notification)
@@ -6,8 +6,8 @@ from typing import Any, TypeVar, Type
 from urllib.parse import urlparse
 
 from app.config import ContentVisibility, DatabaseTable, EditAccessLevel, \
-    ProtocolKey, ResponseStatus, StoreProductStatus
-from app.modules import db
+    EntityType, ProtocolKey, ResponseStatus, StoreProductStatus
+from app.modules import db, loader
 from app.modules.product import Product
 from app.modules.store import Store
 from app.modules.user_account import UserAccount
@@ -55,7 +55,7 @@ class StoreProduct:
                 self.price: Decimal = Decimal(data[ProtocolKey.PRICE])
 
             if ProtocolKey.PRODUCT_ID in data and data[ProtocolKey.PRODUCT_ID]:
-                self.product = Product.get_by_id(data[ProtocolKey.PRODUCT_ID])
+                self.product = loader.load(EntityType.PRODUCT, data[ProtocolKey.PRODUCT_ID])
 
             if ProtocolKey.STATUS in data and data[ProtocolKey.STATUS]:
                 self.status = StoreProductStatus(data[ProtocolKey.STATUS])
@@ -234,6 +234,7 @@ class StoreProduct:
             )
             results = cursor.fetchall()
             conn.commit()
+            loader.prime(EntityType.PRODUCT, [result[ProtocolKey.PRODUCT_ID] for result in results])
 
             for result in results:
                 ret.append(cls(result))
@@ -273,6 +274,7 @@ class StoreProduct:
             )
             results = cursor.fetchall()
             conn.commit()
+            loader.prime(EntityType.PRODUCT, [result[ProtocolKey.PRODUCT_ID] for result in results])
 
             for result in results:
                 ret.append(cls(result))
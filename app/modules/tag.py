@@ -1,9 +1,13 @@
 from datetime import datetime
+from dateutil import parser as date_parser
+import json
 import string
-from typing import Any, TypeVar, Type
+from typing import Any, Callable, TypeVar, Type
 
-from app.config import DatabaseTable, ProtocolKey
-from app.modules import db
+from app.config import (Configuration, ContentVisibility, DatabaseTable,
+                        EntityType, ProtocolKey, ResponseStatus)
+from app.modules import cache, db, loader
+from app.modules.common import Common, invalid_cursor
 
 
 ###########
@@ -15,6 +19,13 @@ T = TypeVar("T", bound="Tag")
 
 
 class Tag:
+    # Per taggable type: the table linking it to tags, its ID column
+    # there, and its own table.
+    MEMBERSHIPS = {
+        EntityType.BRAND: (DatabaseTable.BRAND_TAG, ProtocolKey.BRAND_ID, DatabaseTable.BRAND),
+        EntityType.PRODUCT: (DatabaseTable.PRODUCT_TAG, ProtocolKey.PRODUCT_ID, DatabaseTable.PRODUCT)
+    }
+
     def __init__(self,
                  data: dict) -> None:
         self.creation_timestamp: datetime = None
@@ -24,7 +35,12 @@ class Tag:
 
         if data:
             if ProtocolKey.CREATION_TIMESTAMP in data:
-                self.creation_timestamp: datetime = data[ProtocolKey.CREATION_TIMESTAMP]
+                creation_timestamp = data[ProtocolKey.CREATION_TIMESTAMP]
+
+                if isinstance(creation_timestamp, str):
+                    self.creation_timestamp: datetime = date_parser.parse(creation_timestamp)
+                else:
+                    self.creation_timestamp: datetime = creation_timestamp
 
             if ProtocolKey.CREATOR_ID in data:
                 self.creator_id: int = data[ProtocolKey.CREATOR_ID]
@@ -63,6 +79,13 @@ class Tag:
 
         return serialized
 
+    @staticmethod
+    def clean_name(tag_name: str) -> str:
+        # Tags cannot contain whitespace.
+        tag_name = "".join(char for char in tag_name if char in string.printable)
+
+        return tag_name.lower()
+
     @classmethod
     def create(cls: Type[T],
                name: str,
@@ -86,9 +109,7 @@ class Tag:
         ret: Type[T] = None
         conn = None
         cursor = None
-        # Tags cannot contain whitespace.
-        name = "".join(char for char in name if char in string.printable)
-        name = name.lower()
+        name = Tag.clean_name(name)
 
         try:
             conn = db.connect()
@@ -117,6 +138,86 @@ class Tag:
 
         return ret
 
+    @classmethod
+    def get_all_by_ids(cls: Type[T],
+                       tag_ids: list[int]) -> dict[int, T]:
+        if not isinstance(tag_ids, list):
+            raise TypeError(f"Argument 'tag_ids' must be of type list, not {type(tag_ids)}.")
+
+        ret: dict[int, T] = {}
+        conn = None
+        cursor = None
+
+        if not tag_ids:
+            return ret
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT * FROM {DatabaseTable.TAG}
+                WHERE {ProtocolKey.ID} = ANY(%s);
+                """,
+                (tag_ids,)
+            )
+            results = cursor.fetchall()
+            conn.commit()
+
+            for result in results:
+                tag = cls(result)
+                ret[tag.id] = tag
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
+    @classmethod
+    def get_all_by_names(cls: Type[T],
+                         tag_names: list[str]) -> list[T]:
+        if not isinstance(tag_names, list):
+            raise TypeError(f"Argument 'tag_names' must be of type list, not {type(tag_names)}.")
+
+        ret: list[T] = []
+        conn = None
+        cursor = None
+        tag_names = [Tag.clean_name(tag_name) for tag_name in tag_names if isinstance(tag_name, str)]
+
+        if not tag_names:
+            return ret
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT * FROM {DatabaseTable.TAG}
+                WHERE {ProtocolKey.NAME} = ANY(%s);
+                """,
+                (tag_names,)
+            )
+            results = cursor.fetchall()
+            conn.commit()
+
+            for result in results:
+                ret.append(cls(result))
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
     @classmethod
     def get_all_by_user(cls: Type[T],
                         user_id: int) -> list[T]:
@@ -156,6 +257,82 @@ class Tag:
 
         return ret
 
+    @staticmethod
+    def get_count(tag_id: int,
+                  entity_type: EntityType) -> int:
+        """
+        Uncached count of the visible brands or products carrying the tag.
+        """
+
+        if not isinstance(tag_id, int):
+            raise TypeError(f"Argument 'tag_id' must be of type int, not {type(tag_id)}.")
+
+        if tag_id <= 0:
+            raise ValueError("Argument 'tag_id' must be a positive, non-zero integer.")
+
+        if entity_type not in Tag.MEMBERSHIPS:
+            raise ValueError(f"Argument 'entity_type' must be one of {list(Tag.MEMBERSHIPS)}.")
+
+        membership_table, id_column, table = Tag.MEMBERSHIPS[entity_type]
+        ret = None
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT
+                    COUNT(*) AS {ProtocolKey.COUNT}
+                FROM
+                    {membership_table} AS m
+                JOIN
+                    {table} AS e
+                ON
+                    e.{ProtocolKey.ID} = m.{id_column}
+                WHERE
+                    m.{ProtocolKey.TAG_ID} = %s
+                AND
+                    e.{ProtocolKey.VISIBILITY} NOT IN ({ContentVisibility.DELETED.value}, {ContentVisibility.GHOSTED.value}, {ContentVisibility.REMOVED.value});
+                """,
+                (tag_id,)
+            )
+            result = cursor.fetchone()
+            conn.commit()
+
+            if result:
+                ret = result[ProtocolKey.COUNT]
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
+    @staticmethod
+    def get_counts(tag_ids: list[int],
+                   entity_type: EntityType) -> dict[int, int]:
+        """
+        Returns how many visible brands or products carry each tag. Counts
+        are cached and dropped whenever a brand or product changes.
+        """
+
+        if not isinstance(tag_ids, list):
+            raise TypeError(f"Argument 'tag_ids' must be of type list, not {type(tag_ids)}.")
+
+        ret = {}
+
+        for tag_id in tag_ids:
+            count = tag_count_cache.get((entity_type, tag_id), lambda: Tag.get_count(tag_id, entity_type))
+            ret[tag_id] = count or 0
+
+        return ret
+
     @classmethod
     def get_by_id(cls: Type[T],
                   tag_id: int) -> T:
@@ -207,9 +384,7 @@ class Tag:
         ret: Type[T] = None
         conn = None
         cursor = None
-        # Tags cannot contain whitespace.
-        tag_name = "".join(char for char in tag_name if char in string.printable)
-        tag_name = tag_name.lower()
+        tag_name = Tag.clean_name(tag_name)
 
         try:
             conn = db.connect()
@@ -236,3 +411,120 @@ class Tag:
                 conn.close()
 
         return ret
+
+    @staticmethod
+    def membership_condition(entity_type: EntityType,
+                             column: str) -> str:
+        """
+        SQL condition on column (a brand or product ID) holding for the
+        entities tagged with at least the number of tags given by the
+        second parameter out of the array given by the first: all of them
+        for an AND query, one for an OR query. It's answered from the
+        (tag_id, <entity>_id) index alone.
+        """
+
+        membership_table, id_column, _ = Tag.MEMBERSHIPS[entity_type]
+
+        return f"""
+            {column} IN (
+                SELECT
+                    {id_column}
+                FROM
+                    {membership_table}
+                WHERE
+                    {ProtocolKey.TAG_ID} = ANY(%s)
+                GROUP BY
+                    {id_column}
+                HAVING
+                    COUNT(*) >= %s
+            )
+        """
+
+
+####################
+# MODULE FUNCTIONS #
+####################
+
+
+loader.register(EntityType.TAG, Tag.get_all_by_ids)
+tag_count_cache = cache.search_cache(
+    "tag_count",
+    dependencies=frozenset(["brand", "product"]),
+    ttl=Configuration.TAG_COUNT_CACHE_TTL
+)
+
+
+def get_tagged(tags: str,
+               match: str,
+               cursor: str,
+               page_size: str,
+               entity_type: EntityType,
+               get_all_by_tags: Callable[..., tuple[list, str]],
+               key: ProtocolKey) -> tuple[dict, ResponseStatus]:
+    """
+    Serves a listing of the entities of entity_type carrying the given
+    tags (a JSON array of names), fetched a page at a time through
+    get_all_by_tags and returned under key. The first page also carries
+    the tags and how many entities have each.
+    """
+
+    if tags:
+        try:
+            tags = json.loads(tags)
+
+            if not isinstance(tags, list) or \
+                    not all(isinstance(tag, str) for tag in tags):
+                tags = None
+        except:
+            tags = None
+    else:
+        tags = None
+
+    if not tags or \
+            len(tags) > Configuration.TAG_QUERY_MAX_COUNT or \
+            match not in (None, "all", "any"):
+        response_status = ResponseStatus.BAD_REQUEST
+        error_message = "Invalid or missing parameter"
+
+        if not tags or len(tags) > Configuration.TAG_QUERY_MAX_COUNT:
+            error_message += f": 'tags' must be a JSON array string of between 1 and {Configuration.TAG_QUERY_MAX_COUNT} tag names."
+        else:
+            error_message += ": 'match' must be either 'all' or 'any'."
+
+        response = {
+            ProtocolKey.ERROR: {
+                ProtocolKey.ERROR_CODE: response_status.value,
+                ProtocolKey.ERROR_MESSAGE: error_message
+            }
+        }
+    else:
+        response_status = ResponseStatus.OK
+        serialized = []
+        next_cursor = None
+        page_size = Common.clamp_page_size(page_size)
+        match_all = match == "all"
+        found_tags = Tag.get_all_by_names(tags)
+        tag_ids = [tag.id for tag in found_tags]
+
+        # A tag that doesn't exist can't match anything; with "all" that
+        # rules out everything.
+        if tag_ids and \
+                not (match_all and len(found_tags) < len({Tag.clean_name(tag) for tag in tags})):
+            try:
+                results, next_cursor = get_all_by_tags(tag_ids, match_all=match_all, page_cursor=cursor, limit=page_size)
+            except ValueError:
+                return invalid_cursor()
+
+            for result in results:
+                serialized.append(result.as_dict())
+
+        response = {
+            ProtocolKey.NEXT_CURSOR: next_cursor,
+            key: serialized
+        }
+
+        if not cursor:
+            counts = Tag.get_counts(tag_ids, entity_type)
+            response[ProtocolKey.TAGS] = [tag.as_dict() | {ProtocolKey.COUNT: counts[tag.id]} for tag in found_tags]
+
+    return (response, response_status)
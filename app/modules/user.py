@@ -321,6 +321,7 @@ def join(alias: str,
                     if verification_code.creation_timestamp < datetime.utcnow() - timedelta(seconds=Configuration.USER_VERIFICATION_CODE_TTL):
                         # Code expired.
                         verification_code.delete()
+                        db.commit_on_client_error()
 
                         response_status = ResponseStatus.BAD_REQUEST
                         response = {
@@ -491,6 +492,7 @@ def log_in(client_id: str,
                     if verification_code.creation_timestamp < datetime.utcnow() - timedelta(seconds=Configuration.USER_VERIFICATION_CODE_TTL):
                         # Code expired.
                         verification_code.delete()
+                        db.commit_on_client_error()
 
                         response_status = ResponseStatus.BAD_REQUEST
                         response = {
@@ -6,7 +6,8 @@ from typing import Any, TypeVar, Type
 
 from app.config import Configuration, DatabaseTable, EntityType, \
     ProtocolKey, ResponseStatus
-from app.modules import db
+from app.modules import cache, db, loader, user_account_session
+from app.modules.common import Common, invalid_cursor
 from app.modules.user_account_session import UserAccountSession
 
 
@@ -27,7 +28,7 @@ class UserAccount:
         self.id: int = 0
         self.is_admin: bool = False
         self.rep: int = 0
-        self.sessions: list[UserAccountSession] = []
+        self._sessions: list[UserAccountSession] = None
         self.user_id: int = 0
         self.website: str = None
 
@@ -48,8 +49,13 @@ class UserAccount:
 
             if ProtocolKey.ID in data and data[ProtocolKey.ID]:
                 self.id: int = data[ProtocolKey.ID]
-                self.is_admin = UserAccount.is_admin(self.id)
-                self.sessions = UserAccountSession.get_all_for_account(self.id)
+
+                # Queries that already joined admin status (see
+                # json_select()) spare us a round trip.
+                if ProtocolKey.IS_ADMIN in data:
+                    self.is_admin = bool(data[ProtocolKey.IS_ADMIN])
+                else:
+                    self.is_admin = UserAccount.is_admin(self.id)
 
             if ProtocolKey.REP in data and data[ProtocolKey.REP]:
                 self.rep: int = data[ProtocolKey.REP]
@@ -81,6 +87,62 @@ class UserAccount:
 
         return ret
 
+    @classmethod
+    def _get_by_id(cls: Type[T],
+                   account_id: int) -> T:
+        """
+        Uncached get_by_id().
+        """
+
+        ret: Type[T] = None
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT * FROM {DatabaseTable.USER_ACCOUNT}
+                WHERE {ProtocolKey.ID} = %s;
+                """,
+                (account_id,)
+            )
+            result = cursor.fetchone()
+            conn.commit()
+
+            if result:
+                ret = cls(result)
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+        return ret
+
+    @property
+    def sessions(self) -> list[UserAccountSession]:
+        """
+        Loaded on first access; most callers only need the public profile.
+        """
+
+        if self._sessions is None:
+            if self.id:
+                self._sessions = UserAccountSession.get_all_for_account(self.id)
+            else:
+                self._sessions = []
+
+        return self._sessions
+
+    @sessions.setter
+    def sessions(self,
+                 value: list[UserAccountSession]) -> None:
+        self._sessions = value
+
     @staticmethod
     def alias_exists(alias: str) -> bool:
         """
@@ -224,6 +286,9 @@ class UserAccount:
                     """,
                     (ret.id, alias, EntityType.USER_ACCOUNT)
                 )
+
+                # Drops cached searches that might now include it.
+                user_account_cache.invalidate(ret.id)
                 conn.commit()
         except Exception as e:
             print(e)
@@ -272,6 +337,9 @@ class UserAccount:
                 if conn:
                     conn.close()
 
+            user_account_session.invalidate_account(self.id)
+            user_account_cache.invalidate(self.id)
+
     def delete(self) -> None:
         """
         [NOTE] This method erases the user account's record from the database.
@@ -291,7 +359,8 @@ class UserAccount:
                 cursor.execute(
                     f"""
                     DELETE FROM {DatabaseTable.USER_ACCOUNT}
-                    WHERE {ProtocolKey.ID} = %s;
+                    WHERE {ProtocolKey.ID} = %s
+                    RETURNING {ProtocolKey.ID};
                     """,
                     (self.id,)
                 )
@@ -299,12 +368,18 @@ class UserAccount:
                 cursor.execute(
                     f"""
                     DELETE FROM {DatabaseTable.USER_ACCOUNT}
-                    WHERE {ProtocolKey.ALIAS} = %s;
+                    WHERE {ProtocolKey.ALIAS} = %s
+                    RETURNING {ProtocolKey.ID};
                     """,
                     (self.alias,)
                 )
 
+            result = cursor.fetchone()
             conn.commit()
+
+            if result:
+                user_account_session.invalidate_account(result[ProtocolKey.ID])
+                user_account_cache.invalidate(result[ProtocolKey.ID])
         except Exception as e:
             print(e)
         finally:
@@ -354,29 +429,49 @@ class UserAccount:
 
     @classmethod
     def get_all(cls: Type[T],
-                query: str) -> list[T]:
+                query: str,
+                page_cursor: str = None,
+                limit: int = Configuration.PAGE_SIZE) -> tuple[list[T], str]:
+        """
+        Returns a page of accounts ranked by relevance along with the
+        cursor for the next page (None on the last one).
+        """
+
         if not isinstance(query, str):
             raise TypeError(f"Argument 'query' must be of type str, not {type(query)}.")
 
         ret: list[T] = []
+        next_cursor: str = None
         conn = None
         cursor = None
+        after = Common.decode_cursor(page_cursor, ((float, int), int))
+        keyset = ""
+        params = [query, query]
+
+        if after:
+            keyset = f"WHERE (match.rank, match.{ProtocolKey.ID}) < (%s::real, %s)"
+            params += after
+
+        params.append(limit + 1)
 
         try:
             conn = db.connect()
             cursor = conn.cursor()
             cursor.execute(
                 f"""
-                SELECT *, ts_rank(match.{ProtocolKey.POSTGRES_SEARCH_ALIAS}, plainto_tsquery('english', %s)) AS rank FROM
-                (SELECT * FROM {DatabaseTable.USER_ACCOUNT}
+                SELECT * FROM
+                (SELECT *, ts_rank({ProtocolKey.POSTGRES_SEARCH_ALIAS}, plainto_tsquery('english', %s)) AS rank
+                FROM {DatabaseTable.USER_ACCOUNT}
                 WHERE {ProtocolKey.POSTGRES_SEARCH_ALIAS} @@ plainto_tsquery('english', %s))
                 AS match
-                ORDER BY rank DESC
-                LIMIT 20;
+                {keyset}
+                ORDER BY match.rank DESC, match.{ProtocolKey.ID} DESC
+                LIMIT %s;
                 """,
-                (query, query)
+                params
             )
-            results = cursor.fetchall()
+            results, next_cursor = Common.paginate(cursor.fetchall(), limit,
+                                                   lambda row: [row["rank"], row[ProtocolKey.ID]])
             conn.commit()
 
             for result in results:
@@ -390,6 +485,59 @@ class UserAccount:
             if conn:
                 conn.close()
 
+        return (ret, next_cursor)
+
+    @classmethod
+    def get_all_by_ids(cls: Type[T],
+                       account_ids: list[int]) -> dict[int, T]:
+        """
+        Batch counterpart of get_by_id(), keyed by account ID. Accounts
+        that don't exist are left out.
+        """
+
+        if not isinstance(account_ids, list):
+            raise TypeError(f"Argument 'account_ids' must be of type list, not {type(account_ids)}.")
+
+        ret: dict[int, T] = {}
+        conn = None
+        cursor = None
+
+        if not account_ids:
+            return ret
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT
+                    c.*,
+                    EXISTS (
+                        SELECT 1 FROM {DatabaseTable.ADMIN_USER_ACCOUNT} AS a
+                        WHERE a.{ProtocolKey.USER_ACCOUNT_ID} = c.{ProtocolKey.ID}
+                    ) AS {ProtocolKey.IS_ADMIN}
+                FROM
+                    {DatabaseTable.USER_ACCOUNT} AS c
+                WHERE
+                    c.{ProtocolKey.ID} = ANY(%s);
+                """,
+                (account_ids,)
+            )
+            results = cursor.fetchall()
+            conn.commit()
+
+            for result in results:
+                account = cls(result)
+                ret[account.id] = account
+        except Exception as e:
+            print(e)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
         return ret
 
     @classmethod
@@ -480,35 +628,7 @@ class UserAccount:
         if account_id <= 0:
             raise ValueError("Argument 'account_id' must be a positive, non-zero integer.")
 
-        ret: Type[T] = None
-        conn = None
-        cursor = None
-
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.USER_ACCOUNT}
-                WHERE {ProtocolKey.ID} = %s;
-                """,
-                (account_id,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                ret = cls(result)
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
-
-            if conn:
-                conn.close()
-
-        return ret
+        return user_account_cache.get(account_id, cls._get_by_id)
 
     @classmethod
     def get_by_session(cls: Type[T],
@@ -519,7 +639,11 @@ class UserAccount:
         if not session_id:
             raise ValueError("Argument 'session_id' must be a non-empty string.")
 
-        ret: Type[T] = None
+        ret: Type[T] = user_account_session.get_cached_account(session_id)
+
+        if ret:
+            return ret
+
         conn = None
         cursor = None
 
@@ -539,6 +663,10 @@ class UserAccount:
 
             if result:
                 ret = cls(result)
+                # The session may not be cached yet; load it so the
+                # account has an entry to hang off.
+                if UserAccountSession.get_by_id(session_id):
+                    user_account_session.cache_account(session_id, ret)
         except Exception as e:
             print(e)
         finally:
@@ -666,6 +794,31 @@ class UserAccount:
 
         return ret
 
+    @staticmethod
+    def json_select(account_id_expression: str) -> str:
+        """
+        SQL for a scalar subquery returning the account whose ID is
+        account_id_expression as JSON, admin status included, ready to be
+        passed to the constructor without further queries.
+        """
+
+        return f"""
+            (
+                SELECT
+                    ROW_TO_JSON(json_ua)::jsonb || jsonb_build_object(
+                        '{ProtocolKey.IS_ADMIN}',
+                        EXISTS (
+                            SELECT 1 FROM {DatabaseTable.ADMIN_USER_ACCOUNT} AS json_aua
+                            WHERE json_aua.{ProtocolKey.USER_ACCOUNT_ID} = json_ua.{ProtocolKey.ID}
+                        )
+                    )
+                FROM
+                    {DatabaseTable.USER_ACCOUNT} AS json_ua
+                WHERE
+                    json_ua.{ProtocolKey.ID} = {account_id_expression}
+            )
+        """
+
     def update(self) -> None:
         """
         This method does not update sessions or admin status.
@@ -705,6 +858,10 @@ class UserAccount:
                 )
 
             conn.commit()
+
+            if self.id:
+                user_account_session.invalidate_account(self.id)
+                user_account_cache.invalidate(self.id)
         except Exception as e:
             print(e)
         finally:
@@ -720,6 +877,18 @@ class UserAccount:
 ####################
 
 
+loader.register(EntityType.USER_ACCOUNT, UserAccount.get_all_by_ids)
+user_account_cache = cache.entity_cache(
+    "user_account",
+    max_size=Configuration.USER_ACCOUNT_CACHE_MAX_SIZE,
+    ttl=Configuration.USER_ACCOUNT_CACHE_TTL
+)
+user_account_search_cache = cache.search_cache(
+    "user_account",
+    dependencies=frozenset(["user_account"])
+)
+
+
 def delete_account(account_id: str) -> tuple[dict, ResponseStatus]:
     if account_id:
         try:
@@ -833,19 +1002,32 @@ def get_account(alias: str = None,
     return (response, response_status)
 
 
-def get_accounts(query: str) -> tuple[dict, ResponseStatus]:
+def get_accounts(query: str,
+                 cursor: str = None) -> tuple[dict, ResponseStatus]:
+    key = (cache.normalize_query(query), cursor)
+
+    return user_account_search_cache.get(key, lambda: _get_accounts(query, cursor))
+
+
+def _get_accounts(query: str,
+                  cursor: str = None) -> tuple[dict, ResponseStatus]:
     query = query.strip()
     response_status = ResponseStatus.OK
     serialized = []
+    next_cursor = None
 
     if query:
-        results = UserAccount.get_all(query)
+        try:
+            results, next_cursor = UserAccount.get_all(query, page_cursor=cursor)
+        except ValueError:
+            return invalid_cursor()
 
         for result in results:
             serialized.append(result.as_dict())
 
     response = {
-        ProtocolKey.USER_ACCOUNTS: serialized
+        ProtocolKey.USER_ACCOUNTS: serialized,
+        ProtocolKey.NEXT_CURSOR: next_cursor
     }
 
     return (response, response_status)
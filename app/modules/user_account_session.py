@@ -1,18 +1,25 @@
+import copy
 from datetime import datetime
 from flask import request
 from geoip import open_database
 import hashlib
 import ipaddress
 import os
+from psycopg2.extras import execute_values
 import re
+import sched
 import sys
+import threading
+import time
 from typing import Any, TypeVar, Type
 from ua_parser import user_agent_parser
 import uuid
 
 from app import app
-from app.config import ClientDeviceType, DatabaseTable, ProtocolKey, ResponseStatus
-from app.modules import db
+from app.config import ClientDeviceType, Configuration, DatabaseTable, \
+    ProtocolKey, ResponseStatus
+from app.modules import cache, db, worker
+from app.modules.cache import LRUCache
 from app.modules.user_client import UserClient
 from app.modules.user_os import UserOS
 
@@ -25,6 +32,301 @@ from app.modules.user_os import UserOS
 T = TypeVar("T", bound="UserAccountSession")
 
 
+class ARPTable:
+    """
+    Process-wide snapshot of the host's ARP table. Lookups are plain dict
+    reads; the snapshot is swapped out by a background job every
+    ARP_TABLE_REFRESH_INTERVAL seconds rather than reparsed per request.
+    """
+
+    def __init__(self) -> None:
+        self._job_pid: int = None
+        self._lock = threading.Lock()
+        self._table: dict[str, str] = None
+
+    def _ensure_refresh_job(self) -> None:
+        pid = os.getpid()
+
+        if self._job_pid == pid:
+            return
+
+        with self._lock:
+            if self._job_pid != pid:
+                # Threads don't survive fork(); each worker runs its own.
+                if self._table is None:
+                    self.refresh()
+
+                ARPTableRefreshJob(self).start()
+                self._job_pid = pid
+
+    def lookup(self,
+               ip_address: str) -> str:
+        self._ensure_refresh_job()
+
+        return self._table.get(ip_address)
+
+    def refresh(self) -> None:
+        try:
+            self._table = get_arp_table()
+        except Exception as e:
+            print(e)
+
+            if self._table is None:
+                self._table = {}
+
+
+class ARPTableRefreshJob(threading.Thread):
+    def __init__(self,
+                 arp_table: ARPTable) -> None:
+        super().__init__(daemon=True)
+        self.arp_table = arp_table
+
+    def refresh(self,
+                scheduled_task: sched.scheduler) -> None:
+        self.arp_table.refresh()
+
+        scheduled_task.enter(Configuration.ARP_TABLE_REFRESH_INTERVAL,
+                             1,
+                             self.refresh,
+                             (scheduled_task,))
+
+    def run(self) -> None:
+        refresh_scheduled_task = sched.scheduler(time.time, time.sleep)
+
+        refresh_scheduled_task.enter(Configuration.ARP_TABLE_REFRESH_INTERVAL,
+                                     1,
+                                     self.refresh,
+                                     (refresh_scheduled_task,))
+        refresh_scheduled_task.run()
+
+
+class GeoIPDatabase:
+    """
+    Keeps the GeoLite2 database open (it's memory-mapped, so its pages are
+    shared by every worker through the page cache) instead of opening it
+    per lookup, and reopens it when the file on disk is replaced. Recent
+    IP to country lookups are kept in a small LRU cache.
+    """
+
+    _MISSING = object()
+
+    def __init__(self,
+                 path: str) -> None:
+        self.path = path
+        self._checked_at: float = 0
+        self._db = None
+        self._lock = threading.Lock()
+        self._lookups = LRUCache(max_size=Configuration.GEOIP_CACHE_MAX_SIZE)
+        self._signature: tuple = None
+
+    def _reload_if_changed(self) -> None:
+        now = time.monotonic()
+
+        if self._db is not None and \
+                now - self._checked_at < Configuration.GEOIP_RELOAD_CHECK_INTERVAL:
+            return
+
+        with self._lock:
+            if self._db is not None and \
+                    now - self._checked_at < Configuration.GEOIP_RELOAD_CHECK_INTERVAL:
+                return
+
+            self._checked_at = now
+            stat = os.stat(self.path)
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+            if signature != self._signature:
+                # The old database isn't closed explicitly: a concurrent
+                # lookup may still be reading from it. It's unmapped once
+                # it's no longer referenced.
+                self._db = open_database(self.path)
+                self._signature = signature
+                self._lookups.clear()
+
+    def lookup_country(self,
+                       ip_address: str) -> str:
+        ret = self._lookups.get(ip_address, self._MISSING)
+
+        if ret is not self._MISSING:
+            return ret
+
+        ret = None
+        self._reload_if_changed()
+        match = self._db.lookup(ip_address)
+
+        if match:
+            ret = match.country
+
+        self._lookups.set(ip_address, ret)
+
+        return ret
+
+
+class SessionActivityBuffer:
+    """
+    Write-behind buffer for session activity. Only the latest activity
+    per session is kept and flush() writes everything out in at most two
+    batched UPDATEs: one that only bumps last_activity and one for
+    sessions whose metadata (IP, location, client, etc.) actually changed
+    since it was last read or written.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pending: dict[str, tuple[datetime, tuple]] = {}
+        # Metadata as last seen in the database, per session.
+        self._persisted = LRUCache(max_size=Configuration.SESSION_CACHE_MAX_SIZE)
+
+    def discard(self,
+                session_id: str) -> None:
+        with self._lock:
+            self._pending.pop(session_id, None)
+
+        self._persisted.delete(session_id)
+
+    def flush(self) -> None:
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+
+        if not pending:
+            return
+
+        activity_rows = []
+        metadata_rows = []
+
+        for session_id, (last_activity, metadata) in pending.items():
+            if self._persisted.get(session_id) == metadata:
+                activity_rows.append((session_id, last_activity))
+            else:
+                metadata_rows.append((session_id, last_activity) + metadata)
+
+        conn = None
+        cursor = None
+
+        try:
+            conn = db.connect()
+            cursor = conn.cursor()
+
+            if activity_rows:
+                execute_values(
+                    cursor,
+                    f"""
+                    UPDATE {DatabaseTable.USER_ACCOUNT_SESSION} AS s
+                    SET {ProtocolKey.LAST_ACTIVITY} = v.{ProtocolKey.LAST_ACTIVITY}
+                    FROM (VALUES %s) AS v({ProtocolKey.ID}, {ProtocolKey.LAST_ACTIVITY})
+                    WHERE s.{ProtocolKey.ID} = v.{ProtocolKey.ID};
+                    """,
+                    activity_rows,
+                    template="(%s, %s::timestamp)"
+                )
+
+            if metadata_rows:
+                execute_values(
+                    cursor,
+                    f"""
+                    UPDATE {DatabaseTable.USER_ACCOUNT_SESSION} AS s
+                    SET {ProtocolKey.LAST_ACTIVITY} = v.{ProtocolKey.LAST_ACTIVITY},
+                      {ProtocolKey.IP_ADDRESS} = v.{ProtocolKey.IP_ADDRESS},
+                      {ProtocolKey.MAC_ADDRESS} = v.{ProtocolKey.MAC_ADDRESS},
+                      {ProtocolKey.DEVICE_TYPE} = v.{ProtocolKey.DEVICE_TYPE},
+                      {ProtocolKey.DEVICE_NAME} = v.{ProtocolKey.DEVICE_NAME},
+                      {ProtocolKey.CLIENT_ID} = v.{ProtocolKey.CLIENT_ID},
+                      {ProtocolKey.CLIENT_VERSION} = v.{ProtocolKey.CLIENT_VERSION},
+                      {ProtocolKey.MOBILE_CARRIER} = v.{ProtocolKey.MOBILE_CARRIER},
+                      {ProtocolKey.LOCATION} = v.{ProtocolKey.LOCATION},
+                      {ProtocolKey.TIME_ZONE} = v.{ProtocolKey.TIME_ZONE},
+                      {ProtocolKey.SCREEN_RESOLUTION} = v.{ProtocolKey.SCREEN_RESOLUTION},
+                      {ProtocolKey.OS_ID} = v.{ProtocolKey.OS_ID},
+                      {ProtocolKey.OS_VERSION} = v.{ProtocolKey.OS_VERSION}
+                    FROM (VALUES %s) AS v({ProtocolKey.ID}, {ProtocolKey.LAST_ACTIVITY}, {ProtocolKey.IP_ADDRESS},
+                      {ProtocolKey.MAC_ADDRESS}, {ProtocolKey.DEVICE_TYPE}, {ProtocolKey.DEVICE_NAME},
+                      {ProtocolKey.CLIENT_ID}, {ProtocolKey.CLIENT_VERSION}, {ProtocolKey.MOBILE_CARRIER},
+                      {ProtocolKey.LOCATION}, {ProtocolKey.TIME_ZONE}, {ProtocolKey.SCREEN_RESOLUTION},
+                      {ProtocolKey.OS_ID}, {ProtocolKey.OS_VERSION})
+                    WHERE s.{ProtocolKey.ID} = v.{ProtocolKey.ID};
+                    """,
+                    metadata_rows,
+                    template="(%s, %s::timestamp, %s::inet, %s::macaddr, %s::smallint, %s, %s, %s, %s, %s, %s, %s, %s::smallint, %s)"
+                )
+
+            conn.commit()
+
+            for row in metadata_rows:
+                self._persisted.set(row[0], row[2:])
+        except Exception as e:
+            print(e)
+
+            # Put back whatever hasn't been superseded in the meantime so
+            # it goes out with the next flush.
+            with self._lock:
+                for session_id, activity in pending.items():
+                    self._pending.setdefault(session_id, activity)
+        finally:
+            if cursor:
+                cursor.close()
+
+            if conn:
+                conn.close()
+
+    def record(self,
+               session: "UserAccountSession") -> None:
+        with self._lock:
+            self._pending[session.id] = (session.last_activity, session.metadata())
+
+        _get_activity_flush_job()
+
+    def seed(self,
+             session: "UserAccountSession",
+             replace: bool = False) -> None:
+        """
+        Remembers the metadata of a session as stored in the database.
+        Unless replace is set, metadata that's already known wins since
+        it may be newer than what was just read.
+        """
+
+        if replace or self._persisted.get(session.id) is None:
+            self._persisted.set(session.id, session.metadata())
+
+
+class SessionActivityFlushJob(threading.Thread):
+    def __init__(self) -> None:
+        super().__init__(daemon=True)
+
+    def flush(self,
+              scheduled_task: sched.scheduler) -> None:
+        try:
+            session_activity_buffer.flush()
+        except Exception as e:
+            print(e)
+
+        scheduled_task.enter(Configuration.SESSION_ACTIVITY_FLUSH_INTERVAL,
+                             1,
+                             self.flush,
+                             (scheduled_task,))
+
+    def run(self) -> None:
+        flush_scheduled_task = sched.scheduler(time.time, time.sleep)
+
+        flush_scheduled_task.enter(Configuration.SESSION_ACTIVITY_FLUSH_INTERVAL,
+                                   1,
+                                   self.flush,
+                                   (flush_scheduled_task,))
+        flush_scheduled_task.run()
+
+
+class SessionCacheEntry:
+    """
+    What the session cache holds per session ID: the session itself and,
+    once something asked for it, the account it belongs to.
+    """
+
+    def __init__(self,
+                 session: "UserAccountSession") -> None:
+        self.account = None
+        self.session = session
+
+
 class UserAccountSession:
     def __init__(self,
                  data: dict) -> None:
@@ -223,6 +525,9 @@ class UserAccountSession:
             if conn:
                 conn.close()
 
+        session_activity_buffer.discard(self.id)
+        invalidate_session(self.id)
+
     @staticmethod
     def delete_all_for_account(user_account_id: int) -> None:
         if not isinstance(user_account_id, int):
@@ -254,6 +559,8 @@ class UserAccountSession:
             if conn:
                 conn.close()
 
+        invalidate_account(user_account_id)
+
     @classmethod
     def get_all_for_account(cls: Type[T],
                             user_account_id: int) -> list[T]:
@@ -300,6 +607,11 @@ class UserAccountSession:
         if not session_id:
             raise ValueError("Argument 'session_id' must be a non-empty string.")
 
+        entry: SessionCacheEntry = session_cache.get(session_id)
+
+        if entry:
+            return copy.deepcopy(entry.session)
+
         ret: Type[T] = None
         conn = None
         cursor = None
@@ -328,6 +640,10 @@ class UserAccountSession:
             if conn:
                 conn.close()
 
+        if ret:
+            session_activity_buffer.seed(ret)
+            session_cache.set(session_id, SessionCacheEntry(copy.deepcopy(ret)))
+
         return ret
 
     @staticmethod
@@ -342,41 +658,44 @@ class UserAccountSession:
 
     @staticmethod
     def session_exists(session_id: str) -> bool:
+        """
+        Answered from the session cache when possible.
+        """
+
         if not isinstance(session_id, str):
             raise TypeError(f"Argument 'session_id' must be of type str, not {type(session_id)}.")
 
         if not session_id:
             raise ValueError("Argument 'session_id' must be a non-empty string.")
 
-        ret = False
-        conn = None
-        cursor = None
+        if session_cache.get(session_id):
+            return True
 
-        try:
-            conn = db.connect()
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM {DatabaseTable.USER_ACCOUNT_SESSION}
-                WHERE {ProtocolKey.ID} = %s;
-                """,
-                (session_id,)
-            )
-            result = cursor.fetchone()
-            conn.commit()
+        return UserAccountSession.get_by_id(session_id) is not None
 
-            if result:
-                ret = True
-        except Exception as e:
-            print(e)
-        finally:
-            if cursor:
-                cursor.close()
+    def metadata(self) -> tuple:
+        """
+        The session's columns other than its IDs and timestamps, in the
+        order the activity buffer writes them.
+        """
 
-            if conn:
-                conn.close()
+        client_id = None
+        client_version = None
+        os_id = None
+        os_version = None
 
-        return ret
+        if self.client:
+            client_id = self.client.id
+            client_version = self.client.version
+
+        if self.os:
+            os_id = self.os.id
+            os_version = self.os.version
+
+        return (str(self.ip_address) if self.ip_address else None, self.mac_address, self.device_type.value,
+                self.device_name, client_id, client_version,
+                self.mobile_carrier, self.location, self.time_zone,
+                self.screen_resolution, os_id, os_version)
 
     def update(self) -> None:
         if not self.id or not self.user_account_id:
@@ -428,11 +747,109 @@ class UserAccountSession:
             if conn:
                 conn.close()
 
+        session_activity_buffer.seed(self, replace=True)
+        entry: SessionCacheEntry = session_cache.get(self.id)
+
+        if entry:
+            entry.session = copy.deepcopy(self)
+
 
 ####################
 # MODULE FUNCTIONS #
 ####################
 
+
+SESSION_CACHE_CHANNEL = "session_cache"
+arp_table = ARPTable()
+geoip_database = GeoIPDatabase(os.path.join(app.root_path, "db", "GeoLite2-Country.mmdb"))
+session_activity_buffer = SessionActivityBuffer()
+session_cache = LRUCache(max_size=Configuration.SESSION_CACHE_MAX_SIZE,
+                         ttl=Configuration.SESSION_CACHE_TTL)
+_activity_flush_job: SessionActivityFlushJob = None
+_activity_flush_job_lock = threading.Lock()
+_activity_flush_job_pid: int = None
+
+
+def _get_activity_flush_job() -> SessionActivityFlushJob:
+    """
+    Starts this process's flush job on first use. The buffer lives in
+    each worker, and threads don't survive fork(), so it can't be
+    started at import time in the master.
+    """
+
+    global _activity_flush_job, _activity_flush_job_pid
+
+    pid = os.getpid()
+
+    if _activity_flush_job is None or _activity_flush_job_pid != pid:
+        with _activity_flush_job_lock:
+            if _activity_flush_job is None or _activity_flush_job_pid != pid:
+                _activity_flush_job = SessionActivityFlushJob()
+                _activity_flush_job.start()
+                _activity_flush_job_pid = pid
+
+    return _activity_flush_job
+
+
+def _evict_account(user_account_id: int) -> None:
+    session_cache.delete_where(lambda _, entry: entry.session.user_account_id == user_account_id)
+
+
+def _on_session_cache_notification(payload: str) -> None:
+    if not payload:
+        # The listener reconnected and may have missed invalidations.
+        session_cache.clear()
+    elif payload.startswith("account:"):
+        _evict_account(int(payload.split(":", 1)[1]))
+    elif payload.startswith("session:"):
+        session_cache.delete(payload.split(":", 1)[1])
+
+
+cache.subscribe(SESSION_CACHE_CHANNEL, _on_session_cache_notification)
+# Don't lose buffered activity when a worker exits.
+worker.at_exit(session_activity_buffer.flush)
+
+
+def cache_account(session_id: str,
+                  account: Any) -> None:
+    """
+    Attaches a user account to the cached entry for session_id.
+    """
+
+    entry: SessionCacheEntry = session_cache.get(session_id)
+
+    if entry:
+        entry.account = copy.deepcopy(account)
+
+
+def get_cached_account(session_id: str) -> Any:
+    """
+    Returns a copy of the user account cached for session_id, if any.
+    """
+
+    entry: SessionCacheEntry = session_cache.get(session_id)
+
+    if entry and entry.account:
+        return copy.deepcopy(entry.account)
+
+    return None
+
+
+def invalidate_account(user_account_id: int) -> None:
+    """
+    Drops every cached session of a user account, in this worker and
+    all others.
+    """
+
+    _evict_account(user_account_id)
+    cache.publish(SESSION_CACHE_CHANNEL, f"account:{user_account_id}")
+
+
+def invalidate_session(session_id: str) -> None:
+    session_cache.delete(session_id)
+    cache.publish(SESSION_CACHE_CHANNEL, f"session:{session_id}")
+
+
 def create_session(client_id: str,
                    user_account_id: int) -> UserAccountSession:
     if not isinstance(client_id, str):
@@ -462,16 +879,7 @@ def determine_location(ip_address: str) -> str:
     if not ip_address:
         raise ValueError("Argument 'ip_address' must be a non-empty string")
 
-    ret: str = None
-    geoip_db_path = os.path.join(app.root_path, "db", "GeoLite2-Country.mmdb")
-
-    with open_database(geoip_db_path) as db:
-        match = db.lookup(ip_address)
-
-        if match:
-            ret = match.country
-
-    return ret
+    return geoip_database.lookup_country(ip_address)
 
 
 def determine_mac_address(ip_address: str) -> str:
@@ -484,13 +892,7 @@ def determine_mac_address(ip_address: str) -> str:
     :rtype: str
     """
 
-    ret: str = None
-    arp_table = get_arp_table()
-
-    if ip_address in arp_table:
-        ret = arp_table[ip_address]
-
-    return ret
+    return arp_table.lookup(ip_address)
 
 
 def get_arp_table_darwin() -> dict[str, str]:
@@ -561,7 +963,9 @@ def update_session() -> tuple[dict, ResponseStatus]:
         session = UserAccountSession.get_by_id(session_id)
         user_agent = user_agent_parser.Parse(request.user_agent.string)
 
-        if request.environ.get("HTTP_X_FORWARDED_FOR") is None:
+        behind_proxy = request.environ.get("HTTP_X_FORWARDED_FOR") is not None
+
+        if not behind_proxy:
             ip_address = request.environ["REMOTE_ADDR"]
         else:
             ip_address = request.remote_addr
@@ -570,7 +974,14 @@ def update_session() -> tuple[dict, ResponseStatus]:
         session.ip_address = ipaddress.ip_address(ip_address)
         session.last_activity = datetime.utcnow()
         session.location = determine_location(ip_address)
-        session.mac_address = determine_mac_address(ip_address)
+
+        # A forwarded client is never on our link so its MAC address can't
+        # be in the ARP table.
+        if behind_proxy and not Configuration.MAC_ADDRESS_LOOKUP_BEHIND_PROXY:
+            session.mac_address = None
+        else:
+            session.mac_address = determine_mac_address(ip_address)
+
         session.mobile_carrier = request.form.get(ProtocolKey.MOBILE_CARRIER)
 
         # client_name = user_agent["user_agent"]["family"]
@@ -599,7 +1010,13 @@ def update_session() -> tuple[dict, ResponseStatus]:
             if os_version:
                 session.os.version = os_version
 
-        session.update()
+        # Written out in batches by the activity buffer; see
+        # SESSION_ACTIVITY_FLUSH_INTERVAL.
+        session_activity_buffer.record(session)
+        entry: SessionCacheEntry = session_cache.get(session.id)
+
+        if entry:
+            entry.session = copy.deepcopy(session)
 
         response_status = ResponseStatus.OK
         response = {
@@ -333,6 +333,7 @@ def check_verification_code(phone_number_id: str,
                 if verification_code.creation_timestamp < datetime.utcnow() - timedelta(seconds=Configuration.USER_VERIFICATION_CODE_TTL):
                     # Code expired.
                     verification_code.delete()
+                    db.commit_on_client_error()
 
                     response_status = ResponseStatus.BAD_REQUEST
                     response = {
@@ -369,6 +370,8 @@ def check_verification_code(phone_number_id: str,
                 else:
                     # Incorrect code.
                     verification_code.increment_attempts()
+                    # The attempt has to count even though the request fails.
+                    db.commit_on_client_error()
 
                     if verification_code.attempts >= Configuration.USER_VERIFICATION_CODE_ATTEMPT_LIMIT:
                         response_status = ResponseStatus.TOO_MANY_REQUESTS
@@ -0,0 +1,62 @@
+import atexit
+from typing import Callable
+
+
+####################
+# MODULE FUNCTIONS #
+####################
+
+
+_at_exit: list[Callable[[], None]] = []
+_installed: set[str] = set()
+_post_fork: list[Callable[[], None]] = []
+
+
+def _install(name: str,
+             hooks: list[Callable[[], None]]) -> None:
+    """
+    Points uWSGI's hook called name at hooks. uWSGI keeps a single
+    function per hook, so whatever was set before (by a plugin, or code
+    outside this module) is kept and run first.
+    """
+
+    if name in _installed:
+        return
+
+    try:
+        import uwsgi
+    except ImportError:
+        return
+
+    previous = getattr(uwsgi, name, None)
+
+    def run_hooks() -> None:
+        for hook in ([previous] if previous else []) + hooks:
+            try:
+                hook()
+            except Exception as e:
+                print(e)
+
+    setattr(uwsgi, name, run_hooks)
+    _installed.add(name)
+
+
+def at_exit(hook: Callable[[], None]) -> None:
+    """
+    Runs hook when the worker exits. uWSGI doesn't always run Python's
+    atexit handlers, so hook is registered with both; it may run twice.
+    """
+
+    atexit.register(hook)
+    _at_exit.append(hook)
+    _install("atexit", _at_exit)
+
+
+def post_fork(hook: Callable[[], None]) -> None:
+    """
+    Runs hook in each uWSGI worker once it has been forked. Outside uWSGI
+    there's no fork, so hook isn't called.
+    """
+
+    _post_fork.append(hook)
+    _install("post_fork_hook", _post_fork)
@@ -98,6 +98,11 @@ def api_v1_get_brands() -> Response:
     return json.get_brands()
 
 
+@app.route("/api/v1/get-brands-by-tags", methods=["POST"])
+def api_v1_get_brands_by_tags() -> Response:
+    return json.get_brands_by_tags()
+
+
 @app.route("/api/v1/get-country-list", methods=["POST"])
 def api_v1_get_country_list() -> Response:
     return json.get_country_list()
@@ -138,11 +143,26 @@ def api_v1_get_products() -> Response:
     return json.get_products()
 
 
+@app.route("/api/v1/get-products-by-tags", methods=["POST"])
+def api_v1_get_products_by_tags() -> Response:
+    return json.get_products_by_tags()
+
+
+@app.route("/api/v1/get-stats", methods=["POST"])
+def api_v1_get_stats() -> Response:
+    return json.get_stats()
+
+
 @app.route("/api/v1/get-store", methods=["POST"])
 def api_v1_get_store() -> Response:
     return json.get_store()
 
 
+@app.route("/api/v1/get-store-map", methods=["POST"])
+def api_v1_get_store_map() -> Response:
+    return json.get_store_map()
+
+
 @app.route("/api/v1/get-store-product", methods=["POST"])
 def api_v1_get_store_product() -> Response:
     return json.get_store_product()
@@ -158,6 +178,11 @@ def api_v1_get_stores() -> Response:
     return json.get_stores()
 
 
+@app.route("/api/v1/get-suggestions", methods=["POST"])
+def api_v1_get_suggestions() -> Response:
+    return json.get_suggestions()
+
+
 @app.route("/api/v1/get-user-account", methods=["POST"])
 def api_v1_get_user_account() -> Response:
     return json.get_user_account()
@@ -228,6 +253,11 @@ def api_v1_report_user_account() -> Response:
     return json.report_user_account()
 
 
+@app.route("/api/v1/search", methods=["POST"])
+def api_v1_search() -> Response:
+    return json.search()
+
+
 @app.route("/api/v1/send-verification-code", methods=["POST"])
 def api_v1_send_verification_code() -> Response:
     return json.send_verification_code()
@@ -0,0 +1,77 @@
+import pytest
+from psycopg2 import extensions
+
+from app import app
+from app.modules import db
+
+
+class FakeCursor:
+    def __init__(self,
+                 conn: "FakeConnection") -> None:
+        self.closed = False
+        self.conn = conn
+
+    def close(self) -> None:
+        self.closed = True
+
+    def execute(self, query, vars=None) -> None:
+        self.conn.statements.append(" ".join(query.split()))
+
+    def executemany(self, query, vars_list) -> None:
+        self.conn.statements.append(" ".join(query.split()))
+
+
+class FakeInfo:
+    transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+
+
+class FakeConnection:
+    """
+    Stands in for a pooled psycopg2 connection, recording the statements
+    run on it and whether the transaction was committed or rolled back.
+    """
+
+    def __init__(self) -> None:
+        self.closed = 0
+        self.commits = 0
+        self.info = FakeInfo()
+        self.released = False
+        self.rollbacks = 0
+        self.statements: list[str] = []
+
+    def close(self) -> None:
+        self.released = True
+
+    def commit(self) -> None:
+        self.commits += 1
+
+    def cursor(self, *args, **kwargs) -> FakeCursor:
+        return FakeCursor(self)
+
+    def rollback(self) -> None:
+        self.rollbacks += 1
+
+
+class FakePool:
+    def __init__(self) -> None:
+        self.connections: list[FakeConnection] = []
+
+    def get(self) -> FakeConnection:
+        conn = FakeConnection()
+        self.connections.append(conn)
+
+        return conn
+
+
+@pytest.fixture
+def pool(monkeypatch) -> FakePool:
+    ret = FakePool()
+    monkeypatch.setattr(db, "_get_pool", lambda: ret)
+
+    return ret
+
+
+@pytest.fixture
+def request_context():
+    with app.test_request_context():
+        yield
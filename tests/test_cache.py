@@ -0,0 +1,156 @@
+import pytest
+
+from app.modules import cache
+
+
+class Loads:
+    """
+    A load function for an entity cache that counts its calls.
+    """
+
+    def __init__(self,
+                 **values) -> None:
+        self.calls = 0
+        self.values = values
+
+    def __call__(self, key):
+        self.calls += 1
+
+        return dict(self.values, id=key)
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(monkeypatch):
+    # No Redis: only the per-worker layer is under test.
+    monkeypatch.setattr(cache, "_get_redis", lambda: None)
+    monkeypatch.setattr(cache, "_entity_caches", {})
+    monkeypatch.setattr(cache, "_search_caches", {})
+
+
+def test_cached_entity_loads_once():
+    widgets = cache.entity_cache("widget", max_size=10, ttl=60)
+    load = Loads(name="Widget")
+
+    widgets.get(1, load)
+    widgets.get(1, load)
+
+    assert load.calls == 1
+
+
+def test_cached_entity_is_a_copy():
+    widgets = cache.entity_cache("widget", max_size=10, ttl=60)
+    load = Loads(name="Widget")
+
+    widgets.get(1, load)["name"] = "Changed"
+
+    assert widgets.get(1, load)["name"] == "Widget"
+
+
+def test_notification_drops_entity():
+    widgets = cache.entity_cache("widget", max_size=10, ttl=60)
+    load = Loads(name="Widget")
+    widgets.get(1, load)
+    widgets.get(2, load)
+
+    cache._on_entity_cache_notification("widget:1")
+    widgets.get(1, load)
+    widgets.get(2, load)
+
+    assert load.calls == 3
+
+
+def test_notification_drops_entities_embedding_it():
+    cache.entity_cache("widget", max_size=10, ttl=60)
+    gadgets = cache.entity_cache("gadget", max_size=10, ttl=60, dependencies={
+        "widget": lambda gadget, widget_id: gadget["widget_id"] == widget_id
+    })
+    load = Loads(widget_id=1)
+    gadgets.get(5, load)
+
+    cache._on_entity_cache_notification("widget:1")
+    gadgets.get(5, load)
+
+    assert load.calls == 2
+
+
+def test_notification_for_unrelated_entity_keeps_cache():
+    cache.entity_cache("widget", max_size=10, ttl=60)
+    gadgets = cache.entity_cache("gadget", max_size=10, ttl=60, dependencies={
+        "widget": lambda gadget, widget_id: gadget["widget_id"] == widget_id
+    })
+    load = Loads(widget_id=1)
+    gadgets.get(5, load)
+
+    cache._on_entity_cache_notification("widget:2")
+    gadgets.get(5, load)
+
+    assert load.calls == 1
+
+
+def test_notification_clears_dependent_searches():
+    searches = cache.search_cache("widget_search", frozenset({"widget"}))
+    other_searches = cache.search_cache("gadget_search", frozenset({"gadget"}))
+    searches.get("query", lambda: ({}, None))
+    other_searches.get("query", lambda: ({}, None))
+
+    cache._on_entity_cache_notification("widget:1")
+
+    assert searches.stats()["size"] == 0
+    assert other_searches.stats()["size"] == 1
+
+
+def test_reconnect_clears_everything():
+    widgets = cache.entity_cache("widget", max_size=10, ttl=60)
+    load = Loads(name="Widget")
+    widgets.get(1, load)
+
+    # The listener passes None after reconnecting, since notifications
+    # may have been missed in the meantime.
+    cache._on_entity_cache_notification(None)
+    widgets.get(1, load)
+
+    assert load.calls == 2
+
+
+def test_listener_hands_payload_to_channel_subscribers():
+    listener = cache.InvalidationListener()
+    received = []
+    listener.subscribe("widgets", received.append)
+    listener.subscribe("gadgets", lambda payload: received.append(("gadgets", payload)))
+
+    listener._dispatch("widgets", "widget:1")
+
+    assert received == ["widget:1"]
+
+
+def test_listener_keeps_dispatching_after_failing_callback():
+    listener = cache.InvalidationListener()
+    received = []
+    listener.subscribe("widgets", lambda payload: 1 / 0)
+    listener.subscribe("widgets", received.append)
+
+    listener._dispatch("widgets", "widget:1")
+
+    assert received == ["widget:1"]
+
+
+def test_invalidation_notifies_through_request_transaction(pool, request_context):
+    widgets = cache.entity_cache("widget", max_size=10, ttl=60)
+
+    widgets.invalidate(1)
+
+    # pg_notify is transactional, so other workers hear about it only once
+    # the request commits.
+    assert pool.connections[0].statements[-1].endswith("SELECT pg_notify(%s, %s);")
+    assert pool.connections[0].commits == 0
+
+
+def test_invalidated_entity_bypasses_cache_until_commit(pool, request_context):
+    widgets = cache.entity_cache("widget", max_size=10, ttl=60)
+    load = Loads(name="Widget")
+
+    widgets.invalidate(1)
+    widgets.get(1, load)
+    widgets.get(1, load)
+
+    assert load.calls == 2
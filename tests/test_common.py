@@ -0,0 +1,85 @@
+import base64
+import json
+
+import pytest
+
+from app.config import ProtocolKey, ResponseStatus
+from app.modules.common import Common, invalid_cursor
+
+
+def _raw_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+@pytest.mark.parametrize("values, types", [
+    (["Acme", 42], (str, int)),
+    ([0.0607927, 17], ((float, int), int)),
+    ([1, 17], ((float, int), int)),
+    (["", "Éclair ☕", 3], (str, str, int)),
+    ([9], (int,))
+])
+def test_cursor_round_trip(values, types):
+    assert Common.decode_cursor(Common.encode_cursor(values), types) == values
+
+
+def test_cursor_is_url_safe():
+    cursor = Common.encode_cursor(["??>>", 1])
+
+    assert "=" not in cursor
+    assert "+" not in cursor
+    assert "/" not in cursor
+
+
+@pytest.mark.parametrize("cursor", [None, ""])
+def test_missing_cursor_is_first_page(cursor):
+    assert Common.decode_cursor(cursor, (str, int)) is None
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    "%%%%",
+    base64.urlsafe_b64encode(b"{not json").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+    _raw_cursor({"name": "Acme", "id": 42}),
+    _raw_cursor("Acme"),
+    _raw_cursor([]),
+    _raw_cursor(["Acme"]),
+    _raw_cursor(["Acme", 42, 7]),
+    _raw_cursor(["Acme", "42"]),
+    _raw_cursor(["Acme", True]),
+    _raw_cursor([None, 42])
+])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        Common.decode_cursor(cursor, (str, int))
+
+
+def test_cursor_from_another_listing_is_rejected():
+    # A search cursor (rank, ID) handed to the by-name listing.
+    cursor = Common.encode_cursor([0.5, 42])
+
+    with pytest.raises(ValueError):
+        Common.decode_cursor(cursor, (str, int))
+
+
+def test_paginate_returns_cursor_for_last_row_shown():
+    rows = [{"id": 1}, {"id": 2}, {"id": 3}]
+    results, next_cursor = Common.paginate(rows, 2, lambda row: [row["id"]])
+
+    assert results == rows[:2]
+    assert Common.decode_cursor(next_cursor, (int,)) == [2]
+
+
+def test_paginate_last_page_has_no_cursor():
+    rows = [{"id": 1}, {"id": 2}]
+    results, next_cursor = Common.paginate(rows, 2, lambda row: [row["id"]])
+
+    assert results == rows
+    assert next_cursor is None
+
+
+def test_invalid_cursor_response():
+    response, response_status = invalid_cursor()
+
+    assert response_status == ResponseStatus.BAD_REQUEST
+    assert response[ProtocolKey.ERROR][ProtocolKey.ERROR_CODE] == ResponseStatus.BAD_REQUEST.value
@@ -0,0 +1,140 @@
+from flask import Response
+from psycopg2 import extensions
+
+from app.modules import db
+
+
+def _execute(conn, query: str) -> None:
+    cursor = conn.cursor()
+    cursor.execute(query)
+    cursor.close()
+
+
+def test_request_shares_one_connection(pool, request_context):
+    first = db.connect()
+    second = db.connect()
+    _execute(first, "SELECT 1;")
+    _execute(second, "SELECT 2;")
+
+    assert len(pool.connections) == 1
+
+
+def test_savepoint_rides_along_with_first_statement(pool, request_context):
+    conn = db.connect()
+    _execute(conn, "SELECT 1;")
+    _execute(conn, "SELECT 2;")
+
+    assert pool.connections[0].statements == [
+        "SAVEPOINT sp_1; SELECT 1;",
+        "SELECT 2;"
+    ]
+
+
+def test_commit_and_close_leave_transaction_open(pool, request_context):
+    conn = db.connect()
+    _execute(conn, "SELECT 1;")
+    conn.commit()
+    conn.close()
+
+    assert pool.connections[0].commits == 0
+    assert not pool.connections[0].released
+
+
+def test_closed_savepoint_released_with_next_statement(pool, request_context):
+    conn = db.connect()
+    _execute(conn, "SELECT 1;")
+    conn.close()
+    _execute(db.connect(), "SELECT 2;")
+
+    assert pool.connections[0].statements[-1] == "RELEASE SAVEPOINT sp_1; SAVEPOINT sp_2; SELECT 2;"
+
+
+def test_savepoint_outlives_views_opened_after_it(pool, request_context):
+    outer = db.connect()
+    _execute(outer, "SELECT 1;")
+    inner = db.connect()
+    _execute(inner, "SELECT 2;")
+
+    # Releasing sp_1 would release sp_2 as well while inner still uses it.
+    outer.close()
+    _execute(inner, "SELECT 3;")
+
+    inner.close()
+    _execute(db.connect(), "SELECT 4;")
+
+    assert pool.connections[0].statements == [
+        "SAVEPOINT sp_1; SELECT 1;",
+        "SAVEPOINT sp_2; SELECT 2;",
+        "SELECT 3;",
+        "RELEASE SAVEPOINT sp_1; SAVEPOINT sp_3; SELECT 4;"
+    ]
+
+
+def test_failed_view_rolls_back_to_its_savepoint(pool, request_context):
+    conn = db.connect()
+    _execute(conn, "SELECT 1;")
+    pool.connections[0].info.transaction_status = extensions.TRANSACTION_STATUS_INERROR
+    conn.close()
+
+    assert pool.connections[0].statements[-1] == "ROLLBACK TO SAVEPOINT sp_1;"
+
+
+def test_success_commits_then_runs_callbacks(pool, request_context):
+    ran = []
+    _execute(db.connect(), "SELECT 1;")
+    db.after_commit(lambda: ran.append(pool.connections[0].commits))
+
+    db.end_request_transaction(Response(status=200))
+
+    assert pool.connections[0].commits == 1
+    assert pool.connections[0].rollbacks == 0
+    assert pool.connections[0].released
+    assert ran == [1]
+
+
+def test_client_error_rolls_back(pool, request_context):
+    ran = []
+    _execute(db.connect(), "SELECT 1;")
+    db.after_commit(lambda: ran.append(True))
+
+    db.end_request_transaction(Response(status=400))
+
+    assert pool.connections[0].commits == 0
+    assert pool.connections[0].rollbacks == 1
+    assert ran == []
+
+
+def test_client_error_commits_when_asked(pool, request_context):
+    _execute(db.connect(), "SELECT 1;")
+    db.commit_on_client_error()
+
+    db.end_request_transaction(Response(status=400))
+
+    assert pool.connections[0].commits == 1
+    assert pool.connections[0].rollbacks == 0
+
+
+def test_server_error_rolls_back_even_when_asked_to_commit(pool, request_context):
+    _execute(db.connect(), "SELECT 1;")
+    db.commit_on_client_error()
+
+    db.end_request_transaction(Response(status=500))
+
+    assert pool.connections[0].commits == 0
+    assert pool.connections[0].rollbacks == 1
+
+
+def test_failed_handler_rolls_back(pool, request_context):
+    _execute(db.connect(), "SELECT 1;")
+
+    db.release_request_connection(RuntimeError())
+
+    assert pool.connections[0].rollbacks == 1
+    assert pool.connections[0].released
+
+
+def test_after_commit_runs_at_once_outside_a_transaction(pool, request_context):
+    ran = []
+    db.after_commit(lambda: ran.append(True))
+
+    assert ran == [True]